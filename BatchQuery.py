@@ -0,0 +1,149 @@
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import numpy as np
+from QueryRuntime import normalize_query, compute_cosine_similarity
+from BinaryIndex import BinaryIndexReader
+from Metrics import METRICS
+
+BATCH_SIZE = 2000  # queries scored per batch; bounds the number of postings lists held at once
+TERM_BATCH_SIZE = 500  # tokens per IN (...) lookup, below SQLite's bound parameter limit
+
+#returns {term: [(doc_id, nweight)]} reading each postings list once
+#index.db is read with one scan per TERM_BATCH_SIZE terms instead of one query per term; rows come back in
+#rowid order like the single-term query, so scores are summed in the same order as compute_cosine_similarity
+def fetch_postings_batch(conn, terms):
+    postings = {term: [] for term in terms}
+    if hasattr(conn, 'postings'):
+        for term in terms:
+            postings[term] = conn.postings(term)
+        return postings
+
+    c = conn.cursor()
+    terms = list(terms)
+    for i in range(0, len(terms), TERM_BATCH_SIZE):
+        batch = terms[i:i + TERM_BATCH_SIZE]
+        c.execute(f'SELECT token, doc_id, nweight FROM final_postings WHERE token IN ({", ".join("?" * len(batch))}) '
+                  f'ORDER BY rowid', batch)
+        for token, doc_id, nweight in c:
+            postings[token].append((doc_id, nweight))
+    return postings
+
+#converts the postings lists to (doc index array, weight array) pairs over one shared doc numbering
+#doc indexes follow doc_id order, so ordering by index breaks score ties the same way as the single-query path
+def postings_arrays(postings):
+    doc_keys = sorted({doc_id for rows in postings.values() for doc_id, _ in rows})
+    doc_index = {doc_id: i for i, doc_id in enumerate(doc_keys)}
+    arrays = {}
+    for term, rows in postings.items():
+        arrays[term] = (np.fromiter((doc_index[doc_id] for doc_id, _ in rows), dtype=np.int64, count=len(rows)),
+                        np.fromiter((weight for _, weight in rows), dtype=np.float64, count=len(rows)))
+    return doc_keys, arrays
+
+#returns the positions of the k best scores ordered by (-score, doc index)
+#every score tied with the k-th one is kept until the final sort, so ties at the cut are broken by doc_id
+def top_k_positions(docs, scores, k):
+    if len(docs) > k:
+        kth = np.partition(-scores, k - 1)[k - 1]
+        keep = np.flatnonzero(-scores <= kth)
+        order = np.lexsort((docs[keep], -scores[keep]))[:k]
+        return keep[order]
+    return np.lexsort((docs, -scores))[:k]
+
+#scores the normalized queries of one batch
+def score_batch(conn, query_terms_list, k):
+    METRICS.count("queries", len(query_terms_list))
+    unique_terms = sorted({term for query_terms in query_terms_list for term in query_terms})
+    with METRICS.timer("query_fetch"):
+        doc_keys, arrays = postings_arrays(fetch_postings_batch(conn, unique_terms))
+    with METRICS.timer("query_score"):
+        return [score_query(arrays, doc_keys, query_terms, k) for query_terms in query_terms_list]
+
+#scores one query of a batch; doc_keys maps the doc indexes of arrays back to doc ids
+def score_query(arrays, doc_keys, query_terms, k):
+    parts = [arrays[term] for term in query_terms if len(arrays[term][0])]
+    if not parts:
+        return [], 0, True
+    docs = np.concatenate([part[0] for part in parts])
+    weights = np.concatenate([part[1] for part in parts])
+    #scatter-add into a dense score vector; bincount adds in array order, i.e. query term order then row order
+    scores = np.bincount(docs, weights=weights, minlength=len(doc_keys))
+    matched = np.unique(docs)
+    matched_scores = scores[matched]
+    top = top_k_positions(matched, matched_scores, max(k, 0))
+    return ([(doc_keys[doc], float(score)) for doc, score in zip(matched[top], matched_scores[top])],
+            len(matched), True)
+
+#scores lists of already normalized query terms, BATCH_SIZE lists at a time
+def batch_search_terms(conn, query_terms_list, k=20, batch_size=BATCH_SIZE):
+    results = []
+    for i in range(0, len(query_terms_list), batch_size):
+        results.extend(score_batch(conn, query_terms_list[i:i + batch_size], k))
+    return results
+
+#batch version of top_k_cosine_similarity: returns one (top k [(doc_id, score)], total matches, True) per query
+#queries are normalized once, the terms of each BATCH_SIZE queries are deduplicated and fetched once, and
+#scoring uses NumPy instead of per-posting Python loops; results equal compute_cosine_similarity(conn, query)[:k]
+#conn is an index.db connection or an object with a postings(term) method (BinaryIndexReader, QueryEngine)
+def batch_search(conn, queries, k=20, batch_size=BATCH_SIZE):
+    normalized = {}
+    for query in queries:
+        if query not in normalized:
+            normalized[query] = normalize_query(query)
+    return batch_search_terms(conn, [normalized[query] for query in queries], k, batch_size)
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as query_file:
+        return [line.strip() for line in query_file if line.strip()]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Runs a query log through the batch query path.")
+    parser.add_argument("queries", help="query log, one query per line")
+    parser.add_argument("--index", default="index.db", help="path to index.db")
+    parser.add_argument("--binary-index", help="read postings from index.bin instead of index.db")
+    parser.add_argument("-k", type=int, default=20, help="results per query")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--compare", type=int, default=0, metavar="N",
+                        help="also run the first N queries through compute_cosine_similarity, check that the "
+                             "results match and report its throughput")
+    parser.add_argument("--output", help="write one json line of results per query to this file")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    queries = read_queries(args.queries)
+    conn = sqlite3.connect(args.index)
+    source = BinaryIndexReader(args.binary_index) if args.binary_index else conn
+
+    start = time.perf_counter()
+    results = batch_search(source, queries, args.k, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"Batch: {len(queries)} queries in {elapsed:.2f} s ({len(queries) / elapsed:.1f} queries/s)")
+
+    if args.compare:
+        sample = queries[:args.compare]
+        mismatches = 0
+        start = time.perf_counter()
+        for query, (batch_results, total_matches, _) in zip(sample, results):
+            single = compute_cosine_similarity(source, query)
+            if single[:args.k] != batch_results or len(single) != total_matches:
+                mismatches += 1
+        elapsed = time.perf_counter() - start
+        print(f"Single: {len(sample)} queries in {elapsed:.2f} s ({len(sample) / elapsed:.1f} queries/s)")
+        print(f"Mismatched queries: {mismatches}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            for query, (batch_results, total_matches, _) in zip(queries, results):
+                output_file.write(json.dumps({"query": query, "total_matches": total_matches,
+                                              "results": batch_results}) + "\n")
+    if args.binary_index:
+        source.close()
+    conn.close()
+    if args.compare and mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import itertools
+import contextlib
+import tracemalloc
+from CreateInvertedIndex import (iter_document_paths, get_tokenizer, create_document_postings, calculate_tf,
+                                 setup_database, number_documents, number_postings, write_documents, store_tokens,
+                                 calculate_weight, normalize_weight, write_term_stats, compute_cosine_similarity,
+                                 IndexStatistics, TOKENIZERS)
+from BinaryIndex import has_dbstat
+from DocumentTable import write_document_table
+from CorpusSources import DirectorySource
+
+#resource is not available on Windows; peak RSS is left out of the results there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARK_VERSION = 1
+FILES_PER_FOLDER = 500  # the same layout as WEBPAGES_RAW
+ZIPF_EXPONENT = 1.07
+SYLLABLES = ["an", "ka", "to", "ri", "mo", "sel", "den", "vo", "lu", "pra", "gi", "ne", "sto", "bar", "qui", "el"]
+HIGH_FREQUENCY_TERMS = 50  # the high-frequency mix draws from this many of the most common terms
+REGRESSION_THRESHOLD = 0.10
+
+#returns vocabulary_size distinct made-up words in a seeded random order, so a word's Zipf rank does not
+#depend on its spelling
+def make_vocabulary(rng, vocabulary_size):
+    words = []
+    length = 1
+    while len(words) < vocabulary_size:
+        length += 1
+        for combination in itertools.product(SYLLABLES, repeat=length):
+            words.append("".join(combination))
+            if len(words) == vocabulary_size:
+                break
+    rng.shuffle(words)
+    return words
+
+#draws words from a Zipfian distribution over a fixed vocabulary
+class ZipfSampler:
+
+    def __init__(self, rng, vocabulary):
+        self.rng = rng
+        self.vocabulary = vocabulary
+        self.cumulative_weights = list(itertools.accumulate(1 / (rank ** ZIPF_EXPONENT)
+                                                            for rank in range(1, len(vocabulary) + 1)))
+
+    def words(self, count):
+        return self.rng.choices(self.vocabulary, cum_weights=self.cumulative_weights, k=count)
+
+    def text(self, count):
+        return " ".join(self.words(count))
+
+#builds the html of one synthetic page: title and meta description (L1/meta), headings, paragraphs with
+#bold/italic/emphasized words (L2), lists, anchors to other pages and the odd script block
+def make_page(rng, sampler, urls):
+    title = sampler.text(rng.randint(2, 8))
+    parts = [f'<html><head><title>{title}</title>',
+             f'<meta name="description" content="{sampler.text(rng.randint(8, 20))}">']
+    if rng.random() < 0.3:
+        parts.append(f'<script>var {sampler.words(1)[0]} = {rng.randint(0, 1000)};</script>')
+    parts.append(f'</head><body><h1>{title}</h1>')
+
+    for _ in range(max(1, int(rng.lognormvariate(1.2, 0.6)))):
+        if rng.random() < 0.5:
+            heading = f'h{rng.randint(2, 4)}'
+            parts.append(f'<{heading}>{sampler.text(rng.randint(2, 6))}</{heading}>')
+        for _ in range(rng.randint(1, 4)):
+            words = sampler.words(rng.randint(20, 120))
+            for i in range(len(words)):
+                roll = rng.random()
+                if roll < 0.03:
+                    words[i] = f'<b>{words[i]}</b>'
+                elif roll < 0.05:
+                    tag = rng.choice(["i", "em", "u", "mark"])
+                    words[i] = f'<{tag}>{words[i]}</{tag}>'
+                elif roll < 0.06 and urls:
+                    words[i] = f'<a href="{rng.choice(urls)}">{words[i]} {sampler.words(1)[0]}</a>'
+            parts.append(f'<p>{" ".join(words)}</p>')
+        if rng.random() < 0.2:
+            items = "".join(f'<li>{sampler.text(rng.randint(1, 5))}</li>' for _ in range(rng.randint(2, 6)))
+            parts.append(f'<ul>{items}</ul>')
+    parts.append('</body></html>')
+    return "".join(parts)
+
+#writes a seeded synthetic WEBPAGES_RAW tree (numbered subfolders of pages plus bookkeeping.json) to directory
+#the same seed and sizes always produce the same corpus
+def generate_corpus(directory, documents, seed=0, vocabulary_size=5000):
+    rng = random.Random(seed)
+    sampler = ZipfSampler(rng, make_vocabulary(rng, vocabulary_size))
+    doc_ids = [f"{i // FILES_PER_FOLDER}/{i % FILES_PER_FOLDER}" for i in range(documents)]
+    bookkeeping_data = {doc_id: f"www.{sampler.words(1)[0]}.example.com/{doc_id.replace('/', '-')}"
+                        for doc_id in doc_ids}
+    urls = list(bookkeeping_data.values())
+
+    for generated, doc_id in enumerate(doc_ids):
+        folder, name = doc_id.split("/")
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+        with open(os.path.join(directory, folder, name), 'w', encoding='utf-8') as page_file:
+            page_file.write(make_page(rng, sampler, urls))
+        if generated % 100 == 0:
+            print(f"\rGenerated: {generated}", end="", flush=True)
+
+    with open(os.path.join(directory, "bookkeeping.json"), 'w') as bookkeeping:
+        json.dump(bookkeeping_data, bookkeeping)
+    print(f"\rGenerated {documents} documents in {directory}")
+    return directory
+
+#peak resident set size of this process in kb so far, or None where resource is unavailable
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #macOS reports bytes, Linux kb
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+#times one stage and records throughput and memory
+#with trace_memory, the peak python heap of the stage is also recorded (tracemalloc slows every stage down)
+class StageTimer:
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, documents):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        #the indexing functions report their progress with prints, which would only add noise here
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        self.record(name, time.perf_counter() - start, documents)
+
+    def record(self, name, seconds, documents):
+        result = {"seconds": seconds, "docs_per_sec": documents / seconds if seconds else None,
+                  "peak_rss_kb": peak_rss_kb()}
+        if self.trace_memory:
+            result["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        self.stages[name] = result
+        print(f"{name:>16}: {seconds:8.2f} s | {result['docs_per_sec'] or 0:9.1f} docs/s")
+
+#builds index.db in work_directory with the sql or vectorized build and returns the per-stage results
+#the per-document stages are timed document by document, so tokenize, postings and store are measured on
+#exactly the same work without holding the whole corpus in memory
+def benchmark_indexing(webpages_raw_directory, work_directory, tokenizer=TOKENIZERS[0], trace_memory=False,
+                       build="sql"):
+    db_path = os.path.join(work_directory, "index.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = setup_database(db_path)
+    bookkeeping = open(os.path.join(webpages_raw_directory, "bookkeeping.json"), 'r')
+    bookkeeping_data = json.load(bookkeeping)
+    bookkeeping.close()
+    doc_numbers = number_documents(DirectorySource(webpages_raw_directory), bookkeeping_data)
+    write_documents(conn, doc_numbers, bookkeeping_data)
+
+    if trace_memory:
+        tracemalloc.start()
+    timer = StageTimer(trace_memory)
+    tokenize = get_tokenizer(tokenizer)
+    stats = IndexStatistics()
+    if build == "vectorized":
+        from SparseIndexer import SparseInverter
+        inverter = SparseInverter()
+        store = inverter.add_document
+    else:
+        store = lambda postings_dict: store_tokens(conn, postings_dict)
+    stage_seconds = {"tokenize": 0.0, "postings": 0.0, "store_tokens": 0.0}
+    corpus_bytes = 0
+    documents = 0
+    for file_path in iter_document_paths(webpages_raw_directory):
+        corpus_bytes += os.path.getsize(file_path)
+        start = time.perf_counter()
+        token_DocID_list = tokenize(file_path, bookkeeping_data, {})
+        tokenized = time.perf_counter()
+        postings_dict = number_postings(calculate_tf(create_document_postings(token_DocID_list)), doc_numbers)
+        posted = time.perf_counter()
+        store(postings_dict)
+        stored = time.perf_counter()
+
+        stage_seconds["tokenize"] += tokenized - start
+        stage_seconds["postings"] += posted - tokenized
+        stage_seconds["store_tokens"] += stored - posted
+        stats.add_document(postings_dict, len(token_DocID_list) > 0)
+        documents += 1
+        if documents % 100 == 0:
+            print(f"\rFiles Read: {documents}", end="", flush=True)
+    print()
+    for name, seconds in stage_seconds.items():
+        timer.record(name, seconds, documents)
+
+    if build == "vectorized":
+        with timer.stage("sparse_weight", documents):
+            inverter.merge(conn, stats.valid_documents)
+    else:
+        with timer.stage("calculate_weight", documents):
+            calculate_weight(conn, stats.valid_documents, stats.unique_words)
+        with timer.stage("normalize_weight", documents):
+            normalize_weight(conn)
+    with timer.stage("write_term_stats", documents):
+        write_term_stats(conn)
+    with timer.stage("document_table", documents):
+        write_document_table(conn)
+    if trace_memory:
+        tracemalloc.stop()
+
+    index = {"db_bytes": os.path.getsize(db_path), "tables": {}}
+    if has_dbstat(conn):
+        c = conn.cursor()
+        c.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+        index["tables"] = dict(c.fetchall())
+    conn.close()
+
+    total_seconds = sum(stage["seconds"] for stage in timer.stages.values())
+    return {"documents": documents, "valid_documents": stats.valid_documents,
+            "unique_words": len(stats.unique_words), "corpus_bytes": corpus_bytes,
+            "stages": timer.stages, "total_seconds": total_seconds,
+            "docs_per_sec": documents / total_seconds if total_seconds else None,
+            "peak_rss_kb": peak_rss_kb()}, index
+
+#returns {mix name: [queries]} for the single-term, multi-term and high-frequency-term mixes
+#terms are drawn from the index itself so every query has matches
+def make_query_mixes(conn, queries_per_mix, seed=0):
+    rng = random.Random(seed)
+    c = conn.cursor()
+    c.execute('SELECT token, df FROM term_stats ORDER BY df DESC, token')
+    terms = c.fetchall()
+    vocabulary = [token for token, _ in terms]
+    frequent = vocabulary[:HIGH_FREQUENCY_TERMS]
+    return {
+        "single_term": [rng.choice(vocabulary) for _ in range(queries_per_mix)],
+        "multi_term": [" ".join(rng.sample(vocabulary, min(len(vocabulary), rng.randint(2, 4))))
+                       for _ in range(queries_per_mix)],
+        "high_frequency": [" ".join(rng.sample(frequent, min(len(frequent), rng.randint(1, 3))))
+                           for _ in range(queries_per_mix)],
+    }
+
+#nearest-rank percentile of an already sorted list
+def percentile(sorted_values, fraction):
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+#runs each mix against compute_cosine_similarity and returns latency percentiles and throughput per mix
+def benchmark_queries(db_path, queries_per_mix=200, seed=0):
+    conn = sqlite3.connect(db_path)
+    results = {}
+    for mix, queries in make_query_mixes(conn, queries_per_mix, seed).items():
+        #one untimed query so the first timing does not include opening the tables
+        compute_cosine_similarity(conn, queries[0])
+        timings = []
+        start = time.perf_counter()
+        for query in queries:
+            query_start = time.perf_counter()
+            compute_cosine_similarity(conn, query)
+            timings.append((time.perf_counter() - query_start) * 1000)
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        results[mix] = {"queries": len(queries), "mean_ms": sum(timings) / len(timings),
+                        "p50_ms": percentile(timings, 0.50), "p95_ms": percentile(timings, 0.95),
+                        "p99_ms": percentile(timings, 0.99), "qps": len(queries) / elapsed}
+        print(f"{mix:>16}: p50 {results[mix]['p50_ms']:7.2f} ms | p95 {results[mix]['p95_ms']:7.2f} ms | "
+              f"p99 {results[mix]['p99_ms']:7.2f} ms | {results[mix]['qps']:8.1f} qps")
+    conn.close()
+    return results
+
+#runs the whole suite and returns the results as one json-serializable dict
+#without webpages_raw_directory a synthetic corpus is generated from seed first
+def run_benchmark(webpages_raw_directory=None, documents=500, seed=0, vocabulary_size=5000,
+                  queries_per_mix=200, tokenizer=TOKENIZERS[0], trace_memory=False, work_directory=None,
+                  build="sql"):
+    cleanup = work_directory is None
+    if cleanup:
+        work_directory = tempfile.mkdtemp(prefix="benchmark-")
+    os.makedirs(work_directory, exist_ok=True)
+    try:
+        corpus = {"source": webpages_raw_directory or "synthetic"}
+        if webpages_raw_directory is None:
+            corpus.update({"documents": documents, "seed": seed, "vocabulary_size": vocabulary_size})
+            webpages_raw_directory = generate_corpus(os.path.join(work_directory, "WEBPAGES_RAW"), documents,
+                                                     seed, vocabulary_size)
+
+        print("Indexing...")
+        indexing, index = benchmark_indexing(webpages_raw_directory, work_directory, tokenizer, trace_memory,
+                                             build)
+        print(f"Index size: {index['db_bytes'] / 1000:.0f} kb")
+        print("Querying...")
+        queries = benchmark_queries(os.path.join(work_directory, "index.db"), queries_per_mix, seed)
+    finally:
+        if cleanup:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    return {"benchmark_version": BENCHMARK_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count(), "sqlite": sqlite3.sqlite_version},
+            "config": {"tokenizer": tokenizer, "build": build, "queries_per_mix": queries_per_mix, "trace_memory": trace_memory},
+            "corpus": corpus, "indexing": indexing, "index": index, "queries": queries}
+
+#(path in the results, True if larger is better) of the metrics compare looks at
+def comparable_metrics(results):
+    metrics = [(("indexing", "docs_per_sec"), True), (("index", "db_bytes"), False),
+               (("indexing", "peak_rss_kb"), False)]
+    for stage in results.get("indexing", {}).get("stages", {}):
+        metrics.append((("indexing", "stages", stage, "docs_per_sec"), True))
+    for mix in results.get("queries", {}):
+        metrics.append((("queries", mix, "p50_ms"), False))
+        metrics.append((("queries", mix, "p95_ms"), False))
+        metrics.append((("queries", mix, "p99_ms"), False))
+        metrics.append((("queries", mix, "qps"), True))
+    return metrics
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+#prints every metric of two result files side by side and returns the regressions beyond threshold
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    for path, higher_is_better in comparable_metrics(current):
+        old = lookup(baseline, path)
+        new = lookup(current, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = (change < -threshold) if higher_is_better else (change > threshold)
+        if regressed:
+            regressions.append(".".join(path))
+        print(f"{'.'.join(path):<44} {old:12.2f} {new:12.2f} {change * 100:+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+#tokenizes every document with the named tokenizer and returns (seconds, documents, tokens, postings)
+def time_tokenizer(name, file_paths, url_dict):
+    tokenizer = get_tokenizer(name)
+    tokens = 0
+    postings = 0
+    start = time.perf_counter()
+    for file_path in file_paths:
+        token_DocID_list = tokenizer(file_path, url_dict, {})
+        tokens += len(token_DocID_list)
+        postings += len(create_document_postings(token_DocID_list))
+    return time.perf_counter() - start, len(file_paths), tokens, postings
+
+#compares the per-document throughput of the tokenizers on the same documents
+def benchmark_tokenizers(webpages_raw_directory, limit=None):
+    bookkeeping = open(os.path.join(webpages_raw_directory, "bookkeeping.json"), 'r')
+    bookkeeping_data = json.load(bookkeeping)
+    bookkeeping.close()
+
+    file_paths = []
+    for file_path in iter_document_paths(webpages_raw_directory):
+        if limit is not None and len(file_paths) >= limit:
+            break
+        file_paths.append(file_path)
+
+    #reads every file once so neither tokenizer pays for a cold page cache
+    for file_path in file_paths:
+        with open(file_path, 'rb') as warm_file:
+            warm_file.read()
+
+    results = {}
+    for name in reversed(TOKENIZERS):
+        seconds, documents, tokens, postings = time_tokenizer(name, file_paths, bookkeeping_data)
+        results[name] = {"seconds": seconds, "documents": documents, "docs_per_sec": documents / seconds,
+                         "ms_per_doc": seconds * 1000 / documents, "tokens": tokens, "postings": postings}
+        print(f"{name:>7}: {documents / seconds:8.1f} docs/s | {seconds * 1000 / documents:7.2f} ms/doc | "
+              f"{tokens} tokens | {postings} postings")
+    print(f"Speedup: {results['legacy']['seconds'] / results['fast']['seconds']:.1f}x")
+    return results
+
+def write_results(results, output):
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {output}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the indexing stages and query latency.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="index a corpus (synthetic unless --corpus is given) and time queries")
+    run.add_argument("--corpus", help="existing WEBPAGES_RAW folder to index instead of a synthetic corpus")
+    run.add_argument("--documents", type=int, default=500, help="size of the synthetic corpus")
+    run.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus and the query mixes")
+    run.add_argument("--vocabulary", type=int, default=5000, help="vocabulary size of the synthetic corpus")
+    run.add_argument("--queries", type=int, default=200, help="queries per mix")
+    run.add_argument("--tokenizer", choices=TOKENIZERS, default=TOKENIZERS[0])
+    run.add_argument("--build", choices=["sql", "vectorized"], default="sql",
+                     help="how the tf-idf weights are computed (see CreateInvertedIndex.py --build)")
+    run.add_argument("--trace-memory", action="store_true",
+                     help="also record the peak python heap of every stage with tracemalloc (slower)")
+    run.add_argument("--work-dir", help="keep the corpus and index.db here instead of a temporary folder")
+    run.add_argument("--output", default="benchmark.json", help="where the json results are written")
+
+    generate = commands.add_parser("generate", help="write a synthetic WEBPAGES_RAW folder")
+    generate.add_argument("directory")
+    generate.add_argument("--documents", type=int, default=500)
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--vocabulary", type=int, default=5000)
+
+    compare = commands.add_parser("compare", help="compare two result files; exits with 1 on a regression")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                         help="relative change that counts as a regression (default: 0.10)")
+
+    tokenizer = commands.add_parser("tokenizer", help="per-document throughput of the fast and legacy tokenizers")
+    tokenizer.add_argument("webpages_raw_directory", help="path to a WEBPAGES_RAW folder")
+    tokenizer.add_argument("--limit", type=int, default=None, help="only tokenize the first LIMIT documents")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if args.command == "run":
+        results = run_benchmark(args.corpus, args.documents, args.seed, args.vocabulary, args.queries,
+                                args.tokenizer, args.trace_memory, args.work_dir, args.build)
+        write_results(results, args.output)
+    elif args.command == "generate":
+        generate_corpus(args.directory, args.documents, args.seed, args.vocabulary)
+    elif args.command == "compare":
+        with open(args.baseline) as baseline_file, open(args.current) as current_file:
+            regressions = compare_results(json.load(baseline_file), json.load(current_file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    elif args.command == "tokenizer":
+        benchmark_tokenizers(args.webpages_raw_directory, args.limit)
+
+if __name__ == "__main__":
+    main()
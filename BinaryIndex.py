@@ -0,0 +1,286 @@
+import os
+import sys
+import mmap
+import time
+import random
+import sqlite3
+import struct
+
+BINARY_INDEX_MAGIC = b"SCIX"
+BINARY_INDEX_VERSION = 3
+WEIGHT_LEVELS = 65535  # weights are quantized to 16 bits between each term's minimum and maximum weight
+
+#header: magic, version, doc count, term count, dictionary offset, postings offset
+HEADER_FORMAT = "<4sIIIQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+#dictionary entry after the term bytes: postings offset, doc section length, postings length, df, min weight,
+#max weight, and the largest total weight one document gets from the term (the top-k upper bound)
+TERM_ENTRY_FORMAT = "<QIIIffd"
+TERM_ENTRY_SIZE = struct.calcsize(TERM_ENTRY_FORMAT)
+
+#appends the variable-byte encoding of a non-negative integer to out (7 bits per byte, high bit = more bytes follow)
+def encode_varbyte(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+#decodes one variable-byte integer from buffer at offset and returns (value, next offset)
+def decode_varbyte(buffer, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def quantize_weight(weight, min_weight, max_weight):
+    if max_weight <= min_weight:
+        return 0
+    #min and max are stored as float32, so clamp weights that fall just outside after rounding
+    level = round((weight - min_weight) / (max_weight - min_weight) * WEIGHT_LEVELS)
+    return min(max(level, 0), WEIGHT_LEVELS)
+
+def dequantize_weight(level, min_weight, max_weight):
+    if max_weight <= min_weight:
+        return min_weight
+    return min_weight + level * (max_weight - min_weight) / WEIGHT_LEVELS
+
+#encodes the postings of one term
+#postings is a list of (doc number, nweight, positions list) sorted by doc number
+#the doc section holds (doc gap, quantized weight, byte length of the positions) per posting so doc ids and
+#weights can be read without touching positions; the positions section holds (count, position gaps) per posting
+def encode_postings(postings):
+    min_weight = struct.unpack("<f", struct.pack("<f", min(weight for _, weight, _ in postings)))[0]
+    max_weight = struct.unpack("<f", struct.pack("<f", max(weight for _, weight, _ in postings)))[0]
+    doc_section = bytearray()
+    positions_section = bytearray()
+    previous_doc = 0
+    #the upper bound is taken over the dequantized weights so it holds for the scores the reader computes
+    doc_scores = {}
+    for doc, weight, positions in postings:
+        encoded_positions = bytearray()
+        encode_varbyte(len(positions), encoded_positions)
+        previous_position = 0
+        for position in positions:
+            encode_varbyte(position - previous_position, encoded_positions)
+            previous_position = position
+        encode_varbyte(doc - previous_doc, doc_section)
+        level = quantize_weight(weight, min_weight, max_weight)
+        encode_varbyte(level, doc_section)
+        encode_varbyte(len(encoded_positions), doc_section)
+        positions_section += encoded_positions
+        previous_doc = doc
+        doc_scores[doc] = doc_scores.get(doc, 0) + dequantize_weight(level, min_weight, max_weight)
+    return doc_section, positions_section, min_weight, max_weight, max(doc_scores.values())
+
+#writes final_postings of an index.db connection to path in the binary format
+#postings hold the doc numbers of index.db, whose document table maps them back to doc keys and urls
+#the file is written next to path and renamed into place so readers never see a partial index
+def write_binary_index(conn, path='index.bin'):
+    c = conn.cursor()
+    c.execute('SELECT COUNT(DISTINCT doc_id) FROM final_postings')
+    doc_count = c.fetchone()[0]
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as index_file:
+        index_file.write(b"\0" * HEADER_SIZE)
+
+        #postings, one block per term in term order; dictionary entries are collected and written after them
+        postings_offset = index_file.tell()
+        dictionary = bytearray()
+        term_count = 0
+        current_token = None
+        current_postings = []
+
+        def flush_term():
+            current_postings.sort(key=lambda posting: posting[0])
+            doc_section, positions_section, min_weight, max_weight, max_score = encode_postings(current_postings)
+            encoded_token = current_token.encode('utf-8')
+            encode_varbyte(len(encoded_token), dictionary)
+            dictionary.extend(encoded_token)
+            dictionary.extend(struct.pack(TERM_ENTRY_FORMAT, index_file.tell(), len(doc_section),
+                                          len(doc_section) + len(positions_section), len(current_postings),
+                                          min_weight, max_weight, max_score))
+            index_file.write(doc_section)
+            index_file.write(positions_section)
+
+        c.execute('SELECT token, doc_id, positions, nweight FROM final_postings ORDER BY token')
+        for token, doc_id, positions, nweight in c:
+            if token != current_token:
+                if current_postings:
+                    flush_term()
+                    term_count += 1
+                current_token = token
+                current_postings = []
+            positions_list = [int(i) for i in positions.split()] if positions else []
+            current_postings.append((doc_id, nweight, positions_list))
+        if current_postings:
+            flush_term()
+            term_count += 1
+
+        dictionary_offset = index_file.tell()
+        index_file.write(dictionary)
+
+        index_file.seek(0)
+        index_file.write(struct.pack(HEADER_FORMAT, BINARY_INDEX_MAGIC, BINARY_INDEX_VERSION, doc_count,
+                                     term_count, dictionary_offset, postings_offset))
+    os.replace(temp_path, path)
+    return path
+
+#read-only, memory-mapped view of an index written by write_binary_index
+#the term dictionary is loaded when the index is opened; postings are decoded from the mapping on demand, so
+#only the lists a query touches are read from disk
+class BinaryIndexReader:
+
+    def __init__(self, path='index.bin'):
+        self.path = path
+        self.index_file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.doc_count, term_count, dictionary_offset, postings_offset = \
+            struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != BINARY_INDEX_MAGIC or version != BINARY_INDEX_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {BINARY_INDEX_VERSION} binary index")
+
+        self.dictionary = {}
+        offset = dictionary_offset
+        for _ in range(term_count):
+            length, offset = decode_varbyte(self.buffer, offset)
+            term = self.buffer[offset:offset + length].decode('utf-8')
+            offset += length
+            self.dictionary[term] = struct.unpack_from(TERM_ENTRY_FORMAT, self.buffer, offset)
+            offset += TERM_ENTRY_SIZE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+        self.index_file.close()
+
+    def __contains__(self, term):
+        return term in self.dictionary
+
+    def terms(self):
+        return self.dictionary.keys()
+
+    def document_count(self):
+        return self.doc_count
+
+    def document_frequency(self, term):
+        entry = self.dictionary.get(term)
+        return entry[3] if entry else 0
+
+    #returns the largest total weight a single document gets from term
+    def max_weight(self, term):
+        entry = self.dictionary.get(term)
+        return entry[6] if entry else None
+
+    #returns ([doc numbers], [weights], [positions offsets]) for term in doc order
+    def doc_postings(self, term):
+        entry = self.dictionary.get(term)
+        if entry is None:
+            return [], [], []
+        offset, doc_section_length, postings_length, df, min_weight, max_weight, max_score = entry
+        buffer = self.buffer
+        docs = []
+        weights = []
+        positions_offsets = []
+        position_offset = offset + doc_section_length
+        doc = 0
+        for _ in range(df):
+            gap, offset = decode_varbyte(buffer, offset)
+            level, offset = decode_varbyte(buffer, offset)
+            positions_length, offset = decode_varbyte(buffer, offset)
+            doc += gap
+            docs.append(doc)
+            weights.append(dequantize_weight(level, min_weight, max_weight))
+            positions_offsets.append(position_offset)
+            position_offset += positions_length
+        return docs, weights, positions_offsets
+
+    #decodes one position list at an offset returned by doc_postings
+    def positions_at(self, offset):
+        count, offset = decode_varbyte(self.buffer, offset)
+        positions = []
+        position = 0
+        for _ in range(count):
+            gap, offset = decode_varbyte(self.buffer, offset)
+            position += gap
+            positions.append(position)
+        return positions
+
+    #returns [(doc_id, nweight)] for term, the same shape as the final_postings query in compute_cosine_similarity
+    def postings(self, term):
+        docs, weights, _ = self.doc_postings(term)
+        return list(zip(docs, weights))
+
+    #returns [(doc_id, [positions])] for term
+    def positional_postings(self, term):
+        docs, _, positions_offsets = self.doc_postings(term)
+        return [(doc, self.positions_at(offset)) for doc, offset in zip(docs, positions_offsets)]
+
+#runs every query repeat times against source and returns (mean ms, p95 ms)
+def measure_latency(source, queries, repeat):
+    from QueryRuntime import compute_cosine_similarity
+    timings = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            compute_cosine_similarity(source, query)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return sum(timings) / len(timings), timings[int(len(timings) * 0.95) - 1]
+
+#compares the size and query latency of index.db and index.bin built from the same corpus
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'index.db'
+    bin_path = sys.argv[2] if len(sys.argv) > 2 else 'index.bin'
+    conn = sqlite3.connect(db_path)
+    if not os.path.exists(bin_path):
+        print(f"Writing {bin_path} from {db_path}...")
+        write_binary_index(conn, bin_path)
+    reader = BinaryIndexReader(bin_path)
+
+    #samples single and two term queries from the vocabulary
+    rng = random.Random(0)
+    vocabulary = sorted(reader.terms())
+    queries = [rng.choice(vocabulary) for _ in range(50)]
+    queries += [rng.choice(vocabulary) + " " + rng.choice(vocabulary) for _ in range(50)]
+
+    postings_size = None
+    if has_dbstat(conn):
+        c = conn.cursor()
+        c.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?', ('final_postings',))
+        postings_size = c.fetchone()[0]
+    db_size = os.path.getsize(db_path)
+    bin_size = os.path.getsize(bin_path)
+
+    sqlite_mean, sqlite_p95 = measure_latency(conn, queries, 3)
+    binary_mean, binary_p95 = measure_latency(reader, queries, 3)
+
+    print(f"index.db size:  {db_size/1000:.0f} kb" +
+          (f" (final_postings: {postings_size/1000:.0f} kb)" if postings_size else ""))
+    print(f"index.bin size: {bin_size/1000:.0f} kb")
+    print(f"SQLite query latency: mean {sqlite_mean:.2f} ms | p95 {sqlite_p95:.2f} ms")
+    print(f"Binary query latency: mean {binary_mean:.2f} ms | p95 {binary_p95:.2f} ms")
+    reader.close()
+    conn.close()
+
+#the dbstat virtual table is only available when SQLite is compiled with SQLITE_ENABLE_DBSTAT_VTAB
+def has_dbstat(conn):
+    try:
+        conn.execute('SELECT 1 FROM dbstat LIMIT 1')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import os
+import math
+import json
+import time
+import sqlite3
+import contextlib
+import collections
+from CreateInvertedIndex import (run_serial_pipeline, run_parallel_pipeline, write_term_stats, number_documents,
+                                 number_postings, IndexStatistics, TOKENIZERS)
+from TermDictionary import write_term_dictionary, create_final_postings_table
+from QueryRuntime import write_query_lemmas
+from DocumentTable import store_document_norms, write_document_table
+from DocumentStore import DocumentStoreWriter
+from NearDuplicates import NearDuplicateFilter, create_duplicates_table
+from Metrics import METRICS, Progress
+
+BUILD_FORMAT = 2  # bumped when the checkpoint tables change, so an old partial build is started over
+PHASES = ["tokenize", "weight", "normalize", "term_stats", "finish"]
+
+#A bulk build writes index.db.building and records its progress in it, so a killed build continues where it
+#stopped when it is started again (an archive is read from the start again, but only the subfolders without a
+#checkpoint are tokenized):
+#  tokenize:   one transaction per subfolder inserts its tokens and document infos with executemany together
+#              with the subfolder's row in build_folders; an interrupted subfolder is rolled back and redone
+#              with --near-duplicates the same transaction adds the subfolder's near-duplicates to duplicates
+#              and the fingerprints of its other documents to build_fingerprints, which a resumed build
+#              reloads its NearDuplicateFilter from
+#  weight:     df, idf and the tf-idf weights of every posting in one INSERT ... SELECT
+#  normalize:  document norms and final_postings in one transaction
+#  term_stats: term_stats, terms.dict, the document table and docstore.bin, then the per-folder checkpoint
+#              tables are dropped
+#build_state stays in the finished index.db and records the corpus and tokenizer it was built from.
+#Every phase runs in a single transaction that also records the next phase in build_state, so the database
+#is always either before or after a phase, never half way through one.
+@contextlib.contextmanager
+def transaction(conn):
+    conn.execute('BEGIN')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def set_phase(c, phase):
+    c.execute("INSERT OR REPLACE INTO build_state (key, value) VALUES ('phase', ?)", (phase,))
+
+def current_phase(conn):
+    row = conn.execute("SELECT value FROM build_state WHERE key = 'phase'").fetchone()
+    return row[0] if row else None
+
+#opens the partial build at building_path, or starts a new one if there is none or it was started for another
+#corpus, tokenizer, near-duplicate setting or build format
+def open_build(building_path, corpus_path, url_dict, doc_numbers, tokenizer, near_duplicates=False):
+    source = json.dumps({"format": BUILD_FORMAT, "corpus": corpus_path, "tokenizer": tokenizer,
+                         "near_duplicates": near_duplicates})
+    if os.path.exists(building_path):
+        conn = sqlite3.connect(building_path, isolation_level=None)
+        try:
+            row = conn.execute("SELECT value FROM build_state WHERE key = 'source'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        if row is not None and row[0] == source:
+            print(f"Resuming the build in {building_path} at the {current_phase(conn)} phase")
+            return conn
+        conn.close()
+        print(f"Discarding {building_path}, it was started for another corpus or tokenizer")
+        os.remove(building_path)
+
+    conn = sqlite3.connect(building_path, isolation_level=None)
+    with transaction(conn) as c:
+        c.execute('''CREATE TABLE documents
+                     (id INTEGER PRIMARY KEY, doc_key TEXT, path TEXT)''')
+        c.execute('''CREATE TABLE tokens
+                     (token TEXT, doc_id INTEGER, frequency INTEGER, tf REAL, positions TEXT,
+                      FOREIGN KEY(doc_id) REFERENCES documents(id))''')
+        c.execute('CREATE TABLE build_state (key TEXT PRIMARY KEY, value TEXT)')
+        c.execute('CREATE TABLE build_folders (folder TEXT PRIMARY KEY, valid_documents INTEGER)')
+        c.execute('CREATE TABLE build_doc_info (doc_id TEXT PRIMARY KEY, info TEXT)')
+        if near_duplicates:
+            create_duplicates_table(c)
+            #fingerprints are stored as text because a 64-bit fingerprint does not fit a signed INTEGER
+            c.execute('CREATE TABLE build_fingerprints (doc_id INTEGER PRIMARY KEY, fingerprint TEXT)')
+        c.executemany('INSERT INTO documents (id, doc_key, path) VALUES (?, ?, ?)',
+                      ((number, doc_key, url_dict.get(doc_key)) for doc_key, number in doc_numbers.items()))
+        c.execute("INSERT INTO build_state (key, value) VALUES ('source', ?)", (source,))
+        set_phase(c, PHASES[0])
+    return conn
+
+#returns a NearDuplicateFilter with the documents the checkpointed subfolders of the build added to it
+def load_duplicate_filter(conn):
+    duplicate_filter = NearDuplicateFilter()
+    for doc, fingerprint in conn.execute('SELECT doc_id, fingerprint FROM build_fingerprints ORDER BY rowid'):
+        duplicate_filter.add_canonical(doc, int(fingerprint, 16))
+    for doc, canonical, postings, positions in conn.execute('SELECT doc_id, canonical, postings, positions '
+                                                            'FROM duplicates'):
+        duplicate_filter.duplicates[doc] = (canonical, postings, positions)
+    return duplicate_filter
+
+#tokenizes every subfolder of the corpus source that has no checkpoint yet
+#the documents of all those subfolders go through one pipeline, so the workers are started (and sent url_dict)
+#once per build; the sink gets the results in corpus order and checkpoints a subfolder with its last document
+def tokenize_folders(conn, source, url_dict, doc_numbers, num_workers, tokenizer, near_duplicates=False):
+    done = {folder for (folder,) in conn.execute('SELECT folder FROM build_folders')}
+    duplicate_filter = load_duplicate_filter(conn) if near_duplicates else None
+    progress = Progress("Folders Read")
+    progress.update(len(done))
+    #(folder, is its last document) of every document handed to the pipeline and not yet written
+    document_folders = collections.deque()
+    rows = []
+    doc_infos = []
+    fingerprints = []
+    duplicates = []
+    valid_documents = 0
+
+    def folder_documents():
+        seen = set()
+        for folder, documents in source.folders():
+            #a folder is checkpointed as a whole, so its files must come together
+            if folder in seen:
+                raise ValueError(f"{source.path} stores the files of folder {folder} in more than one place")
+            seen.add(folder)
+            if folder in done:
+                continue
+            #each document is held back until the next one is read, so the last one can be marked
+            previous = None
+            for document in documents:
+                if previous is not None:
+                    document_folders.append((folder, False))
+                    yield previous
+                previous = document
+            if previous is not None:
+                document_folders.append((folder, True))
+                yield previous
+
+    def checkpoint(folder):
+        nonlocal valid_documents
+        with METRICS.timer("sqlite_insert"), transaction(conn) as c:
+            c.executemany('INSERT INTO tokens (token, doc_id, frequency, tf, positions) VALUES (?, ?, ?, ?, ?)', rows)
+            c.executemany('INSERT OR REPLACE INTO build_doc_info (doc_id, info) VALUES (?, ?)', doc_infos)
+            if duplicate_filter is not None:
+                c.executemany('INSERT INTO build_fingerprints (doc_id, fingerprint) VALUES (?, ?)', fingerprints)
+                c.executemany('INSERT INTO duplicates (doc_id, canonical, postings, positions) VALUES (?, ?, ?, ?)',
+                              duplicates)
+            c.execute('INSERT INTO build_folders (folder, valid_documents) VALUES (?, ?)',
+                      (folder, valid_documents - len(duplicates)))
+        METRICS.count("rows_inserted", len(rows))
+        progress.update()
+        for buffer in (rows, doc_infos, fingerprints, duplicates):
+            buffer.clear()
+        valid_documents = 0
+
+    def add_document(doc_id, postings_dict, doc_info):
+        nonlocal valid_documents
+        postings_dict = number_postings(postings_dict, doc_numbers)
+        if postings_dict:
+            valid_documents += 1
+        if duplicate_filter is not None:
+            doc = doc_numbers[doc_id]
+            if duplicate_filter.check(doc, postings_dict) is not None:
+                duplicates.append((doc,) + duplicate_filter.duplicates[doc])
+                return
+            if doc in duplicate_filter.fingerprints:
+                fingerprints.append((doc, format(duplicate_filter.fingerprints[doc], 'x')))
+        for token, (posting_doc_id, tf, positions, html_weights) in postings_dict.items():
+            rows.append((token, posting_doc_id, len(positions), tf, " ".join(str(i) for i in positions)))
+        if doc_info:
+            doc_infos.append((doc_id, json.dumps(doc_info)))
+
+    def collect(doc_id, postings_dict, doc_info):
+        folder, last = document_folders.popleft()
+        add_document(doc_id, postings_dict, doc_info)
+        if last:
+            checkpoint(folder)
+
+    if num_workers > 1:
+        run_parallel_pipeline(folder_documents(), url_dict, collect, num_workers, tokenizer=tokenizer)
+    else:
+        run_serial_pipeline(folder_documents(), url_dict, collect, tokenizer)
+    progress.finish()
+
+    #the token index is built once after the load instead of being maintained by every insert
+    with transaction(conn) as c:
+        c.execute('CREATE INDEX IF NOT EXISTS tokens_token ON tokens(token)')
+        c.execute('''INSERT OR REPLACE INTO build_state (key, value)
+                     SELECT 'valid_documents', COALESCE(SUM(valid_documents), 0) FROM build_folders''')
+        set_phase(c, "weight")
+
+#computes df, idf and the weights of every posting in SQL
+#idf is the same Python expression calculate_weight uses, so the weights are identical to the sql build's;
+#postings are written term by term in the order calculate_weight writes them
+def weight_postings(conn, valid_documents):
+    conn.create_function("idf", 2, lambda documents, df: math.log10(documents/(df + 1)), deterministic=True)
+    with METRICS.timer("idf"), transaction(conn) as c:
+        c.execute('DROP TABLE IF EXISTS postings')
+        c.execute('''CREATE TABLE postings
+                     (token TEXT, doc_id INTEGER, frequency INTEGER, tf REAL, weight REAL, nweight REAL, positions TEXT,
+                      FOREIGN KEY(doc_id) REFERENCES documents(id))''')
+        c.execute('''INSERT INTO postings (token, doc_id, frequency, tf, weight, positions)
+                     SELECT t.token, t.doc_id, t.frequency, t.tf, t.tf * idf(?, d.df), t.positions
+                     FROM tokens t JOIN (SELECT token, COUNT(*) AS df FROM tokens GROUP BY token) d
+                     ON t.token = d.token
+                     ORDER BY t.token, t.rowid''', (valid_documents,))
+        c.execute('DROP TABLE tokens')
+        set_phase(c, "normalize")
+
+#divides every weight by the norm of its document and writes final_postings
+#the squared weights of a document are summed in postings order with math.pow like normalize_weight, and
+#final_postings is written term by term, so terms.dict needs no reordering
+def normalize_postings(conn):
+    with METRICS.timer("normalize"), transaction(conn) as c:
+        sums = {}
+        for doc_id, weight in c.execute('SELECT doc_id, weight FROM postings ORDER BY rowid'):
+            sums[doc_id] = sums.get(doc_id, 0) + math.pow(weight, 2)
+        store_document_norms(c, ((doc_id, math.sqrt(total)) for doc_id, total in sums.items()))
+        c.execute('DROP TABLE IF EXISTS final_postings')
+        create_final_postings_table(c)
+        c.execute('''INSERT INTO final_postings (token, doc_id, positions, nweight)
+                     SELECT p.token, p.doc_id, p.positions,
+                            CASE WHEN n.magnitude = 0 THEN 0.0 ELSE p.weight / n.magnitude END
+                     FROM postings p JOIN doc_norms n ON p.doc_id = n.doc_id
+                     ORDER BY p.rowid''')
+        c.execute('DROP TABLE postings')
+        set_phase(c, "term_stats")
+
+#writes term_stats, terms.dict, query_lemmas, the document table and docstore.bin and removes the per-folder checkpoint tables
+#each step replaces its previous output, so the phase can be rerun after an interruption
+def finish_build(conn, dictionary_path, document_store_path):
+    write_term_stats(conn)
+    write_term_dictionary(conn, dictionary_path)
+    write_query_lemmas(conn)
+    write_document_table(conn)
+    doc_store = DocumentStoreWriter(document_store_path)
+    for doc_id, info in conn.execute('SELECT doc_id, info FROM build_doc_info ORDER BY rowid'):
+        doc_store.add(doc_id, json.loads(info))
+    doc_store.close()
+    with transaction(conn) as c:
+        c.execute('DROP TABLE build_doc_info')
+        c.execute('DROP TABLE build_folders')
+        c.execute('DROP TABLE IF EXISTS build_fingerprints')
+        set_phase(c, "finish")
+    conn.execute('VACUUM')
+
+#builds (or resumes building) the index of the corpus source at building_path and returns its IndexStatistics
+#the caller publishes the finished file by renaming it to index.db
+def build_index(building_path, source, url_dict, num_workers=1, tokenizer=TOKENIZERS[0],
+                dictionary_path='terms.dict', document_store_path='docstore.bin', near_duplicates=False):
+    doc_numbers = number_documents(source, url_dict)
+    conn = open_build(building_path, source.path, url_dict, doc_numbers, tokenizer, near_duplicates)
+    try:
+        phase = current_phase(conn)
+        if phase == "tokenize":
+            start = time.time()
+            tokenize_folders(conn, source, url_dict, doc_numbers, num_workers, tokenizer, near_duplicates)
+            print(f"\nTime Elapsed: {time.time() - start:.2f} s")
+            phase = current_phase(conn)
+
+        stats = IndexStatistics()
+        stats.valid_documents = int(conn.execute("SELECT value FROM build_state WHERE key = 'valid_documents'")
+                                    .fetchone()[0])
+        if phase == "weight":
+            print("\nCorpus Processed. Now calculating tf-idf weights...")
+            start = time.time()
+            weight_postings(conn, stats.valid_documents)
+            print(f"Time Elapsed: {time.time() - start:.2f} s")
+            phase = current_phase(conn)
+        if phase == "normalize":
+            print("\nNormalizing document vectors...")
+            start = time.time()
+            normalize_postings(conn)
+            print(f"Time Elapsed: {time.time() - start:.2f} s")
+            phase = current_phase(conn)
+        if phase == "term_stats":
+            finish_build(conn, dictionary_path, document_store_path)
+        stats.unique_words = {token for (token,) in conn.execute('SELECT token FROM term_stats')}
+    finally:
+        conn.close()
+    return stats
@@ -0,0 +1,387 @@
+import os
+import io
+import re
+import gzip
+import json
+import heapq
+import bisect
+import codecs
+import tarfile
+import zipfile
+import itertools
+from collections.abc import Mapping
+from DocumentTable import string_column
+
+BOOKKEEPING_NAME = 'bookkeeping.json'
+WARC_FOLDER_SIZE = 500  # WARC responses are given "folder/file" doc keys with this many files per folder
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+WARC_SUFFIXES = ('.warc', '.warc.gz')
+BOOKKEEPING_CHUNK_SIZE = 1 << 20  # bytes of bookkeeping.json read at a time
+BOOKKEEPING_RUN_SIZE = 100000  # (doc key, url) pairs sorted at a time while bookkeeping.json is loaded
+#a "key": "value" pair of strings without escapes and the "," or "}" after it, which is every pair of a
+#bookkeeping.json; other pairs are decoded with json
+PLAIN_PAIR = re.compile(r'[ \t\r\n]*"([^"\\\x00-\x1f]*)"[ \t\r\n]*:[ \t\r\n]*"([^"\\\x00-\x1f]*)"[ \t\r\n]*([,}])')
+
+#A corpus source hands the indexer the documents of a corpus one at a time, so a corpus can be indexed from an
+#archive without extracting it:
+#  DirectorySource: a WEBPAGES_RAW folder (bookkeeping.json and numbered subfolders of pages)
+#  TarSource:       a .tar/.tar.gz/.tgz/.tar.bz2/.tar.xz of such a folder, read as a stream
+#  ZipSource:       a .zip of such a folder
+#  WarcSource:      a .warc or .warc.gz crawl; every response record is a document and its target uri its url
+#Every source has
+#  path:               the absolute path of the corpus, which a bulk build records to recognize its corpus
+#  read_bookkeeping(): the doc key -> url mapping as a Bookkeeping
+#  doc_keys():         the "folder/file" key of every document
+#  documents(wanted):  (path, contents) for every document, or only those whose doc key wanted(doc_key) accepts,
+#                      in corpus order; contents is None when the tokenizer reads path itself, otherwise the bytes
+#                      of the document and path its doc key
+#documents() reads one document at a time, so memory does not grow with the corpus. An archive is read once for
+#its bookkeeping and doc keys and once more for the documents.
+
+#the doc key -> url mapping of bookkeeping.json, held as two sorted StringColumns instead of a dict
+#lookups are a binary search over the keys
+#pairs can come in any order; they are sorted BOOKKEEPING_RUN_SIZE at a time into StringColumn runs that are
+#then merged, so at most one run is ever held as Python strings
+class Bookkeeping(Mapping):
+
+    def __init__(self, pairs):
+        pairs = iter(pairs)
+        runs = []
+        while True:
+            run = sorted(itertools.islice(pairs, BOOKKEEPING_RUN_SIZE))
+            if not run:
+                break
+            runs.append((string_column(doc_key for doc_key, _ in run), string_column(url for _, url in run)))
+        if len(runs) == 1:
+            self.keys, self.urls = runs[0]
+            return
+        self.keys = string_column(())
+        self.urls = string_column(())
+        merged = heapq.merge(*(zip(keys.encoded(), urls.encoded()) for keys, urls in runs))
+        while True:
+            batch = list(itertools.islice(merged, BOOKKEEPING_RUN_SIZE))
+            if not batch:
+                break
+            self.keys.extend_encoded([doc_key for doc_key, _ in batch])
+            self.urls.extend_encoded([url for _, url in batch])
+
+    def position(self, doc_key):
+        position = bisect.bisect_left(self.keys, doc_key)
+        if position < len(self.keys) and self.keys[position] == doc_key:
+            return position
+        return None
+
+    def __getitem__(self, doc_key):
+        position = self.position(doc_key)
+        if position is None:
+            raise KeyError(doc_key)
+        return self.urls[position]
+
+    def get(self, doc_key, default=None):
+        #anchors look up hrefs that are not keys, so a miss must not cost an exception
+        if not isinstance(doc_key, str):
+            return default
+        position = self.position(doc_key)
+        return default if position is None else self.urls[position]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return (self.keys[i] for i in range(len(self.keys)))
+
+    def items(self):
+        return ((self.keys[i], self.urls[i]) for i in range(len(self.keys)))
+
+#yields the (key, value) pairs of the JSON object in a binary file, reading it a chunk at a time
+#a value that reaches the end of the text read so far may be cut off, so it is decoded again with more text
+def iter_json_object(binary_file, chunk_size=BOOKKEEPING_CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder('utf-8-sig')().decode
+    buffer = ""
+    position = 0
+    finished = False
+
+    #drops the parsed text and appends the next chunk; returns False at the end of the file
+    def read_more():
+        nonlocal buffer, position, finished
+        if finished:
+            return False
+        chunk = binary_file.read(chunk_size)
+        finished = not chunk
+        buffer = buffer[position:] + decode(chunk, final=finished)
+        position = 0
+        return True
+
+    #skips whitespace and returns the next character, or "" at the end of the file
+    def next_character():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or not read_more():
+                return buffer[position:position + 1]
+
+    def next_value():
+        nonlocal position
+        while True:
+            next_character()
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read_more():
+                    continue
+                raise
+            #a number cut off after "1." or "1e+" still decodes, so it needs the characters after it as well
+            cut_off = end == len(buffer) or isinstance(value, (int, float)) and len(buffer) - end < 3
+            if cut_off and read_more():
+                continue
+            position = end
+            return value
+
+    def expect(characters):
+        nonlocal position
+        character = next_character()
+        if not character or character not in characters:
+            raise json.JSONDecodeError(f"Expecting one of {characters!r}", buffer, position)
+        position += 1
+        return character
+
+    expect("{")
+    if next_character() == "}":
+        return
+    while True:
+        match = PLAIN_PAIR.match(buffer, position)
+        if match:
+            position = match.end()
+            yield match.group(1), match.group(2)
+            if match.group(3) == "}":
+                return
+            continue
+        if next_character() != '"':
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", buffer, position)
+        key = next_value()
+        expect(":")
+        yield key, next_value()
+        if expect(",}") == "}":
+            return
+
+#parses bookkeeping.json from a binary file into a Bookkeeping; the file is read a chunk at a time and never
+#held as a dict or a list of all its pairs
+def load_bookkeeping(bookkeeping_file):
+    return Bookkeeping(iter_json_object(bookkeeping_file))
+
+#returns the "folder/file" doc key of the archive member name, or None if it is not a document
+#documents are the files of the subfolders of root, the folder holding bookkeeping.json
+def archive_doc_key(name, root):
+    if root:
+        if not name.startswith(root + "/"):
+            return None
+        name = name[len(root) + 1:]
+    parts = name.split("/")
+    if len(parts) != 2 or not all(parts):
+        return None
+    return name
+
+def archive_root(name):
+    return name[:-len(BOOKKEEPING_NAME)].rstrip("/")
+
+def document_folder(document):
+    return os.path.normpath(document[0]).split(os.sep)[-2]
+
+#yields (folder, documents of the folder) for the documents of a source
+#an archive keeps a folder's files together when it is written from a directory tree
+def group_by_folder(documents):
+    return itertools.groupby(documents, key=document_folder)
+
+class DirectorySource:
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def read_bookkeeping(self):
+        with open(os.path.join(self.path, BOOKKEEPING_NAME), 'rb') as bookkeeping_file:
+            return load_bookkeeping(bookkeeping_file)
+
+    #the subfolders and files in the order os.listdir returns them, like the indexer has always read them
+    def iter_paths(self):
+        for folder in os.listdir(self.path):
+            folder_path = os.path.join(self.path, folder)
+            if os.path.isdir(folder_path):
+                for file in os.listdir(folder_path):
+                    yield folder + "/" + file, os.path.join(folder_path, file)
+
+    def doc_keys(self):
+        return (doc_key for doc_key, _ in self.iter_paths())
+
+    #the tokenizer reads every file itself, in a worker process when there are workers
+    def documents(self, wanted=None):
+        for doc_key, file_path in self.iter_paths():
+            if wanted is None or wanted(doc_key):
+                yield file_path, None
+
+    def folders(self):
+        return group_by_folder(self.documents())
+
+#a tar archive, read front to back as a stream so it is never seeked or listed as a whole
+class TarSource:
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.root = None
+        self.bookkeeping = None
+        self.scanned_keys = None
+
+    #reads bookkeeping.json and the names of the documents in one pass; the documents are matched to their root
+    #afterwards because bookkeeping.json can come after them in the archive
+    def scan(self):
+        names = []
+        with tarfile.open(self.path, 'r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if os.path.basename(member.name) == BOOKKEEPING_NAME and self.bookkeeping is None:
+                    self.root = archive_root(member.name)
+                    self.bookkeeping = load_bookkeeping(archive.extractfile(member))
+                else:
+                    names.append(member.name)
+        if self.bookkeeping is None:
+            raise FileNotFoundError(f"{self.path} has no {BOOKKEEPING_NAME}")
+        self.scanned_keys = [doc_key for doc_key in (archive_doc_key(name, self.root) for name in names) if doc_key]
+
+    def read_bookkeeping(self):
+        if self.bookkeeping is None:
+            self.scan()
+        return self.bookkeeping
+
+    #the keys are dropped once they are handed out, so a source passed to other processes does not carry them
+    def doc_keys(self):
+        if self.scanned_keys is None:
+            self.scan()
+        doc_keys, self.scanned_keys = self.scanned_keys, None
+        return doc_keys
+
+    def documents(self, wanted=None):
+        if self.bookkeeping is None:
+            self.scan()
+        with tarfile.open(self.path, 'r|*') as archive:
+            for member in archive:
+                doc_key = archive_doc_key(member.name, self.root) if member.isfile() else None
+                if doc_key and (wanted is None or wanted(doc_key)):
+                    yield doc_key, archive.extractfile(member).read()
+
+    def folders(self):
+        return group_by_folder(self.documents())
+
+class ZipSource:
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with zipfile.ZipFile(self.path) as archive:
+            names = [name for name in archive.namelist() if os.path.basename(name) == BOOKKEEPING_NAME]
+        if not names:
+            raise FileNotFoundError(f"{self.path} has no {BOOKKEEPING_NAME}")
+        self.bookkeeping_name = min(names, key=len)
+        self.root = archive_root(self.bookkeeping_name)
+
+    def read_bookkeeping(self):
+        with zipfile.ZipFile(self.path) as archive, archive.open(self.bookkeeping_name) as bookkeeping_file:
+            return load_bookkeeping(bookkeeping_file)
+
+    def doc_keys(self):
+        with zipfile.ZipFile(self.path) as archive:
+            names = archive.namelist()
+        return [doc_key for doc_key in (archive_doc_key(name, self.root) for name in names) if doc_key]
+
+    #members are read in the order they are stored in the archive
+    def documents(self, wanted=None):
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                doc_key = archive_doc_key(info.filename, self.root) if not info.is_dir() else None
+                if doc_key and (wanted is None or wanted(doc_key)):
+                    yield doc_key, archive.read(info)
+
+    def folders(self):
+        return group_by_folder(self.documents())
+
+#yields (headers, content block) for every record of a WARC file; header names are lowercased
+#the content block is only read when read_content is set, otherwise it is skipped and None is yielded
+def iter_warc_records(warc_file, read_content=True):
+    while True:
+        line = warc_file.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        if not line.startswith(b"WARC/"):
+            raise ValueError(f"not a WARC record header: {line[:40]!r}")
+        headers = {}
+        for line in iter(warc_file.readline, b""):
+            if not line.strip():
+                break
+            name, _, value = line.decode('utf-8', 'replace').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if read_content:
+            yield headers, warc_file.read(length)
+        else:
+            warc_file.seek(length, io.SEEK_CUR)
+            yield headers, None
+
+#a WARC crawl; response and resource records are the documents, numbered in file order and given the doc keys
+#"0/0", "0/1", ... with WARC_FOLDER_SIZE documents per folder, and their WARC-Target-URI is their url
+class WarcSource:
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.bookkeeping = None
+
+    def open(self):
+        return gzip.open(self.path, 'rb') if self.path.endswith('.gz') else open(self.path, 'rb')
+
+    def iter_documents(self, read_content):
+        number = 0
+        with self.open() as warc_file:
+            for headers, block in iter_warc_records(warc_file, read_content):
+                record_type = headers.get("warc-type")
+                if record_type not in ("response", "resource"):
+                    continue
+                doc_key = f"{number // WARC_FOLDER_SIZE}/{number % WARC_FOLDER_SIZE}"
+                number += 1
+                yield doc_key, headers, block
+
+    def read_bookkeeping(self):
+        if self.bookkeeping is None:
+            self.bookkeeping = Bookkeeping((doc_key, headers.get("warc-target-uri", ""))
+                                           for doc_key, headers, _ in self.iter_documents(False))
+        return self.bookkeeping
+
+    #every document has a url, so the doc keys are the keys of the bookkeeping
+    def doc_keys(self):
+        return iter(self.read_bookkeeping())
+
+    #the HTTP status line and headers of a response record are cut off, leaving the page
+    def documents(self, wanted=None):
+        for doc_key, headers, block in self.iter_documents(True):
+            if wanted is not None and not wanted(doc_key):
+                continue
+            if headers.get("content-type", "").startswith("application/http"):
+                block = block.partition(b"\r\n\r\n")[2]
+            yield doc_key, block
+
+    def folders(self):
+        return group_by_folder(self.documents())
+
+#returns the corpus source for a WEBPAGES_RAW folder or an archive of one
+def open_corpus(path):
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    name = path.lower()
+    if name.endswith(TAR_SUFFIXES):
+        return TarSource(path)
+    if name.endswith('.zip'):
+        return ZipSource(path)
+    if name.endswith(WARC_SUFFIXES):
+        return WarcSource(path)
+    raise ValueError(f"{path} is not a folder or a .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .zip, .warc or "
+                     ".warc.gz archive")
@@ -3,15 +3,61 @@ import nltk
 import sqlite3
 from nltk.stem import WordNetLemmatizer
 from bs4 import BeautifulSoup
-from lxml import html
+from lxml import html, etree
 import math
-import json
 import time
+import queue
+import argparse
+import traceback
+import multiprocessing
+import functools
+import itertools
+from SpimiIndexer import SpimiInverter, DEFAULT_MEMORY_BUDGET
+from BinaryIndex import write_binary_index
+from TermDictionary import write_term_dictionary, create_final_postings_table
+from DocumentTable import DocumentNumbers, store_document_norms, write_document_table
+from NearDuplicates import NearDuplicateFilter, write_duplicates, print_duplicate_report
+from DocumentStore import DocumentStoreWriter, SNIPPET_LENGTH
+from CorpusSources import open_corpus
+from QueryRuntime import (load_stopwords, get_query_lemmatizer, normalize_query, fetch_postings,
+                          compute_cosine_similarity, fetch_doc_ordered_postings, fetch_max_weight, fetch_document_count,
+                          PostingsCursor, top_k_cosine_similarity, top_k_for_terms, write_query_lemmas)
+from Metrics import METRICS, Progress
 
-VALID_DOCUMENTS = 0
-UNIQUE_WORDS_SET = set()  # Global set to keep track of unique words
 L1_TAGS = ['head', 'title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
 L2_TAGS = ['b', 'i', 'em', 'u', 'mark', 'meta']
+INDEX_QUEUE_SIZE = 64  # Maximum number of finished documents waiting for the writer
+RESULT_POLL_INTERVAL = 1.0  # Seconds the writer waits for a result before it checks that the workers are alive
+TAG_WEIGHTS = dict([(tag, 2) for tag in L1_TAGS] + [(tag, 1.5) for tag in L2_TAGS])
+SKIPPED_TAGS = frozenset(['script', 'style'])  # never indexed, the same as BeautifulSoup's get_text
+LEMMA_CACHE_SIZE = 200000  # Maximum number of distinct words whose lemma is kept in memory
+TOKENIZERS = ["fast", "legacy"]
+DATABASE_PATH = 'index.db'
+DICTIONARY_PATH = 'terms.dict'
+DOCUMENT_STORE_PATH = 'docstore.bin'
+BINARY_INDEX_PATH = 'index.bin'
+BUILDING_SUFFIX = '.building'  # every index file is written to its .building name and renamed when all are complete
+HTML_PARSER = html.HTMLParser(encoding='utf-8')
+
+#holds the per-document counters that used to live in module globals
+#each worker keeps its own copy and the copies are merged once the corpus has been processed
+class IndexStatistics:
+
+    def __init__(self):
+        self.valid_documents = 0
+        self.unique_words = set()
+
+    #records one processed document
+    def add_document(self, postings_dict, is_valid):
+        if is_valid:
+            self.valid_documents += 1
+        self.unique_words.update(postings_dict.keys())
+
+    #folds the counters of another worker into this one
+    def merge(self, other):
+        self.valid_documents += other.valid_documents
+        self.unique_words.update(other.unique_words)
+        return self
 
 #given a subfolder path, this function returns the path the files as a list inside that subfolder
 def find_file_paths(subfolder_path):
@@ -27,35 +73,93 @@ def find_file_paths(subfolder_path):
     #returns the path list to the current_files
     return current_files
 
+#finds the name/Doc ID of a file_path
+#it will be "subfolder/docname"
+#for example, if the subfolder is 0 and the file name is 25, the DocID will be 0/25
+#this can be used to lookup the link later in the bookeeper.json file when returning search results
+def document_id(file_path):
+    path = os.path.normpath(file_path).split(os.sep)
+    return path[-2] + "/" + path[-1]
+
+#numbers the documents of the corpus source 0..N-1 in doc key order, so doc numbers sort like the "folder/file"
+#keys and postings store a small integer instead of the key; files bookkeeping.json does not list are numbered too
+#returns a DocumentNumbers mapping
+def number_documents(source, url_dict):
+    doc_keys = set(url_dict)
+    doc_keys.update(source.doc_keys())
+    return DocumentNumbers(doc_keys)
+
+#returns the text of a document: contents (the bytes read from an archive) decoded as utf-8, or the file at
+#file_path when there are no contents; line endings are translated like a file opened in text mode
+def read_document(file_path, contents=None):
+    if contents is None:
+        with open(file_path, 'r', encoding='utf-8') as open_file:
+            return open_file.read()
+    return contents.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+#returns the postings of one document (the output of calculate_tf) with doc numbers instead of doc keys
+#anchor text whose target is not a document of the corpus has no doc number and is left out; the anchor lookup
+#yields the target's url rather than its doc key, so those rows used to be stored under a doc id no document had
+#the doc number of each distinct doc key is looked up once, as nearly every row has the document's own key
+def number_postings(postings_dict, doc_numbers):
+    numbered = {}
+    numbers = {}
+    for token, values in postings_dict.items():
+        doc_key = values[0]
+        if doc_key not in numbers:
+            numbers[doc_key] = doc_numbers.get(doc_key)
+        number = numbers[doc_key]
+        if number is not None:
+            values[0] = number
+            numbered[token] = values
+    return numbered
+
+#extracts what the result list shows for a document from its parse tree:
+#the <title>, the meta description (or the start of the text) and a snippet of the text
+def extract_document_info(soup):
+    #titles are stored as plain str: a NavigableString keeps a reference into the whole parse tree, which
+    #then has to be pickled along with it when a worker process sends its doc_info to the writer
+    title = soup.find('title')
+    if title:
+        title = str(title.string) if title.string is not None else None
+
+    text = soup.get_text().replace('\n', ' ')
+    text = ' '.join(text.split())
+    snippet = text[0:SNIPPET_LENGTH]
+
+    description = soup.find('meta', attrs={'name' : 'description'})
+    if description:
+        description = description.get('content')
+    else:
+        description = snippet + "..."
+
+    return {"title": title or "No Title", "description": description or "No Description", "snippet": snippet}
+
 #function to create the tokenized results for a document (Modified Token, Document ID Pairs)
-def create_tokenizer_for_individual_doc(file_path, url_dict):
+#if doc_info is a dict it is filled in with the document's title, description and snippet
+def create_tokenizer_for_individual_doc(file_path, url_dict, doc_info=None, contents=None):
 
-    #finds the name/Doc ID of the current file_path
-    #it will be "subfolder/docname"
-    #for example, if the subfolder is 0 and the file name is 25, the DocID will be 0/25
-    #this can be used to lookup the link later in the bookeeper.json file when returning search results
-    path = os.path.normpath(file_path).split(os.sep)
-    fullDocID = path[-2] + "/" + path[-1]
+    fullDocID = document_id(file_path)
 
-    #opens the file_path
-    open_file = open(file_path, 'r', encoding='utf-8')
+    #opens the file_path, unless its contents were read from an archive
     try:
-        contents = open_file.read()
+        contents = read_document(file_path, contents)
     except:
         print("ERROR: Could not read file at DocId: {}".format(fullDocID))
+        METRICS.count("read_errors")
         return []
-    open_file.close()
-
-    global VALID_DOCUMENTS
-    print(f"\rFiles Read: {VALID_DOCUMENTS} | Current file DocId: {fullDocID}", end = "", flush = True)
 
     #extracts the html contents 
-    text_extracter = BeautifulSoup(contents, 'html.parser')
+    with METRICS.timer("parse"):
+        text_extracter = BeautifulSoup(contents, 'html.parser')
+        if doc_info is not None:
+            doc_info.update(extract_document_info(text_extracter))
 
     #list to hold (Modified Token, DocID, htmlWeight) pairs 
     token_DocID_list = []
 
     #sets the html tags by a tier-based ranking
+    tokenize_timer = METRICS.timer("tokenize").start()
     for tag in text_extracter.find_all():
 
         #gets the weight of the html tag
@@ -105,71 +209,194 @@ def create_tokenizer_for_individual_doc(file_path, url_dict):
             if word.isalpha() and word.isascii():
                 lemmatized_word = lemmatizer.lemmatize(word.lower())
                 token_DocID_list.append((lemmatized_word.lower(), fullDocID, weight))
-    
-    if len(token_DocID_list) > 0:
-        VALID_DOCUMENTS += 1
+    tokenize_timer.stop()
+
+    METRICS.count("documents")
+    METRICS.count("tokens", len(token_DocID_list))
+    return token_DocID_list
+
+LEMMATIZER = None
+
+#returns the lowercase lemma of a word, or None if the word is not alphabetic ASCII
+#lemmas are memoized because a small vocabulary makes up most of the words of any corpus
+@functools.lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_token(word):
+    global LEMMATIZER
+    if not (word.isalpha() and word.isascii()):
+        return None
+    if LEMMATIZER is None:
+        LEMMATIZER = WordNetLemmatizer()
+    return LEMMATIZER.lemmatize(word.lower()).lower()
+
+#parses a document with lxml; returns None if there is nothing to parse (an empty file, for example)
+def parse_html(contents):
+    try:
+        return html.document_fromstring(contents.encode('utf-8'), parser=HTML_PARSER)
+    except (etree.ParserError, ValueError):
+        return None
+
+#extract_document_info for an lxml tree whose text has already been collected
+def extract_tree_document_info(root, text):
+    title = root.find('.//title')
+    if title is not None:
+        title = str(title.text_content())
+
+    text = ' '.join(text.split())
+    snippet = text[0:SNIPPET_LENGTH]
+
+    description = root.find('.//meta[@name="description"]')
+    if description is not None:
+        description = description.get('content')
+    else:
+        description = snippet + "..."
+
+    return {"title": title or "No Title", "description": description or "No Description", "snippet": snippet}
+
+#walks the parse tree once and returns its (text, weight, DocID) segments in document order
+#every text node, tails included, gets the weight of its strongest enclosing L1/L2 tag; anchor text is also
+#returned as a segment of the anchor's target document
+def collect_text_segments(root, fullDocID, url_dict):
+    segments = []
+    #the stack holds (element, weight of the enclosing tags) and (tail text, weight) entries
+    stack = [(root, 1)]
+    while stack:
+        element, weight = stack.pop()
+        if isinstance(element, str):
+            segments.append((element, weight, fullDocID))
+            continue
+
+        if element.tail:
+            stack.append((element.tail, weight))
+        #comments and processing instructions have no str tag; only their tail is text
+        if not isinstance(element.tag, str) or element.tag in SKIPPED_TAGS:
+            continue
+        weight = max(weight, TAG_WEIGHTS.get(element.tag, 1))
+
+        #handles anchor text by adding the anchor text to the tokens of target
+        if element.tag == 'a':
+            anchor_words = element.text_content().strip()
+            if anchor_words:
+                targetDocID = url_dict.get(element.get('href'))
+                if targetDocID:
+                    segments.append((anchor_words, 1, targetDocID))
+
+        if element.text:
+            segments.append((element.text, weight, fullDocID))
+        for child in reversed(element):
+            stack.append((child, weight))
+    return segments
+
+#function to create the tokenized results for a document with a single pass over its parse tree
+#every text node is tokenized once and gets the weight of its strongest enclosing L1/L2 tag, where
+#create_tokenizer_for_individual_doc tokenizes the text again for each of its ancestors
+def create_fast_tokenizer_for_individual_doc(file_path, url_dict, doc_info=None, contents=None):
+
+    fullDocID = document_id(file_path)
+
+    #opens the file_path, unless its contents were read from an archive
+    try:
+        contents = read_document(file_path, contents)
+    except:
+        print("ERROR: Could not read file at DocId: {}".format(fullDocID))
+        METRICS.count("read_errors")
+        return []
+
+    with METRICS.timer("parse"):
+        root = parse_html(contents)
+    if root is None:
+        METRICS.count("empty_documents")
+        return []
+
+    with METRICS.timer("extract_text"):
+        segments = collect_text_segments(root, fullDocID, url_dict)
+        if doc_info is not None:
+            doc_info.update(extract_tree_document_info(root, " ".join(
+                text for text, _, doc_id in segments if doc_id == fullDocID)))
+
+    #adjacent segments with the same weight and DocID are tokenized together
+    with METRICS.timer("tokenize"):
+        runs = [(weight, doc_id, nltk.word_tokenize(" ".join(text for text, _, _ in group)))
+                for (weight, doc_id), group in itertools.groupby(segments, key=lambda segment: segment[1:])]
+
+    token_DocID_list = []
+    with METRICS.timer("lemmatize"):
+        for weight, doc_id, words in runs:
+            for word in words:
+                token = lemmatize_token(word)
+                if token:
+                    token_DocID_list.append((token, doc_id, weight))
+
+    METRICS.count("documents")
+    METRICS.count("tokens", len(token_DocID_list))
     return token_DocID_list
 
+#returns the tokenizer function for a --tokenizer choice
+def get_tokenizer(name):
+    if name == "legacy":
+        return create_tokenizer_for_individual_doc
+    return create_fast_tokenizer_for_individual_doc
+
 def create_document_postings(token_DocID_list):
-    global UNIQUE_WORDS_SET
     unique_tokens = 0
     postings_dict = {}
 
     #this section checks for stop words from stopwords.txt
-    stop_words = set()
-    try:
-        with open('stopwords.txt', 'r') as sw_file:
-            stop_words = {word.strip().lower() for word in sw_file.readlines()}
-    except FileNotFoundError:
-            print("stopwords.txt not found")
-
-    #this holds the position of the tokens in the list as we iterate
-    iter = 0
-    for token in token_DocID_list:
-        #if the token is not a stop word
-        if token[0] not in stop_words:
-            UNIQUE_WORDS_SET.add(token[0])
-            #if the token is already in the dictionary, update values
-            if token[0] in postings_dict:
-                #updates posting with docid, word count, and doc position
-                values = postings_dict[token[0]]
-                docid = values[0]
-                word_count = values[1]
-                doc_positions = values[2]
-                doc_positions.append(iter)
-                html_weight_dict = values[3]
-                if token[2] in html_weight_dict:
-                    html_weight_dict[token[2]] += 1
-                else:
-                    html_weight_dict[token[2]] = 1
-
-                #increments word count, and appends the current list position to the list of positions
-                postings_dict[token[0]] = [docid, word_count + 1, doc_positions, html_weight_dict]
+    stop_words = load_stopwords()
+
+    #drops the stop words but keeps the position of the remaining tokens in the list
+    with METRICS.timer("stopword_filter"):
+        kept_tokens = [(iter, token) for iter, token in enumerate(token_DocID_list) if token[0] not in stop_words]
+    METRICS.count("stopwords_removed", len(token_DocID_list) - len(kept_tokens))
+
+    postings_timer = METRICS.timer("postings").start()
+    for iter, token in kept_tokens:
+        #if the token is already in the dictionary, update values
+        if token[0] in postings_dict:
+            #updates posting with docid, word count, and doc position
+            values = postings_dict[token[0]]
+            docid = values[0]
+            word_count = values[1]
+            doc_positions = values[2]
+            doc_positions.append(iter)
+            html_weight_dict = values[3]
+            if token[2] in html_weight_dict:
+                html_weight_dict[token[2]] += 1
             else:
-                #creates new dictionary entry with docid, word count = 1, and doc position
-                docid = token[1]
-                word_count = 1
-                doc_positions = [iter]
-                html_weight_dict = {token[2]: 1}
-                postings_dict[token[0]] = [docid, word_count, doc_positions, html_weight_dict]
-                unique_tokens += 1
-        iter += 1
+                html_weight_dict[token[2]] = 1
+
+            #increments word count, and appends the current list position to the list of positions
+            postings_dict[token[0]] = [docid, word_count + 1, doc_positions, html_weight_dict]
+        else:
+            #creates new dictionary entry with docid, word count = 1, and doc position
+            docid = token[1]
+            word_count = 1
+            doc_positions = [iter]
+            html_weight_dict = {token[2]: 1}
+            postings_dict[token[0]] = [docid, word_count, doc_positions, html_weight_dict]
+            unique_tokens += 1
+    postings_timer.stop()
     return postings_dict
 
 # Set up sqlite3 database
-def setup_database():
+def setup_database(db_path='index.db'):
     # Initialize connection
-    conn = sqlite3.connect('index.db')
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
     # Create tables
     c.execute('''CREATE TABLE IF NOT EXISTS documents
-                 (id TEXT PRIMARY KEY, path TEXT)''')
+                 (id INTEGER PRIMARY KEY, doc_key TEXT, path TEXT)''')
     c.execute('''CREATE TABLE IF NOT EXISTS tokens
                  (token TEXT, doc_id INTEGER, frequency INTEGER, tf REAL, positions TEXT,
                   FOREIGN KEY(doc_id) REFERENCES documents(id))''')
     conn.commit()
     return conn
 
+#writes the doc number, doc key and url of every numbered document to the documents table
+def write_documents(conn, doc_numbers, url_dict):
+    conn.executemany('INSERT INTO documents (id, doc_key, path) VALUES (?, ?, ?)',
+                     ((number, doc_key, url_dict.get(doc_key)) for doc_key, number in doc_numbers.items()))
+    conn.commit()
+
 # Replaces all word_counts in postings_dict with term frequencies
 def calculate_tf(postings_dict):
     # Loop through token posting dictionary
@@ -192,6 +419,7 @@ def calculate_tf(postings_dict):
 
 # Stores tokens and posting values into database
 def store_tokens(conn, postings_dict):
+    insert_timer = METRICS.timer("sqlite_insert").start()
     c = conn.cursor()
     # Loop through tokens and values and insert every pair
     for token, values in postings_dict.items():
@@ -201,44 +429,46 @@ def store_tokens(conn, postings_dict):
         c.execute('INSERT INTO tokens (token, doc_id, frequency, tf, positions) VALUES (?, ?, ?, ?, ?)',
                   (token, doc_id, len(positions), tf, positions_string))
     conn.commit()
+    insert_timer.stop()
+    METRICS.count("rows_inserted", len(postings_dict))
 
 # Retrieves tokens and posting values into database
 def retrieve_tokens(conn, token=None):
     c = conn.cursor()
     # Check if token exists or not
     if token:
-        c.execute('SELECT * FROM final_postings WHERE token = ?', (token,))
+        c.execute('SELECT token, doc_id, positions, nweight FROM final_postings WHERE token = ?', (token,))
     else:
-        c.execute('SELECT * FROM final_postings')
+        c.execute('SELECT token, doc_id, positions, nweight FROM final_postings')
     
     rows = c.fetchall()
     return rows
 
-def calculate_weight(conn):
+def calculate_weight(conn, valid_documents, unique_words):
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS postings
             (token TEXT, doc_id INTEGER, frequency INTEGER, tf REAL, weight REAL, nweight REAL, positions TEXT,
             FOREIGN KEY(doc_id) REFERENCES documents(id))''') 
-    global UNIQUE_WORDS_SET
-    word_set = sorted(UNIQUE_WORDS_SET)
-    global VALID_DOCUMENTS
-    counter = 1
+    word_set = sorted(unique_words)
+    #Report processing progress
+    progress = Progress("Progress", len(word_set))
     for token in word_set:
-        #Report processing progress
-        print(f"\rProgress: {(counter/len(UNIQUE_WORDS_SET))*100:.2f}%", end="", flush= True)
-        counter += 1
+        progress.update()
 
         #for every token, calculate the idf
+        idf_timer = METRICS.timer("idf").start()
         c.execute('SELECT * FROM tokens WHERE token = ?', (token,))
         token_list = c.fetchall()
 
         document_count = len(token_list)
-        idf = math.log10(VALID_DOCUMENTS/(document_count + 1))
+        idf = math.log10(valid_documents/(document_count + 1))
         for posting in token_list:
             #calculate the weight using the tf and idf and update value in posting table
             token, doc_id, frequency, tf, positions = posting
             weight = posting[3]*idf
             c.execute('INSERT INTO postings (token, doc_id, frequency, tf, weight, positions) VALUES(?, ?, ?, ?, ?, ?)', (token, doc_id, frequency, tf, weight, positions))
+        idf_timer.stop()
+    progress.finish()
 
     c.execute('''DROP TABLE IF EXISTS tokens''')
 
@@ -248,18 +478,17 @@ def calculate_weight(conn):
 def normalize_weight(conn):
     c = conn.cursor()
     #creates new table to store final postings list
-    c.execute('''CREATE TABLE IF NOT EXISTS final_postings
-                 (token TEXT, doc_id INTEGER, positions TEXT, nweight REAL,
-                  FOREIGN KEY(doc_id) REFERENCES documents(id))''')
+    create_final_postings_table(c)
     #gets all unique docs
     c.execute('SELECT DISTINCT doc_id FROM postings')
     doc_list = c.fetchall()
-    counter = 1
+    magnitudes = []
+    #Report processing progress
+    progress = Progress("Progress", len(doc_list))
     for doc in doc_list:
-        #Report processing progress
-        print(f"\rProgress: {(counter/len(doc_list))*100:.2f}% | Current Doc: {doc}", end="", flush= True)
-        counter += 1
+        progress.update()
 
+        normalize_timer = METRICS.timer("normalize").start()
         #gets (token, weight) tuple for all postings with the same doc_id
         c.execute('SELECT token, weight, positions FROM postings WHERE doc_id = ?', (doc))
         #stores (token, weight) for all tokens in doc
@@ -270,89 +499,374 @@ def normalize_weight(conn):
             sum += math.pow(weight,2)
         #holds magnitude
         magnitude = math.sqrt(sum)
+        magnitudes.append((doc[0], magnitude))
 
         #normalizes the weights and stores it in new table
         for token, weight, positions in token_list:
             nweight = weight/magnitude
             c.execute('INSERT INTO final_postings (token, doc_id, positions, nweight) VALUES(?, ?, ?, ?)', (token, doc[0], positions, nweight))
+        normalize_timer.stop()
+    progress.finish()
+    store_document_norms(c, magnitudes)
 
     c.execute('''DROP TABLE IF EXISTS postings''')
     conn.commit()
 
-def compute_cosine_similarity(conn, query):
-    # Tokenize and lemmatize the query terms
-    lemmatizer = WordNetLemmatizer()
-    query_terms = nltk.word_tokenize(query)
-    query_terms = [lemmatizer.lemmatize(term.lower()) for term in query_terms if term.isalpha()]
-    # Initialize scores and length
-    scores = {}
-
-    # Initialize all doc_id's with default scores and length
-    c = conn.cursor()
-
-    # Calculate scores for each document
-    for term in query_terms:
-        c.execute('SELECT doc_id, nweight FROM final_postings WHERE token = ?', (term,))
-        postings = c.fetchall()
-        # Add to scores and length based on weight of doc_id
-        for doc_id, weight in postings:
-            if doc_id in scores:
-                scores[doc_id] += weight
-            else:
-                scores[doc_id] = weight
-
-    # Return sorted scores
-    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
-
-def main():
-    conn = setup_database()
-    #asks user for input to webpages_raw_directory
-    webpages_raw_directory = input("Please enter your path to the WEBPAGES_RAW Folder: ")
-
-    #gets the bookkeeping file as a json object
-    bookkeeping = open(os.path.join(webpages_raw_directory, "bookkeeping.json"), 'r')
-    bookkeeping_data = json.load(bookkeeping)
-    bookkeeping.close()
-
-    for doc, path in bookkeeping_data.items():
-        conn.execute('INSERT INTO documents VALUES (?, ?)', (doc, path))
-    start = time.time()
-    url_dict = {}
-    for key, value in bookkeeping_data.items():
-        url_dict[value] = key
+#records the largest score contribution any single document gets from each token
+#top_k_cosine_similarity uses these as upper bounds to skip documents that cannot reach the top k
+def write_term_stats(conn):
+    with METRICS.timer("term_stats"):
+        c = conn.cursor()
+        c.execute('DROP TABLE IF EXISTS term_stats')
+        c.execute('''CREATE TABLE term_stats
+                     (token TEXT PRIMARY KEY, df INTEGER, max_weight REAL)''')
+        c.execute('''INSERT INTO term_stats (token, df, max_weight)
+                     SELECT token, COUNT(*), MAX(doc_weight) FROM
+                     (SELECT token, doc_id, SUM(nweight) AS doc_weight FROM final_postings GROUP BY token, doc_id)
+                     GROUP BY token''')
+        conn.commit()
+
+#yields the path of every document file in the WEBPAGES_RAW folder in the order they are indexed
+def iter_document_paths(webpages_raw_directory):
     #loops through each subfolder
     for file in find_file_paths(webpages_raw_directory):
         #checks if the subfolder is a directory
         if os.path.isdir(file):
             #goes through each file in the subfolder
             for subfile in find_file_paths(file):
-                #tokenizes the document
-                token_DocID_list = create_tokenizer_for_individual_doc(subfile, bookkeeping_data)
-                #creates the token_list
-                postings_dict = create_document_postings(token_DocID_list)
-                # Calculate TF-IDF for token and document postings
-                postings_dict = calculate_tf(postings_dict)
-                # Store the tokens in the database
-                store_tokens(conn, postings_dict)
-
-    end = time.time()
-    print(f"\nTime Elapsed: {end-start:.2f} s")
+                yield subfile
+
+#runs the per-document stages (tokenize, postings, tf) with the named tokenizer
+#contents are the bytes of the document when it was read from an archive, None to read file_path
+#returns (doc_id, postings, doc_info) and whether the document was valid
+def process_document(file_path, url_dict, tokenizer=TOKENIZERS[0], contents=None):
+    doc_info = {}
+    #tokenizes the document
+    token_DocID_list = get_tokenizer(tokenizer)(file_path, url_dict, doc_info, contents)
+    #creates the token_list
+    postings_dict = create_document_postings(token_DocID_list)
+    # Calculate TF-IDF for token and document postings
+    with METRICS.timer("tf"):
+        postings_dict = calculate_tf(postings_dict)
+    return (document_id(file_path), postings_dict, doc_info), len(token_DocID_list) > 0
+
+#processes every document on the current core and calls sink(doc_id, postings, doc_info) in corpus order
+#documents are (file_path, contents) pairs from a corpus source
+def run_serial_pipeline(documents, url_dict, sink, tokenizer=TOKENIZERS[0]):
+    stats = IndexStatistics()
+    for file_path, contents in documents:
+        result, is_valid = process_document(file_path, url_dict, tokenizer, contents)
+        stats.add_document(result[1], is_valid)
+        sink(*result)
+    return stats
+
+#worker process loop: takes (sequence, path, contents) tasks until it receives None
+#the finished postings are put on the bounded result queue and the worker's metrics and statistics are sent last
+def index_worker(task_queue, result_queue, url_dict, tokenizer, metrics_settings):
+    METRICS.configure(**metrics_settings)
+    stats = IndexStatistics()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, file_path, contents = task
+        try:
+            result, is_valid = process_document(file_path, url_dict, tokenizer, contents)
+        except Exception:
+            result_queue.put(("error", traceback.format_exc()))
+            return
+        stats.add_document(result[1], is_valid)
+        result_queue.put((seq, result))
+    if METRICS.enabled:
+        METRICS.write_profiles(f".{os.getpid()}")
+        result_queue.put(("metrics", METRICS.state()))
+    result_queue.put(("done", stats))
+
+#raises if a worker died: killed (by the OOM killer, for example), crashed, or exited without its end marker
+#returns whether more workers have exited than sent their end marker; a worker flushes its results before it
+#exits, so if that was already the case at the previous check (stalled) and nothing arrived since, the end
+#marker is never coming
+def check_workers(workers, finished_workers, stalled):
+    for worker in workers:
+        if worker.exitcode is not None and worker.exitcode != 0:
+            raise RuntimeError(f"Indexing worker {worker.pid} exited with code {worker.exitcode}")
+    missing = sum(1 for worker in workers if worker.exitcode is not None) - finished_workers
+    if stalled and missing > 0:
+        raise RuntimeError(f"{missing} indexing worker(s) exited without finishing")
+    return missing > 0
+
+#processes documents on num_workers processes while this process acts as the single writer
+#results are handed to sink in the same order as the serial pipeline so both produce the same index
+#documents read from an archive are sent to the workers with their contents
+def run_parallel_pipeline(documents, url_dict, sink, num_workers, queue_size=INDEX_QUEUE_SIZE,
+                          tokenizer=TOKENIZERS[0]):
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue(maxsize=queue_size)
+    workers = [multiprocessing.Process(target=index_worker, args=(task_queue, result_queue, url_dict, tokenizer,
+                                                                     METRICS.settings()), daemon=True)
+               for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    #limits the number of documents in flight so out-of-order results cannot pile up in memory
+    window = queue_size + num_workers
+    documents = iter(documents)
+    stats = IndexStatistics()
+    pending = {}
+    submitted = 0
+    next_seq = 0
+    finished_workers = 0
+    exhausted = False
+    completed = False
+    stalled = False
+    try:
+        while True:
+            while not exhausted and submitted - next_seq < window:
+                document = next(documents, None)
+                if document is None:
+                    exhausted = True
+                    for _ in workers:
+                        task_queue.put(None)
+                else:
+                    task_queue.put((submitted,) + tuple(document))
+                    submitted += 1
+
+            if exhausted and next_seq == submitted and finished_workers == len(workers):
+                completed = True
+                break
+
+            try:
+                seq, result = result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                stalled = check_workers(workers, finished_workers, stalled)
+                continue
+            stalled = False
+            if seq == "error":
+                raise RuntimeError("Indexing worker failed:\n" + result)
+            if seq == "metrics":
+                METRICS.merge(result)
+                continue
+            if seq == "done":
+                stats.merge(result)
+                finished_workers += 1
+                #a worker's results are sent before its end marker, so once every worker is done any missing
+                #result was lost on the way (the worker could not pickle it)
+                lost = submitted - next_seq - len(pending)
+                if finished_workers == len(workers) and lost:
+                    raise RuntimeError(f"Indexing workers finished without sending {lost} results; "
+                                       "see the worker errors above")
+                continue
+
+            #writes every result that is next in corpus order
+            pending[seq] = result
+            while next_seq in pending:
+                sink(*pending.pop(next_seq))
+                next_seq += 1
+    finally:
+        for worker in workers:
+            if not completed:
+                worker.terminate()
+            worker.join()
+
+    return stats
+
+#tokenizes the whole corpus source, passes every document's postings to store with doc numbers from doc_numbers
+#and returns the merged statistics
+#the title, description and snippet of every document are written to doc_store
+#with a duplicate_filter, near-duplicates of an earlier document are neither stored nor counted as valid documents
+def index_corpus(store, source, url_dict, doc_numbers, num_workers=1, doc_store=None, tokenizer=TOKENIZERS[0],
+                 duplicate_filter=None):
+    progress = Progress("Files Read")
+
+    def write_postings(doc_id, postings_dict, doc_info):
+        postings_dict = number_postings(postings_dict, doc_numbers)
+        progress.update()
+        if duplicate_filter is not None and duplicate_filter.check(doc_numbers[doc_id], postings_dict) is not None:
+            return
+        store(postings_dict)
+        if doc_store is not None and doc_info:
+            doc_store.add(doc_id, doc_info)
+
+    if num_workers > 1:
+        stats = run_parallel_pipeline(source.documents(), url_dict, write_postings, num_workers, tokenizer=tokenizer)
+    else:
+        stats = run_serial_pipeline(source.documents(), url_dict, write_postings, tokenizer)
+    progress.finish()
+    if duplicate_filter is not None:
+        stats.valid_documents -= len(duplicate_filter.duplicates)
+    return stats
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Builds index.db from a WEBPAGES_RAW folder or an archive of one.")
+    parser.add_argument("webpages_raw_directory", nargs="?",
+                        help="path to the WEBPAGES_RAW folder, or a .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz or .zip "
+                             "archive of it, or a .warc or .warc.gz crawl, which are read without being extracted "
+                             "(asked for interactively when omitted)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse and tokenize documents (default: 1, serial)")
+    parser.add_argument("--build", choices=["sql", "spimi", "vectorized", "bulk"], default="sql",
+                        help="sql: tokens/postings tables weighted in SQLite; "
+                             "spimi: in-memory inversion with sorted runs and a k-way merge; "
+                             "vectorized: one sparse doc-term matrix weighted with NumPy array operations; "
+                             "bulk: batched inserts and set-based weighting with per-folder and per-phase "
+                             "checkpoints, resumed by running the same command again")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help="megabytes of postings the spimi build keeps in memory before flushing a run")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="partition the documents by doc id into N shard indexes in --shard-dir, each built by "
+                             "its own process with corpus-wide idf statistics")
+    parser.add_argument("--shard-dir", default="shards", help="where --shards writes the shard indexes")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="index only the first of each group of near-duplicate documents (SimHash) and record "
+                             "the others in the duplicates table; not available with --shards")
+    parser.add_argument("--binary-index", action="store_true",
+                        help="also write index.bin, the compressed memory-mapped postings format")
+    parser.add_argument("--tokenizer", choices=TOKENIZERS, default=TOKENIZERS[0],
+                        help="fast: single lxml pass over each document; "
+                             "legacy: BeautifulSoup, re-tokenizing the text of every tag")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="record stage timers and counters and write them to PATH "
+                             "(Prometheus text if PATH ends in .prom, json otherwise)")
+    parser.add_argument("--profile", metavar="STAGE", action="append", default=[],
+                        help="run STAGE (parse, tokenize, lemmatize, sqlite_insert, idf, normalize, ...) under "
+                             "cProfile; can be repeated")
+    parser.add_argument("--profile-dir", default="profiles", help="where --profile writes its .prof files")
+    return parser.parse_args()
 
-    print("\nCorpus Processed. Now calculating tf-idf weight for tokens...")
+def main():
+    args = parse_arguments()
+    if args.metrics or args.profile:
+        METRICS.configure(True, args.profile, args.profile_dir)
+    #asks user for input to webpages_raw_directory
+    webpages_raw_directory = args.webpages_raw_directory
+    if not webpages_raw_directory:
+        webpages_raw_directory = input("Please enter your path to the WEBPAGES_RAW Folder: ")
+
+    #opens the folder or archive and gets the bookkeeping file as a compact doc key -> url mapping
+    source = open_corpus(webpages_raw_directory)
+    bookkeeping_data = source.read_bookkeeping()
+
+    if args.shards > 1:
+        if args.near_duplicates:
+            print("--near-duplicates is not available with --shards")
+            return
+        #imported here because ShardedIndex builds on this module
+        from ShardedIndex import build_shards
+        start = time.time()
+        valid_documents, vocabulary_size = build_shards(source, bookkeeping_data, args.shards,
+                                                        args.shard_dir, args.workers if args.workers > 1 else None,
+                                                        args.tokenizer, args.memory_budget * 1024 * 1024,
+                                                        args.binary_index)
+        print(f"\nSharded index complete! {args.shards} shards written to {args.shard_dir} in {time.time() - start:.2f} s. "
+              f"Files successfully read: {valid_documents}")
+        print(f"Total unique words across all documents: {vocabulary_size}")
+        if args.metrics:
+            print(f"Metrics written to {METRICS.write(args.metrics)}")
+        return
+
+    #the index is built in index.db.building and renamed to index.db once it is complete, so queries never see a
+    #partial index and a previous index.db is replaced rather than appended to
+    building_path = DATABASE_PATH + BUILDING_SUFFIX
+    if args.build == "bulk":
+        #imported here because BulkIndexer builds on this module
+        from BulkIndexer import build_index
+        stats = build_index(building_path, source, bookkeeping_data, args.workers, args.tokenizer,
+                            DICTIONARY_PATH + BUILDING_SUFFIX, DOCUMENT_STORE_PATH + BUILDING_SUFFIX,
+                            args.near_duplicates)
+        conn = sqlite3.connect(building_path)
+        publish_index(conn, building_path, stats, args)
+        return
+
+    if os.path.exists(building_path):
+        os.remove(building_path)
+    conn = setup_database(building_path)
+    doc_numbers = number_documents(source, bookkeeping_data)
+    write_documents(conn, doc_numbers, bookkeeping_data)
     start = time.time()
-    calculate_weight(conn)
-    end = time.time()
-    print(f"\nTime Elapsed: {end-start:.2f} s")
+    doc_store = DocumentStoreWriter(DOCUMENT_STORE_PATH + BUILDING_SUFFIX)
+    duplicate_filter = NearDuplicateFilter() if args.near_duplicates else None
+    if args.build == "spimi":
+        inverter = SpimiInverter(args.memory_budget * 1024 * 1024)
+        stats = index_corpus(inverter.add_document, source, bookkeeping_data, doc_numbers,
+                             args.workers, doc_store, args.tokenizer, duplicate_filter)
+    elif args.build == "vectorized":
+        #imported here so NumPy is only needed by this build
+        from SparseIndexer import SparseInverter
+        inverter = SparseInverter()
+        stats = index_corpus(inverter.add_document, source, bookkeeping_data, doc_numbers,
+                             args.workers, doc_store, args.tokenizer, duplicate_filter)
+    else:
+        stats = index_corpus(lambda postings_dict: store_tokens(conn, postings_dict), source, bookkeeping_data,
+                             doc_numbers, args.workers, doc_store, args.tokenizer, duplicate_filter)
+    doc_store.close()
+    if duplicate_filter is not None:
+        write_duplicates(conn, duplicate_filter)
 
-    start = time.time()
-    normalize_weight(conn)
     end = time.time()
     print(f"\nTime Elapsed: {end-start:.2f} s")
 
-    db_size = int(os.path.getsize(os.path.join(os.getcwd(), "index.db"))/1000)
-
-    print(f"\nDatabase complete! Files successfully read: {VALID_DOCUMENTS} Size of database: {db_size} kb")
-    print(f"Total unique words across all documents: {len(UNIQUE_WORDS_SET)}")
+    if args.build == "vectorized":
+        print("\nCorpus Processed. Now calculating tf-idf weights over the doc-term matrix...")
+        start = time.time()
+        inverter.merge(conn, stats.valid_documents)
+        end = time.time()
+        print(f"\nTime Elapsed: {end-start:.2f} s")
+    elif args.build == "spimi":
+        print("\nCorpus Processed. Now merging runs and calculating tf-idf weights...")
+        start = time.time()
+        inverter.merge(conn, stats.valid_documents)
+        end = time.time()
+        print(f"\nTime Elapsed: {end-start:.2f} s")
+    else:
+        print("\nCorpus Processed. Now calculating tf-idf weight for tokens...")
+        start = time.time()
+        calculate_weight(conn, stats.valid_documents, stats.unique_words)
+        end = time.time()
+        print(f"\nTime Elapsed: {end-start:.2f} s")
+
+        start = time.time()
+        normalize_weight(conn)
+        end = time.time()
+        print(f"\nTime Elapsed: {end-start:.2f} s")
+
+    write_term_stats(conn)
+    write_term_dictionary(conn, DICTIONARY_PATH + BUILDING_SUFFIX)
+    write_query_lemmas(conn)
+    write_document_table(conn)
+    publish_index(conn, building_path, stats, args)
+
+#writes index.bin if asked for, renames the finished files to their final names and prints the summary
+#terms.dict, docstore.bin and index.bin hold doc numbers and rowid ranges of the index.db they were built with,
+#so they are only renamed here, together with index.db and right before it: an interrupted build leaves the
+#previous index untouched. A renamed file whose .building file is gone was already published by an earlier,
+#interrupted publish of the same build.
+def publish_index(conn, building_path, stats, args):
+    if args.binary_index:
+        write_binary_index(conn, BINARY_INDEX_PATH + BUILDING_SUFFIX)
+    if args.near_duplicates:
+        print_duplicate_report(conn)
+    conn.close()
+    sidecar_paths = [DICTIONARY_PATH, DOCUMENT_STORE_PATH] + ([BINARY_INDEX_PATH] if args.binary_index else [])
+    for path in sidecar_paths:
+        if os.path.exists(path + BUILDING_SUFFIX):
+            os.replace(path + BUILDING_SUFFIX, path)
+    #an index.bin of the previous index would not match the new index.db
+    if not args.binary_index and os.path.exists(BINARY_INDEX_PATH):
+        os.remove(BINARY_INDEX_PATH)
+        print(f"\nRemoved the {BINARY_INDEX_PATH} of the previous index")
+    os.replace(building_path, DATABASE_PATH)
+    if args.binary_index:
+        bin_size = int(os.path.getsize(os.path.join(os.getcwd(), BINARY_INDEX_PATH))/1000)
+        print(f"\nBinary index written to index.bin. Size: {bin_size} kb")
+    db_size = int(os.path.getsize(os.path.join(os.getcwd(), DATABASE_PATH))/1000)
+
+    print(f"\nDatabase complete! Files successfully read: {stats.valid_documents} Size of database: {db_size} kb")
+    print(f"Total unique words across all documents: {len(stats.unique_words)}")
+
+    if args.metrics:
+        print(f"Metrics written to {METRICS.write(args.metrics)}")
+    for path in METRICS.write_profiles():
+        print(f"Profile written to {path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
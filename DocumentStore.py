@@ -0,0 +1,138 @@
+import os
+import mmap
+import zlib
+import struct
+from BinaryIndex import encode_varbyte, decode_varbyte
+
+DOCUMENT_STORE_MAGIC = b"SCDS"
+DOCUMENT_STORE_VERSION = 1
+RECORDS_PER_BLOCK = 64  # records are compressed together in blocks so zlib sees enough text to work with
+SNIPPET_LENGTH = 300
+
+#header: magic, version, record count, block count, block index offset, key table offset
+HEADER_FORMAT = "<4sIIIQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FIELDS = ("title", "description", "snippet")
+
+#writes (doc_id -> title, description, snippet) records to a block-compressed, random-access file
+#records are buffered RECORDS_PER_BLOCK at a time, so memory use does not grow with the corpus
+class DocumentStoreWriter:
+
+    def __init__(self, path='docstore.bin'):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.store_file = open(self.temp_path, 'wb')
+        self.store_file.write(b"\0" * HEADER_SIZE)
+        self.block_offsets = []
+        self.key_table = bytearray()
+        self.block = bytearray()
+        self.block_records = 0
+        self.record_count = 0
+
+    #adds the title, description and snippet of one document; doc_info is the dict filled in by the tokenizer
+    def add(self, doc_id, doc_info):
+        encoded_key = doc_id.encode('utf-8')
+        encode_varbyte(len(encoded_key), self.key_table)
+        self.key_table += encoded_key
+        encode_varbyte(len(self.block_offsets), self.key_table)
+        encode_varbyte(self.block_records, self.key_table)
+
+        for field in FIELDS:
+            encoded_value = (doc_info.get(field) or "").encode('utf-8')
+            encode_varbyte(len(encoded_value), self.block)
+            self.block += encoded_value
+        self.block_records += 1
+        self.record_count += 1
+        if self.block_records == RECORDS_PER_BLOCK:
+            self.flush_block()
+
+    def flush_block(self):
+        if self.block_records == 0:
+            return
+        self.block_offsets.append(self.store_file.tell())
+        self.store_file.write(zlib.compress(bytes(self.block)))
+        self.block = bytearray()
+        self.block_records = 0
+
+    #writes the block index and key table and moves the finished file into place
+    def close(self):
+        self.flush_block()
+        block_index_offset = self.store_file.tell()
+        #one extra offset marks the end of the last block
+        self.store_file.write(struct.pack(f"<{len(self.block_offsets) + 1}Q", *self.block_offsets, block_index_offset))
+        key_table_offset = self.store_file.tell()
+        self.store_file.write(self.key_table)
+        self.store_file.seek(0)
+        self.store_file.write(struct.pack(HEADER_FORMAT, DOCUMENT_STORE_MAGIC, DOCUMENT_STORE_VERSION,
+                                          self.record_count, len(self.block_offsets),
+                                          block_index_offset, key_table_offset))
+        self.store_file.close()
+        os.replace(self.temp_path, self.path)
+
+#memory-mapped reader for files written by DocumentStoreWriter
+class DocumentStoreReader:
+
+    def __init__(self, path='docstore.bin'):
+        self.path = path
+        self.store_file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_count, block_count, block_index_offset, key_table_offset = \
+            struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != DOCUMENT_STORE_MAGIC or version != DOCUMENT_STORE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {DOCUMENT_STORE_VERSION} document store")
+
+        self.block_offsets = struct.unpack_from(f"<{block_count + 1}Q", self.buffer, block_index_offset)
+        self.locations = {}
+        offset = key_table_offset
+        for _ in range(record_count):
+            length, offset = decode_varbyte(self.buffer, offset)
+            doc_id = self.buffer[offset:offset + length].decode('utf-8')
+            offset += length
+            block, offset = decode_varbyte(self.buffer, offset)
+            slot, offset = decode_varbyte(self.buffer, offset)
+            self.locations[doc_id] = (block, slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+        self.store_file.close()
+
+    def __len__(self):
+        return len(self.locations)
+
+    #decompresses one block into a list of {title, description, snippet} records
+    def read_block(self, block):
+        data = zlib.decompress(self.buffer[self.block_offsets[block]:self.block_offsets[block + 1]])
+        records = []
+        offset = 0
+        while offset < len(data):
+            record = {}
+            for field in FIELDS:
+                length, offset = decode_varbyte(data, offset)
+                record[field] = data[offset:offset + length].decode('utf-8')
+                offset += length
+            records.append(record)
+        return records
+
+    #returns {doc_id: record} for every doc_id in the store, decompressing each needed block once
+    def get_many(self, doc_ids):
+        wanted = {}
+        for doc_id in doc_ids:
+            location = self.locations.get(doc_id)
+            if location:
+                wanted.setdefault(location[0], []).append((doc_id, location[1]))
+        records = {}
+        for block in sorted(wanted):
+            block_records = self.read_block(block)
+            for doc_id, slot in wanted[block]:
+                records[doc_id] = block_records[slot]
+        return records
+
+    def get(self, doc_id):
+        return self.get_many([doc_id]).get(doc_id)
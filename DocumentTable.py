@@ -0,0 +1,203 @@
+import sys
+import time
+import bisect
+import random
+import sqlite3
+import itertools
+from array import array
+from collections.abc import Mapping
+
+#typecode of every numeric column; string columns are stored with the typecode 's'
+NUMERIC_COLUMNS = {"norm": 'd', "length": 'q'}
+STRING_COLUMNS = ("doc_key", "url")
+
+#Documents are numbered 0..N-1 in doc key order when an index is built, and postings store these doc numbers.
+#The documents table maps each number back to its "folder/file" key and url; the document table holds the same
+#per-document data as columns indexed by doc number, so query code reads a document's key, url, norm or length
+#with a list index instead of a lookup in the documents table:
+#  doc_key, url: the utf-8 strings back to back, after an array of their count + 1 start offsets
+#  norm:         the magnitude of the document's tf-idf vector, which its nweights were divided by
+#  length:       the number of term occurrences indexed for the document (anchor text included)
+#Each column is one BLOB row of the document_columns table, so it is part of index.db and is replaced
+#together with the postings it describes. A shard's columns start at the first doc number of its range.
+def store_document_norms(c, norms):
+    c.execute('DROP TABLE IF EXISTS doc_norms')
+    c.execute('CREATE TABLE doc_norms (doc_id INTEGER PRIMARY KEY, magnitude REAL)')
+    c.executemany('INSERT INTO doc_norms (doc_id, magnitude) VALUES (?, ?)', norms)
+
+def encode_string_column(values):
+    offsets = array('q', [0])
+    data = bytearray()
+    for value in values:
+        data += (value or "").encode('utf-8')
+        offsets.append(len(data))
+    return offsets.tobytes() + data
+
+#writes the document table of index.db from its documents table, the doc_norms table the build left behind
+#(store_document_norms) and the positions of final_postings, then drops doc_norms
+#a build that was interrupted after doc_norms was dropped already has its table, so running this again is a no-op
+def write_document_table(conn):
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'doc_norms'")
+    if c.fetchone() is None:
+        return
+    c.execute('SELECT MIN(id), MAX(id) FROM documents')
+    first, last = c.fetchone()
+    first = first or 0
+    count = last - first + 1 if last is not None else 0
+
+    doc_keys = [None] * count
+    urls = [None] * count
+    for doc, doc_key, url in c.execute('SELECT id, doc_key, path FROM documents'):
+        doc_keys[doc - first] = doc_key
+        urls[doc - first] = url
+    norms = array('d', bytes(8 * count))
+    for doc, magnitude in c.execute('SELECT doc_id, magnitude FROM doc_norms'):
+        norms[doc - first] = magnitude
+    lengths = array('q', bytes(8 * count))
+    for doc, positions in c.execute('SELECT doc_id, positions FROM final_postings'):
+        lengths[doc - first] += positions.count(' ') + 1 if positions else 0
+
+    c.execute('DROP TABLE IF EXISTS document_columns')
+    c.execute('''CREATE TABLE document_columns
+                 (name TEXT PRIMARY KEY, typecode TEXT, first INTEGER, count INTEGER, data BLOB)''')
+    rows = [("doc_key", 's', first, count, encode_string_column(doc_keys)),
+            ("url", 's', first, count, encode_string_column(urls)),
+            ("norm", NUMERIC_COLUMNS["norm"], first, count, norms.tobytes()),
+            ("length", NUMERIC_COLUMNS["length"], first, count, lengths.tobytes())]
+    c.executemany('INSERT INTO document_columns (name, typecode, first, count, data) VALUES (?, ?, ?, ?, ?)', rows)
+    c.execute('DROP TABLE doc_norms')
+    conn.commit()
+
+#a string column; column[i] decodes the i-th string
+class StringColumn:
+    __slots__ = ('offsets', 'data')
+
+    def __init__(self, data, count):
+        self.offsets = array('q')
+        self.offsets.frombytes(data[:8 * (count + 1)])
+        self.data = data[8 * (count + 1):]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    #the utf-8 bytes of every string, in order; bytes sort like the strings they encode
+    def encoded(self):
+        data, offsets = self.data, self.offsets
+        return (data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1))
+
+    def extend(self, values):
+        self.extend_encoded([(value or "").encode('utf-8') for value in values])
+
+    def extend_encoded(self, encoded):
+        offsets = itertools.accumulate(map(len, encoded), initial=len(self.data))
+        next(offsets)
+        self.offsets.extend(offsets)
+        self.data += b"".join(encoded)
+
+#returns a StringColumn holding the strings of values; more can be added with extend
+def string_column(values):
+    column = StringColumn(bytearray(8), 0)
+    column.extend(values)
+    return column
+
+#maps the doc key of every document of a build to its doc number, the position of the key in sorted order
+#the keys are held in one StringColumn instead of a dict, so a corpus of millions of documents costs little
+#more than the bytes of its keys; a lookup is a binary search over the column
+class DocumentNumbers(Mapping):
+
+    def __init__(self, doc_keys):
+        self.keys = string_column(sorted(doc_keys))
+
+    def __getitem__(self, doc_key):
+        number = bisect.bisect_left(self.keys, doc_key)
+        if number < len(self.keys) and self.keys[number] == doc_key:
+            return number
+        raise KeyError(doc_key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return (self.keys[number] for number in range(len(self.keys)))
+
+    def items(self):
+        return ((self.keys[number], number) for number in range(len(self.keys)))
+
+#the columns of a document table, read from index.db in one query
+#numeric columns are arrays, so column[doc - first] costs no more than a list index
+class DocumentTable:
+
+    def __init__(self, rows):
+        self.columns = {}
+        self.first = 0
+        self.count = 0
+        for name, typecode, first, count, data in rows:
+            if typecode == 's':
+                self.columns[name] = StringColumn(data, count)
+            else:
+                self.columns[name] = array(typecode)
+                self.columns[name].frombytes(data)
+            self.first = first
+            self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, doc):
+        return isinstance(doc, int) and self.first <= doc < self.first + self.count
+
+    def column(self, name):
+        return self.columns[name]
+
+    def value(self, name, doc):
+        return self.columns[name][doc - self.first]
+
+    #returns {doc: value} for the docs of doc_ids that are in the table
+    def values(self, name, doc_ids):
+        column = self.columns[name]
+        first = self.first
+        return {doc: column[doc - first] for doc in doc_ids if doc in self}
+
+#returns the DocumentTable of an index.db connection, or None if the index has none (an index built before
+#documents were numbered, or a segment catalog)
+def open_document_table(conn):
+    try:
+        c = conn.cursor()
+        c.execute('SELECT name, typecode, first, count, data FROM document_columns')
+        return DocumentTable(c.fetchall())
+    except sqlite3.OperationalError:
+        return None
+
+#compares url lookups through the document table with lookups in the documents table
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'index.db'
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    table = open_document_table(conn)
+    load_ms = (time.perf_counter() - start) * 1000
+    if table is None:
+        print(f"{db_path} has no document table; rebuild it with CreateInvertedIndex.py")
+        return
+    print(f"Document table: {len(table)} documents loaded in {load_ms:.2f} ms")
+
+    rng = random.Random(0)
+    samples = [[rng.randrange(table.first, table.first + len(table)) for _ in range(20)] for _ in range(500)]
+    start = time.perf_counter()
+    for doc_ids in samples:
+        table.values("url", doc_ids)
+    table_ms = (time.perf_counter() - start) * 1000 / len(samples)
+    c = conn.cursor()
+    start = time.perf_counter()
+    for doc_ids in samples:
+        c.execute(f'SELECT id, path FROM documents WHERE id IN ({", ".join("?" * len(doc_ids))})', doc_ids)
+        c.fetchall()
+    sql_ms = (time.perf_counter() - start) * 1000 / len(samples)
+    print(f"20 urls per result page: document table {table_ms:.3f} ms | documents table {sql_ms:.3f} ms")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import time
+import cProfile
+
+PROGRESS_INTERVAL = 0.5  # minimum seconds between two progress lines
+METRIC_PREFIX = "search_engine"
+
+#returned by Metrics.timer while metrics are disabled, so an instrumented block only costs one method call
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+NULL_TIMER = NullTimer()
+
+#times one run of a stage and, if the stage is being profiled, runs it under that stage's profiler
+class StageTimer:
+    __slots__ = ('metrics', 'name', 'started', 'profiler')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.profiler = self.metrics.start_profile(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.metrics.stop_profile(self.profiler)
+        self.metrics.observe(self.name, elapsed)
+        return False
+
+    #start() and stop() time code that cannot be wrapped in a with block
+    def start(self):
+        self.__enter__()
+        return self
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+#stage timers and counters for the indexer and the query path
+#everything is a no-op until configure(enabled=True) is called; stages named in profile_stages are also run
+#under cProfile and their statistics are written to profile_directory/<stage>.prof
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_stages = frozenset()
+        self.profile_directory = 'profiles'
+        self.reset()
+
+    def configure(self, enabled=True, profile_stages=(), profile_directory='profiles'):
+        self.enabled = enabled
+        self.profile_stages = frozenset(profile_stages)
+        self.profile_directory = profile_directory
+
+    #the arguments of configure, so worker processes can be set up the same way
+    def settings(self):
+        return {"enabled": self.enabled, "profile_stages": sorted(self.profile_stages),
+                "profile_directory": self.profile_directory}
+
+    def reset(self):
+        #name -> [calls, total seconds, longest call in seconds]
+        self.timers = {}
+        self.counters = {}
+        self.profilers = {}
+        self.active_profiler = None
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def observe(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    #only one profiler can run at a time, so a profiled stage nested in another one is profiled as part of it
+    def start_profile(self, name):
+        if name not in self.profile_stages or self.active_profiler is not None:
+            return None
+        profiler = self.profilers.get(name)
+        if profiler is None:
+            profiler = self.profilers[name] = cProfile.Profile()
+        self.active_profiler = profiler
+        profiler.enable()
+        return profiler
+
+    def stop_profile(self, profiler):
+        profiler.disable()
+        self.active_profiler = None
+
+    #writes one .prof file per profiled stage (readable with pstats or snakeviz) and returns their paths
+    #worker processes pass a suffix so their files do not overwrite each other
+    def write_profiles(self, suffix=""):
+        paths = []
+        if self.profilers:
+            os.makedirs(self.profile_directory, exist_ok=True)
+        for name, profiler in self.profilers.items():
+            path = os.path.join(self.profile_directory, f"{name}{suffix}.prof")
+            profiler.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    #raw timers and counters, small enough to send from a worker process to the writer
+    def state(self):
+        return {"timers": {name: list(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters)}
+
+    #folds the state of another process into this one
+    def merge(self, state):
+        for name, (calls, total, longest) in state["timers"].items():
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [calls, total, longest]
+            else:
+                timer[0] += calls
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+        for name, value in state["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        return {"timers": {name: {"calls": calls, "total_seconds": total, "mean_seconds": total / calls,
+                                  "max_seconds": longest}
+                           for name, (calls, total, longest) in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items()))}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    #Prometheus text exposition format
+    def to_prometheus(self):
+        lines = [f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+                 f"# TYPE {METRIC_PREFIX}_stage_calls_total counter",
+                 f"# TYPE {METRIC_PREFIX}_stage_max_seconds gauge"]
+        for name, (calls, total, longest) in sorted(self.timers.items()):
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{name}"}} {total!r}')
+            lines.append(f'{METRIC_PREFIX}_stage_calls_total{{stage="{name}"}} {calls}')
+            lines.append(f'{METRIC_PREFIX}_stage_max_seconds{{stage="{name}"}} {longest!r}')
+        for name, value in sorted(self.counters.items()):
+            metric = f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    #writes a snapshot to path: Prometheus text for .prom files, json otherwise
+    def write(self, path):
+        with open(path, 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+        return path
+
+#the metrics of this process, shared by every module
+METRICS = Metrics()
+
+#prints "\r<label>: <count or percentage>" at most every PROGRESS_INTERVAL seconds instead of once per item
+class Progress:
+
+    def __init__(self, label, total=None, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.last_print = 0.0
+
+    def update(self, done=None):
+        self.done = self.done + 1 if done is None else done
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            self.print()
+
+    def print(self):
+        if self.total:
+            print(f"\r{self.label}: {(self.done / self.total) * 100:.2f}%", end="", flush=True)
+        else:
+            print(f"\r{self.label}: {self.done}", end="", flush=True)
+
+    #prints the final count; like the other progress lines it is left without a newline
+    def finish(self):
+        self.print()
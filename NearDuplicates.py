@@ -0,0 +1,154 @@
+import sys
+import sqlite3
+import hashlib
+import functools
+
+FINGERPRINT_BITS = 64
+BANDS = 6  # the fingerprint is split into 6 bands of 10 or 11 bits for the LSH lookup
+MAX_DISTANCE = 5  # fingerprints at most this many bits apart are near-duplicates; they always share a band
+LANE_BITS = 32  # every fingerprint bit sums its token weights in its own 32-bit lane of one big int
+TOKEN_CACHE_SIZE = 200000
+
+#Near-duplicate pages (mirrors, calendar pages, urls that only differ in a session parameter) are found while
+#the corpus is tokenized, from the postings of every document:
+#  fingerprint: a 64-bit SimHash of the document's distinct tokens, so documents that share most of their tokens
+#               get fingerprints that differ in only a few bits. Tokens are not weighted by their frequency:
+#               the few most frequent words of a language would then decide most bits, and unrelated pages
+#               would get near fingerprints
+#  lookup:      the fingerprint's bands are looked up in one table per band; two fingerprints at most
+#               MAX_DISTANCE bits apart differ in at most MAX_DISTANCE bands, so they agree on at least one of the
+#               BANDS bands, and only documents that share a band are compared
+#The first document of a cluster in corpus order is its canonical document and is indexed; the later members
+#are not indexed and are recorded in the duplicates table of index.db with the doc number of their canonical
+#document, so their urls are still listed with it. A document is compared with canonical documents only.
+
+#returns the bits of a token's hash spread out so bit i sits at the bottom of lane i
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def token_lanes(token):
+    token_hash = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    lanes = 0
+    for bit in range(FINGERPRINT_BITS):
+        if token_hash >> bit & 1:
+            lanes |= 1 << (bit * LANE_BITS)
+    return lanes
+
+#returns the SimHash of the postings of doc (the output of calculate_tf, with doc numbers)
+#bit i is set when more than half of the document's distinct tokens have bit i set in their hash; the counts of
+#all 64 bits are summed at once in the lanes of one int
+#rows of anchor text for other documents are left out
+def simhash(doc, postings_dict):
+    lane_sums = 0
+    total = 0
+    for token, values in postings_dict.items():
+        if values[0] == doc:
+            lane_sums += token_lanes(token)
+            total += 1
+    lane_mask = (1 << LANE_BITS) - 1
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if 2 * (lane_sums >> (bit * LANE_BITS) & lane_mask) > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def band_values(fingerprint):
+    bounds = [band * FINGERPRINT_BITS // BANDS for band in range(BANDS + 1)]
+    return [fingerprint >> bounds[band] & ((1 << (bounds[band + 1] - bounds[band])) - 1) for band in range(BANDS)]
+
+#finds the near-duplicates among the documents of a build in corpus order
+#duplicates maps the doc number of every near-duplicate to (canonical doc number, postings, positions) it held
+class NearDuplicateFilter:
+
+    def __init__(self):
+        self.bands = [{} for _ in range(BANDS)]
+        self.fingerprints = {}
+        self.duplicates = {}
+
+    def add_canonical(self, doc, fingerprint):
+        self.fingerprints[doc] = fingerprint
+        for band, value in enumerate(band_values(fingerprint)):
+            self.bands[band].setdefault(value, []).append(doc)
+
+    #returns the first canonical document within MAX_DISTANCE bits of fingerprint, or None
+    def find_canonical(self, fingerprint):
+        for band, value in enumerate(band_values(fingerprint)):
+            for doc in self.bands[band].get(value, ()):
+                if bin(fingerprint ^ self.fingerprints[doc]).count('1') <= MAX_DISTANCE:
+                    return doc
+        return None
+
+    #returns the canonical document doc is a near-duplicate of, or None if doc is to be indexed
+    #a document without postings is indexed (it adds nothing) and is not fingerprinted
+    def check(self, doc, postings_dict):
+        if not postings_dict:
+            return None
+        fingerprint = simhash(doc, postings_dict)
+        canonical = self.find_canonical(fingerprint)
+        if canonical is None:
+            self.add_canonical(doc, fingerprint)
+            return None
+        positions = sum(len(values[2]) for values in postings_dict.values())
+        self.duplicates[doc] = (canonical, len(postings_dict), positions)
+        return canonical
+
+    #duplicates table rows: (doc number, canonical doc number, postings, positions)
+    def duplicate_rows(self):
+        return [(doc, canonical, postings, positions)
+                for doc, (canonical, postings, positions) in self.duplicates.items()]
+
+def create_duplicates_table(c):
+    c.execute('DROP TABLE IF EXISTS duplicates')
+    c.execute('''CREATE TABLE duplicates
+                 (doc_id INTEGER PRIMARY KEY, canonical INTEGER, postings INTEGER, positions INTEGER)''')
+
+#writes the near-duplicates a NearDuplicateFilter found to the duplicates table of index.db
+def write_duplicates(conn, duplicate_filter):
+    c = conn.cursor()
+    create_duplicates_table(c)
+    c.executemany('INSERT INTO duplicates (doc_id, canonical, postings, positions) VALUES (?, ?, ?, ?)',
+                  duplicate_filter.duplicate_rows())
+    conn.commit()
+
+#returns {canonical doc number: [doc numbers of its near-duplicates]}, empty for an index built without
+#--near-duplicates
+def read_duplicate_clusters(conn):
+    clusters = {}
+    try:
+        for doc, canonical in conn.execute('SELECT doc_id, canonical FROM duplicates ORDER BY doc_id'):
+            clusters.setdefault(canonical, []).append(doc)
+    except sqlite3.OperationalError:
+        pass
+    return clusters
+
+#prints how many documents were near-duplicates and how many postings and positions they would have added
+def print_duplicate_report(conn):
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*), COUNT(DISTINCT canonical), COALESCE(SUM(postings), 0), COALESCE(SUM(positions), 0) '
+              'FROM duplicates')
+    duplicates, clusters, postings, positions = c.fetchone()
+    c.execute('SELECT COUNT(DISTINCT doc_id), COUNT(*) FROM final_postings')
+    indexed, indexed_postings = c.fetchone()
+    documents = indexed + duplicates
+    total_postings = indexed_postings + postings
+    print(f"\nNear-duplicates: {duplicates} of {documents} documents "
+          f"({100 * duplicates / documents if documents else 0:.1f}%) in {clusters} clusters were not indexed")
+    print(f"Postings saved: {postings} of {total_postings} "
+          f"({100 * postings / total_postings if total_postings else 0:.1f}%), {positions} positions")
+
+#lists the clusters of an index: the url of each canonical document followed by the urls of its near-duplicates
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'index.db'
+    conn = sqlite3.connect(db_path)
+    clusters = read_duplicate_clusters(conn)
+    if not clusters:
+        print(f"{db_path} has no near-duplicates; build it with CreateInvertedIndex.py --near-duplicates")
+        return
+    paths = dict(conn.execute('SELECT id, COALESCE(path, doc_key) FROM documents'))
+    for canonical, docs in sorted(clusters.items(), key=lambda cluster: -len(cluster[1])):
+        print(f"{paths.get(canonical)} ({len(docs)} near-duplicates)")
+        for doc in docs:
+            print(f"    {paths.get(doc)}")
+    print_duplicate_report(conn)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
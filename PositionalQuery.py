@@ -0,0 +1,307 @@
+import re
+import math
+import heapq
+import bisect
+import sqlite3
+from QueryRuntime import get_query_lemmatizer, load_stopwords, tokenize_query, normalize_query, top_k_for_terms
+from BinaryIndex import BinaryIndexReader
+from SegmentIndex import SegmentedIndex
+from Metrics import METRICS
+
+PROXIMITY_WEIGHT = 0.5  # weight of the phrase/proximity bonus relative to the cosine score
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+NEAR_PATTERN = re.compile(r'^near/(\d+)$', re.IGNORECASE)
+
+#returns the first index >= lo at which values[index] >= target
+#the search probes lo+1, lo+2, lo+4, ... before bisecting, so consecutive lookups with increasing targets cost
+#O(log distance) instead of O(log n)
+def gallop(values, target, lo=0):
+    n = len(values)
+    if lo >= n or values[lo] >= target:
+        return lo
+    step = 1
+    hi = lo + 1
+    while hi < n and values[hi] < target:
+        lo = hi
+        step *= 2
+        hi = lo + step
+    return bisect.bisect_left(values, target, lo + 1, min(hi, n))
+
+#tokenizes text the way the indexer does and returns [(term, position)]
+#positions count every alphabetic ASCII token, stop words included, so they line up with the stored positions
+#lemmas is the LemmaTable of the index, as in normalize_query
+def normalize_phrase(text, lemmas=None):
+    lemmatize = lemmas.lemmatize if lemmas is not None else get_query_lemmatizer().lemmatize
+    stop_words = load_stopwords()
+    terms = []
+    position = 0
+    for word in tokenize_query(text):
+        if word.isalpha() and word.isascii():
+            term = lemmatize(word.lower())
+            if term not in stop_words:
+                terms.append((term, position))
+            position += 1
+    return terms
+
+#splits a query into its scoring terms and its positional clauses
+#  "a b c"       phrase clause: ('phrase', [(term, offset), ...])
+#  a NEAR/k b    proximity clause: ('near', term a, term b, k)
+#every term inside a clause is also a scoring term
+def parse_query(query, lemmas=None):
+    terms = []
+    clauses = []
+    pieces = []
+    for match in QUERY_PATTERN.finditer(query):
+        if match.group(1) is not None:
+            phrase = normalize_phrase(match.group(1), lemmas)
+            terms.extend(term for term, _ in phrase)
+            if len(phrase) > 1:
+                clauses.append(('phrase', tuple(phrase)))
+            pieces.append(None)
+        else:
+            pieces.append(match.group(2))
+
+    for i, piece in enumerate(pieces):
+        if piece is None:
+            continue
+        near = NEAR_PATTERN.match(piece)
+        if near:
+            if 0 < i < len(pieces) - 1 and pieces[i - 1] and pieces[i + 1]:
+                left = normalize_query(pieces[i - 1], lemmas)
+                right = normalize_query(pieces[i + 1], lemmas)
+                if left and right:
+                    clauses.append(('near', left[-1], right[0], int(near.group(1))))
+            continue
+        terms.extend(normalize_query(piece, lemmas))
+    return terms, clauses
+
+def is_positional_query(query):
+    return '"' in query or any(NEAR_PATTERN.match(piece) for piece in query.split())
+
+#doc-ordered postings of one term with positions decoded on demand
+#docs are sorted, weights[i] holds every row weight of docs[i], and positions(i) returns the sorted positions
+class TermPositions:
+
+    def __init__(self, docs, weights, decode_positions):
+        self.docs = docs
+        self.weights = weights
+        self.decode_positions = decode_positions
+        self.decoded = {}
+
+    def positions(self, i):
+        if i not in self.decoded:
+            self.decoded[i] = self.decode_positions(i)
+        return self.decoded[i]
+
+#positions from index.bin: the variable-byte position lists are only decoded for documents that survive the
+#doc-level intersection
+class BinaryPositionSource:
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def term_positions(self, term):
+        row_docs, row_weights, row_offsets = self.reader.doc_postings(term)
+        docs = []
+        weights = []
+        offsets = []
+        for doc, weight, offset in zip(row_docs, row_weights, row_offsets):
+            if docs and docs[-1] == doc:
+                weights[-1] += (weight,)
+                offsets[-1].append(offset)
+            else:
+                docs.append(doc)
+                weights.append((weight,))
+                offsets.append([offset])
+
+        def decode_positions(i):
+            if len(offsets[i]) == 1:
+                return self.reader.positions_at(offsets[i][0])
+            return sorted(position for offset in offsets[i] for position in self.reader.positions_at(offset))
+        return TermPositions(docs, weights, decode_positions)
+
+#TermPositions of doc-ordered (doc_id, nweight, positions) rows with positions stored as TEXT
+#the TEXT positions are only converted for documents that survive the doc-level intersection
+def text_term_positions(rows):
+    docs = []
+    weights = []
+    stored = []
+    for doc_id, weight, positions in rows:
+        if docs and docs[-1] == doc_id:
+            weights[-1] += (weight,)
+            stored[-1].append(positions)
+        else:
+            docs.append(doc_id)
+            weights.append((weight,))
+            stored.append([positions])
+
+    def decode_positions(i):
+        return sorted(int(position) for positions in stored[i] for position in positions.split())
+    return TermPositions(docs, weights, decode_positions)
+
+#positions from final_postings in index.db
+#with a TermDictionary the rows of a term are read by rowid range instead of scanning the table for the token
+class SQLitePositionSource:
+
+    def __init__(self, conn, dictionary=None):
+        self.conn = conn
+        self.dictionary = dictionary
+
+    def term_positions(self, term):
+        c = self.conn.cursor()
+        if self.dictionary is not None:
+            rows = self.dictionary.row_range(term) or (0, -1)
+            c.execute('SELECT doc_id, nweight, positions FROM final_postings WHERE rowid BETWEEN ? AND ? '
+                      'ORDER BY doc_id, rowid', rows)
+        else:
+            c.execute('SELECT doc_id, nweight, positions FROM final_postings WHERE token = ? ORDER BY doc_id, rowid',
+                      (term,))
+        return text_term_positions(c.fetchall())
+
+#positions from the segments of an incremental index, weighted like SegmentedIndex.postings
+class SegmentPositionSource:
+
+    def __init__(self, index):
+        self.index = index
+
+    def term_positions(self, term):
+        return text_term_positions(self.index.position_rows(term))
+
+#returns the position source for an index, or None if the index has no positions to offer
+#an object that already has one (a QueryEngine) hands out its own
+def make_position_source(index, dictionary=None):
+    if isinstance(index, BinaryIndexReader):
+        return BinaryPositionSource(index)
+    if isinstance(index, SegmentedIndex):
+        return SegmentPositionSource(index)
+    if isinstance(index, sqlite3.Connection):
+        return SQLitePositionSource(index, dictionary)
+    return getattr(index, 'position_source', None)
+
+#intersects the doc lists of term_lists, rarest first, and returns [(doc, [index of doc in each list])]
+def intersect_docs(term_lists):
+    order = sorted(range(len(term_lists)), key=lambda i: len(term_lists[i].docs))
+    rarest = term_lists[order[0]]
+    cursors = [0] * len(term_lists)
+    matches = []
+    for rarest_index, doc in enumerate(rarest.docs):
+        indexes = [0] * len(term_lists)
+        indexes[order[0]] = rarest_index
+        for i in order[1:]:
+            docs = term_lists[i].docs
+            cursors[i] = gallop(docs, doc, cursors[i])
+            if cursors[i] >= len(docs):
+                return matches
+            if docs[cursors[i]] != doc:
+                break
+            indexes[i] = cursors[i]
+        else:
+            matches.append((doc, indexes))
+    return matches
+
+#counts the occurrences of a phrase given each term's positions and offset within the phrase
+def count_phrase(position_lists, offsets):
+    order = sorted(range(len(position_lists)), key=lambda i: len(position_lists[i]))
+    anchor = order[0]
+    cursors = [0] * len(position_lists)
+    count = 0
+    for position in position_lists[anchor]:
+        start = position - offsets[anchor]
+        for i in order[1:]:
+            target = start + offsets[i]
+            positions = position_lists[i]
+            cursors[i] = gallop(positions, target, cursors[i])
+            if cursors[i] >= len(positions):
+                return count
+            if positions[cursors[i]] != target:
+                break
+        else:
+            count += 1
+    return count
+
+#returns the smallest distance between a position in left and one in right
+def minimum_distance(left, right):
+    best = None
+    cursor = 0
+    for position in left:
+        cursor = gallop(right, position, cursor)
+        for j in (cursor - 1, cursor):
+            if 0 <= j < len(right):
+                distance = abs(right[j] - position)
+                if best is None or distance < best:
+                    best = distance
+    return best
+
+#evaluates one clause; returns {doc: proximity score} for the documents that satisfy it
+def evaluate_clause(clause, term_positions):
+    if clause[0] == 'phrase':
+        phrase = clause[1]
+        term_lists = [term_positions[term] for term, _ in phrase]
+        offsets = [offset for _, offset in phrase]
+        matches = {}
+        for doc, indexes in intersect_docs(term_lists):
+            count = count_phrase([term_list.positions(i) for term_list, i in zip(term_lists, indexes)], offsets)
+            if count:
+                matches[doc] = 1 + math.log10(count)
+        return matches
+
+    _, left, right, window = clause
+    term_lists = [term_positions[left], term_positions[right]]
+    matches = {}
+    for doc, (i, j) in intersect_docs(term_lists):
+        distance = minimum_distance(term_lists[0].positions(i), term_lists[1].positions(j))
+        if distance is not None and distance <= window:
+            matches[doc] = 1 / max(distance, 1)
+    return matches
+
+#evaluates a query with phrase ("...") and proximity (a NEAR/k b) clauses
+#documents must satisfy every clause; they are ranked by the cosine score of all query terms plus
+#PROXIMITY_WEIGHT times the clause scores (more phrase occurrences or closer terms score higher)
+#returns (top k [(doc_id, score)], total matches, True) like top_k_cosine_similarity
+def positional_search(index, query, k=20):
+    terms, clauses = parse_query(query)
+    return evaluate_positional_query(index, make_position_source(index), terms, clauses, k)
+
+#positional_search for an already parsed query
+#without clauses the query is ranked by top_k_for_terms on index; clauses need a position source, since
+#ranking their terms as a bag of words would return documents that do not satisfy them
+def evaluate_positional_query(index, source, terms, clauses, k=20):
+    if not clauses:
+        return top_k_for_terms(index, terms, k)
+    if source is None:
+        raise ValueError("this index has no positions, so it cannot answer phrase or NEAR/k queries")
+
+    METRICS.count("queries")
+    term_positions = {}
+    for term in terms:
+        if term not in term_positions:
+            with METRICS.timer("query_fetch"):
+                term_positions[term] = source.term_positions(term)
+
+    candidates = None
+    bonuses = {}
+    for clause in clauses:
+        with METRICS.timer("query_positions"):
+            matches = evaluate_clause(clause, term_positions)
+        candidates = set(matches) if candidates is None else candidates & set(matches)
+        for doc, bonus in matches.items():
+            bonuses[doc] = bonuses.get(doc, 0) + bonus
+        if not candidates:
+            return [], 0, True
+
+    #cosine score of the candidates, added in query term order like compute_cosine_similarity
+    candidate_docs = sorted(candidates)
+    scores = dict.fromkeys(candidate_docs, 0.0)
+    for term in terms:
+        term_list = term_positions[term]
+        cursor = 0
+        for doc in candidate_docs:
+            cursor = gallop(term_list.docs, doc, cursor)
+            if cursor < len(term_list.docs) and term_list.docs[cursor] == doc:
+                for weight in term_list.weights[cursor]:
+                    scores[doc] += weight
+    for doc in candidate_docs:
+        scores[doc] += PROXIMITY_WEIGHT * bonuses[doc]
+
+    top = heapq.nsmallest(k, ((-score, doc) for doc, score in scores.items()))
+    return [(doc_id, -score) for score, doc_id in top], len(candidate_docs), True
@@ -0,0 +1,305 @@
+import os
+import sqlite3
+import urllib.parse
+from collections import OrderedDict
+from QueryRuntime import normalize_query, top_k_for_terms, open_lemma_table
+from BinaryIndex import BinaryIndexReader
+from DocumentStore import DocumentStoreReader
+from SegmentIndex import SegmentedIndex, CATALOG_NAME
+from PositionalQuery import is_positional_query, parse_query, evaluate_positional_query, make_position_source
+from TermDictionary import open_term_dictionary, is_wildcard, expand_query
+from DocumentTable import open_document_table
+from NearDuplicates import read_duplicate_clusters
+from Metrics import METRICS
+
+POSTINGS_CACHE_SIZE = 2000000  # maximum number of postings held across all cached lists
+RESULT_CACHE_SIZE = 1024  # maximum number of cached ranked result lists
+METADATA_BATCH_SIZE = 500  # doc ids per IN (...) lookup, below SQLite's bound parameter limit
+STATEMENT_CACHE_SIZE = 256
+
+#returns the file: URI of path for sqlite3.connect(uri=True)
+#built with urllib.parse because urllib.request takes longer to import than the rest of the query side
+def file_uri(path):
+    path = os.path.abspath(path).replace(os.sep, '/')
+    #a Windows path starts with its drive letter: file:///C:/...
+    if not path.startswith('/'):
+        path = '/' + path
+    return "file://" + urllib.parse.quote(path, safe='/:')
+
+#least recently used cache bounded by the summed size of its values
+class LRUCache:
+
+    def __init__(self, capacity, size_of=lambda value: 1):
+        self.capacity = capacity
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        value_size = self.size_of(value)
+        #values larger than the whole cache are not kept
+        if value_size > self.capacity:
+            return
+        if key in self.entries:
+            self.size -= self.size_of(self.entries.pop(key))
+        self.entries[key] = value
+        self.size += value_size
+        while self.size > self.capacity:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= self.size_of(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                "size": self.size, "capacity": self.capacity}
+
+#long-lived query object shared by the CLI and the GUI
+#it keeps index.db (and optionally index.bin, or an incremental segment directory) open, caches postings lists and ranked results, and clears
+#both caches when an index file changes on disk. It implements the postings(term) / max_weight(term) /
+#document_count() interface, so the query functions in QueryRuntime can be run against it directly
+class QueryEngine:
+
+    def __init__(self, index_path='index.db', binary_index_path=None, document_store_path=None,
+                 postings_cache_size=POSTINGS_CACHE_SIZE, result_cache_size=RESULT_CACHE_SIZE, segments_path=None,
+                 read_only=False, dictionary_path=None):
+        #a segmented index keeps its documents table in the catalog, which changes on every update
+        if segments_path:
+            index_path = os.path.join(segments_path, CATALOG_NAME)
+        self.segments_path = segments_path
+        self.index_path = index_path
+        #terms.dict is written next to index.db; it is only used if it belongs to that index.db
+        if dictionary_path is None and not segments_path:
+            dictionary_path = os.path.join(os.path.dirname(index_path), 'terms.dict')
+        self.dictionary_path = dictionary_path
+        self.binary_index_path = binary_index_path
+        self.read_only = read_only
+        #docstore.bin is written next to index.db as well; '' opens the index without it
+        #the document store is optional; indexes built before it existed have none
+        if document_store_path is None:
+            document_store_path = os.path.join(os.path.dirname(index_path), 'docstore.bin')
+        if document_store_path and not os.path.exists(document_store_path):
+            document_store_path = None
+        self.document_store_path = document_store_path
+        self.postings_cache = LRUCache(postings_cache_size, size_of=len)
+        self.result_cache = LRUCache(result_cache_size)
+        self.conn = None
+        self.reader = None
+        self.dictionary = None
+        self.lemmas = None
+        self.document_table = None
+        self.duplicate_clusters = {}
+        self.document_store = None
+        self.index_signature = None
+        self.open_index()
+
+    #(mtime, size) of every index file, used to detect rebuilds
+    def current_signature(self):
+        signature = []
+        for path in (self.index_path, self.binary_index_path, self.document_store_path, self.dictionary_path):
+            if path and os.path.exists(path):
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def open_index(self):
+        self.close()
+        if self.read_only:
+            #mode=ro lets several processes and threads share index.db without taking write locks
+            uri = file_uri(self.index_path) + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+        else:
+            self.conn = sqlite3.connect(self.index_path, cached_statements=STATEMENT_CACHE_SIZE)
+        if self.segments_path:
+            self.reader = SegmentedIndex(self.segments_path)
+        elif self.binary_index_path:
+            self.reader = BinaryIndexReader(self.binary_index_path)
+        if self.document_store_path:
+            self.document_store = DocumentStoreReader(self.document_store_path)
+        self.dictionary = open_term_dictionary(self.conn, self.dictionary_path)
+        self.lemmas = open_lemma_table(self.conn)
+        self.document_table = open_document_table(self.conn)
+        self.duplicate_clusters = read_duplicate_clusters(self.conn)
+        self.index_signature = self.current_signature()
+        self.position_source = make_position_source(self.reader if self.reader is not None else self.conn,
+                                                    self.dictionary)
+        self.document_total = None
+        self.postings_cache.clear()
+        self.result_cache.clear()
+
+    #reopens the index and drops the caches if an index file was replaced since the last check
+    def check_for_changes(self):
+        if self.current_signature() != self.index_signature:
+            self.open_index()
+
+    #aborts the SQLite statement this engine is running; safe to call from another thread
+    def interrupt(self):
+        conn = self.conn
+        if conn is not None:
+            conn.interrupt()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.dictionary is not None:
+            self.dictionary.close()
+            self.dictionary = None
+        self.lemmas = None
+        self.document_table = None
+        self.duplicate_clusters = {}
+        if self.document_store is not None:
+            self.document_store.close()
+            self.document_store = None
+
+    #returns the doc-ordered (doc_id, nweight) postings of term, from the cache when possible
+    #with a term dictionary index.db is read by rowid range rather than by scanning final_postings for the token
+    def postings(self, term):
+        postings = self.postings_cache.get(term)
+        if postings is None:
+            if self.reader is not None:
+                postings = self.reader.postings(term)
+            elif self.dictionary is not None:
+                rows = self.dictionary.row_range(term)
+                postings = []
+                if rows is not None:
+                    c = self.conn.cursor()
+                    c.execute('SELECT doc_id, nweight FROM final_postings WHERE rowid BETWEEN ? AND ? '
+                              'ORDER BY doc_id, rowid', rows)
+                    postings = c.fetchall()
+            else:
+                c = self.conn.cursor()
+                c.execute('SELECT doc_id, nweight FROM final_postings WHERE token = ? ORDER BY doc_id, rowid', (term,))
+                postings = c.fetchall()
+            self.postings_cache.put(term, postings)
+        return postings
+
+    def max_weight(self, term):
+        if self.reader is not None:
+            return self.reader.max_weight(term)
+        if self.dictionary is not None:
+            return self.dictionary.max_weight(term)
+        c = self.conn.cursor()
+        try:
+            c.execute('SELECT max_weight FROM term_stats WHERE token = ?', (term,))
+        except sqlite3.OperationalError:
+            return None
+        row = c.fetchone()
+        return row[0] if row else None
+
+    def document_count(self):
+        if self.document_total is None:
+            c = self.conn.cursor()
+            c.execute('SELECT COUNT(*) FROM documents')
+            self.document_total = c.fetchone()[0]
+        return self.document_total
+
+    #returns (top k [(doc_id, score)], total matches, whether the total is exact)
+    #results are cached per normalized query, so queries that only differ in case or inflection share an entry
+    #quoted phrases and NEAR/k operators are evaluated on the stored positions
+    #words with * or ? are expanded to the matching terms of the term dictionary, if the index has one
+    def search(self, query, k=20):
+        self.check_for_changes()
+        if is_positional_query(query):
+            query_terms, clauses = parse_query(query, self.lemmas)
+            key = (tuple(query_terms), tuple(clauses), k)
+        elif self.dictionary is not None and any(is_wildcard(word) for word in query.split()):
+            query_terms, clauses = expand_query(self.dictionary, query, self.lemmas), ()
+            key = (tuple(query_terms), k)
+        else:
+            query_terms, clauses = normalize_query(query, self.lemmas), ()
+            key = (tuple(query_terms), k)
+        result = self.result_cache.get(key)
+        if result is None:
+            METRICS.count("result_cache_misses")
+            if clauses:
+                result = evaluate_positional_query(self, self.position_source, query_terms, clauses, k)
+            else:
+                result = top_k_for_terms(self, query_terms, k)
+            self.result_cache.put(key, result)
+        return result
+
+    #search() for many queries at once, used to replay query logs and warm the result cache
+    #plain queries missing from the cache are scored together by BatchQuery.batch_search_terms; positional and
+    #wildcard queries one by one
+    def search_batch(self, queries, k=20):
+        from BatchQuery import batch_search_terms
+        self.check_for_changes()
+        results = [None] * len(queries)
+        pending = {}
+        for i, query in enumerate(queries):
+            if is_positional_query(query) or (self.dictionary is not None and
+                                              any(is_wildcard(word) for word in query.split())):
+                results[i] = self.search(query, k)
+                continue
+            key = (tuple(normalize_query(query, self.lemmas)), k)
+            results[i] = self.result_cache.get(key)
+            if results[i] is None:
+                pending.setdefault(key, []).append(i)
+        if pending:
+            METRICS.count("result_cache_misses", len(pending))
+            keys = list(pending)
+            for key, result in zip(keys, batch_search_terms(self, [list(terms) for terms, _ in keys], k)):
+                self.result_cache.put(key, result)
+                for i in pending[key]:
+                    results[i] = result
+        return results
+
+    #returns {doc_id: path} for doc_ids from the document table, or with one batched lookup in the documents table
+    #per METADATA_BATCH_SIZE ids for an index without one
+    def document_paths(self, doc_ids):
+        if self.document_table is not None:
+            return {doc_id: url or None for doc_id, url in self.document_table.values("url", doc_ids).items()}
+        doc_ids = list(doc_ids)
+        paths = {}
+        c = self.conn.cursor()
+        for i in range(0, len(doc_ids), METADATA_BATCH_SIZE):
+            batch = doc_ids[i:i + METADATA_BATCH_SIZE]
+            c.execute(f'SELECT id, path FROM documents WHERE id IN ({", ".join("?" * len(batch))})', batch)
+            paths.update(c.fetchall())
+        return paths
+
+    #returns {doc_id: [paths of its near-duplicates]} for the doc_ids that had near-duplicates left out of the index
+    def duplicate_paths(self, doc_ids):
+        clusters = self.duplicate_clusters
+        clusters = {doc_id: clusters[doc_id] for doc_id in doc_ids if doc_id in clusters}
+        if not clusters:
+            return {}
+        paths = self.document_paths([doc for docs in clusters.values() for doc in docs])
+        return {doc_id: [paths.get(doc) for doc in docs] for doc_id, docs in clusters.items()}
+
+    #returns {doc_id: "folder/file" key} for doc_ids
+    #an index without a document table (built before documents were numbered, or a segmented index) stores the
+    #keys themselves as doc ids
+    def document_keys(self, doc_ids):
+        if self.document_table is not None:
+            return self.document_table.values("doc_key", doc_ids)
+        return {doc_id: doc_id for doc_id in doc_ids}
+
+    #returns {doc_id: {title, description, snippet}} from the document store with one bulk read
+    #documents missing from the store (or every document, if there is no store) are left out
+    def document_info(self, doc_ids):
+        if self.document_store is None:
+            return {}
+        doc_keys = self.document_keys(doc_ids)
+        records = self.document_store.get_many(doc_keys.values())
+        return {doc_id: records[doc_key] for doc_id, doc_key in doc_keys.items() if doc_key in records}
+
+    #hit/miss counters of both caches, for sizing them
+    def cache_stats(self):
+        return {"postings": self.postings_cache.stats(), "results": self.result_cache.stats()}
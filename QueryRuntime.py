@@ -0,0 +1,379 @@
+import re
+import sys
+import json
+import bisect
+import sqlite3
+import argparse
+from Metrics import METRICS
+
+LEMMA_CACHE_SIZE = 100000  # Maximum number of query words whose lemma a LemmaTable keeps in memory
+COLD_START_QUERY = "computer science"
+HEAVY_MODULES = ('nltk', 'bs4', 'lxml')
+
+#The query side of the search engine: query normalization and the cosine scoring functions, without the
+#indexer's HTML parsing and tokenizing. Importing it loads no NLP library:
+#  tokenizing:  a query of plain ASCII words is split on whitespace exactly like nltk.word_tokenize splits it;
+#               nltk is imported for any other query
+#  lemmatizing: words are looked up in the query_lemmas table index.db gets at index time (see LemmaTable);
+#               WordNet is loaded the first time a query word is missing from it
+#CreateInvertedIndex re-exports these functions, so code that imports them from there keeps working.
+
+#the words nltk.word_tokenize splits in two even without punctuation, and where it splits them
+SPLIT_WORDS = {'cannot': 3, 'gimme': 3, 'gonna': 3, 'gotta': 3, 'lemme': 3, 'wanna': 3}
+PLAIN_QUERY = re.compile(r'[A-Za-z\s]*', re.ASCII)
+
+#suffix rules of WordNet's noun lemmatizer as (inflected ending, lemma ending)
+NOUN_SUFFIXES = (("s", ""), ("ses", "s"), ("xes", "x"), ("zes", "z"), ("ches", "ch"), ("shes", "sh"),
+                 ("men", "man"), ("ies", "y"))
+
+STOP_WORDS = None
+
+#returns the set of stop words from stopwords.txt, reading the file only once
+def load_stopwords():
+    global STOP_WORDS
+    if STOP_WORDS is None:
+        try:
+            with open('stopwords.txt', 'r') as sw_file:
+                STOP_WORDS = frozenset(word.strip().lower() for word in sw_file.readlines())
+        except FileNotFoundError:
+            print("stopwords.txt not found")
+            STOP_WORDS = frozenset()
+    return STOP_WORDS
+
+QUERY_LEMMATIZER = None
+
+#returns the lemmatizer shared by all queries, creating it on first use
+#nltk and WordNet take longer to load than the rest of the query side, so they are only imported here
+def get_query_lemmatizer():
+    global QUERY_LEMMATIZER
+    if QUERY_LEMMATIZER is None:
+        with METRICS.timer("lemmatizer_load"):
+            from nltk.stem import WordNetLemmatizer
+            QUERY_LEMMATIZER = WordNetLemmatizer()
+    return QUERY_LEMMATIZER
+
+#tokenizes text like nltk.word_tokenize
+#text of ASCII letters and whitespace has no punctuation for the tokenizer to split off, so it is split on
+#whitespace, plus the few contractions nltk splits (cannot -> can not)
+def tokenize_query(text):
+    if PLAIN_QUERY.fullmatch(text):
+        words = []
+        for word in text.split():
+            split = SPLIT_WORDS.get(word.lower())
+            if split:
+                words.extend((word[:split], word[split:]))
+            else:
+                words.append(word)
+        return words
+    import nltk
+    return nltk.word_tokenize(text)
+
+#the lemmas of the query words that can match an indexed term
+#index.db's query_lemmas table maps every word that lemmatizes to an indexed term or a stop word (as far as the
+#noun suffix rules go) to the lemma WordNet gives it; other words, such as typos and irregular plurals, are
+#lemmatized with WordNet. Either way a word gets the lemma normalize_query always gave it.
+class LemmaTable:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lemmas = {}
+
+    def lemmatize(self, word):
+        lemma = self.lemmas.get(word)
+        if lemma is None:
+            row = self.conn.execute('SELECT lemma FROM query_lemmas WHERE word = ?', (word,)).fetchone()
+            if row is None:
+                METRICS.count("lemma_table_misses")
+                lemma = get_query_lemmatizer().lemmatize(word)
+            else:
+                lemma = row[0]
+            if len(self.lemmas) >= LEMMA_CACHE_SIZE:
+                self.lemmas.clear()
+            self.lemmas[word] = lemma
+        return lemma
+
+#returns the LemmaTable of an index.db, or None for an index built before it had one
+def open_lemma_table(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_lemmas'").fetchone()
+    return LemmaTable(conn) if row else None
+
+#yields the word itself and the words WordNet's noun rules reduce to it (cat -> cats, box -> boxes, ...)
+def inflected_forms(word):
+    yield word
+    for suffix, ending in NOUN_SUFFIXES:
+        if word.endswith(ending):
+            yield word[:len(word) - len(ending)] + suffix
+
+#writes the query_lemmas table of index.db from the indexed terms, or from vocabulary if it is given
+#each candidate word is stored with the lemma WordNet gives it, so a lookup answers like the lemmatizer would
+def write_query_lemmas(conn, vocabulary=None):
+    with METRICS.timer("query_lemmas"):
+        c = conn.cursor()
+        if vocabulary is None:
+            vocabulary = [token for token, in c.execute('SELECT token FROM term_stats')]
+        lemmatizer = get_query_lemmatizer()
+        words = set()
+        for term in vocabulary:
+            words.update(inflected_forms(term))
+        for stop_word in load_stopwords():
+            words.update(inflected_forms(stop_word))
+        c.execute('DROP TABLE IF EXISTS query_lemmas')
+        c.execute('CREATE TABLE query_lemmas (word TEXT PRIMARY KEY, lemma TEXT) WITHOUT ROWID')
+        c.executemany('INSERT INTO query_lemmas (word, lemma) VALUES (?, ?)',
+                      ((word, lemmatizer.lemmatize(word)) for word in sorted(words) if word.isalpha()))
+        conn.commit()
+
+#tokenizes and lemmatizes a query into index terms
+#lemmas is the LemmaTable of the index being searched; without one every word is lemmatized with WordNet
+def normalize_query(query, lemmas=None):
+    lemmatize = lemmas.lemmatize if lemmas is not None else get_query_lemmatizer().lemmatize
+    return [lemmatize(term.lower()) for term in tokenize_query(query) if term.isalpha()]
+
+#returns the (doc_id, nweight) postings of term
+#conn is either an index.db connection or a reader object with a postings(term) method, such as BinaryIndexReader
+def fetch_postings(conn, term):
+    if hasattr(conn, 'postings'):
+        return conn.postings(term)
+    c = conn.cursor()
+    c.execute('SELECT doc_id, nweight FROM final_postings WHERE token = ?', (term,))
+    return c.fetchall()
+
+def compute_cosine_similarity(conn, query):
+    # Tokenize and lemmatize the query terms
+    query_terms = normalize_query(query)
+    METRICS.count("queries")
+    # Initialize scores and length
+    scores = {}
+
+    # Calculate scores for each document
+    for term in query_terms:
+        with METRICS.timer("query_fetch"):
+            postings = fetch_postings(conn, term)
+        METRICS.count("postings_scored", len(postings))
+        # Add to scores and length based on weight of doc_id
+        with METRICS.timer("query_score"):
+            for doc_id, weight in postings:
+                if doc_id in scores:
+                    scores[doc_id] += weight
+                else:
+                    scores[doc_id] = weight
+
+    # Return sorted scores (ties are ordered by doc_id so the ranking is deterministic)
+    with METRICS.timer("query_sort"):
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+#returns the postings of term ordered by doc_id as ([doc_id], [(nweight, ...)])
+#a doc_id can appear in more than one row of a token (anchor text), so each entry keeps all of its row weights
+def fetch_doc_ordered_postings(conn, term):
+    if hasattr(conn, 'postings'):
+        postings = conn.postings(term)
+    else:
+        c = conn.cursor()
+        c.execute('SELECT doc_id, nweight FROM final_postings WHERE token = ? ORDER BY doc_id, rowid', (term,))
+        postings = c.fetchall()
+    docs = []
+    weights = []
+    for doc_id, weight in postings:
+        if docs and docs[-1] == doc_id:
+            weights[-1] += (weight,)
+        else:
+            docs.append(doc_id)
+            weights.append((weight,))
+    return docs, weights
+
+#returns the stored upper bound on the score a single document gets from term, or None if the index has none
+def fetch_max_weight(conn, term):
+    if hasattr(conn, 'max_weight'):
+        return conn.max_weight(term)
+    c = conn.cursor()
+    try:
+        c.execute('SELECT max_weight FROM term_stats WHERE token = ?', (term,))
+    except sqlite3.OperationalError:
+        return None
+    row = c.fetchone()
+    return row[0] if row else None
+
+def fetch_document_count(conn):
+    if hasattr(conn, 'document_count'):
+        return conn.document_count()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM documents')
+    return c.fetchone()[0]
+
+#a position in one query term's doc-ordered postings list
+class PostingsCursor:
+    __slots__ = ('term', 'docs', 'weights', 'position', 'upper_bound')
+
+    def __init__(self, term, docs, weights, upper_bound):
+        self.term = term
+        self.docs = docs
+        self.weights = weights
+        self.position = 0
+        self.upper_bound = upper_bound
+
+    def current_doc(self):
+        return self.docs[self.position]
+
+    def exhausted(self):
+        return self.position >= len(self.docs)
+
+    #moves to the first posting with doc_id >= target and returns how many postings were passed over
+    def skip_to(self, target):
+        new_position = bisect.bisect_left(self.docs, target, self.position)
+        skipped = new_position - self.position
+        self.position = new_position
+        return skipped
+
+#returns (top k results, total matches, whether the total is exact)
+#results are [(doc_id, score)] in the same order compute_cosine_similarity ranks them; documents are visited in
+#doc_id order with WAND pivoting, so a document is only scored when the upper bounds of the terms it can
+#contain reach the current k-th best score
+def top_k_cosine_similarity(conn, query, k=20):
+    return top_k_for_terms(conn, normalize_query(query), k)
+
+#top_k_cosine_similarity for an already normalized list of query terms
+def top_k_for_terms(conn, query_terms, k=20):
+    METRICS.count("queries")
+    term_counts = {}
+    for term in query_terms:
+        term_counts[term] = term_counts.get(term, 0) + 1
+
+    cursors = []
+    document_frequencies = []
+    for term, count in term_counts.items():
+        with METRICS.timer("query_fetch"):
+            docs, weights = fetch_doc_ordered_postings(conn, term)
+        if not docs:
+            continue
+        max_weight = fetch_max_weight(conn, term)
+        if max_weight is None:
+            max_weight = max(sum(doc_weights) for doc_weights in weights)
+        #negative weights can only lower a score, so a bound of 0 is still an upper bound;
+        #the slack covers rounding differences between the stored sum and the query-time sum
+        upper_bound = max(max_weight, 0) * count * (1 + 1e-9) + 1e-12
+        cursors.append(PostingsCursor(term, docs, weights, upper_bound))
+        document_frequencies.append(len(docs))
+
+    #results holds (-score, doc_id) sorted best first, at most k entries
+    results = []
+    threshold = None
+    evaluated = 0
+    skipped = 0
+    score_timer = METRICS.timer("query_score").start()
+    while cursors and k > 0:
+        cursors.sort(key=lambda cursor: cursor.current_doc())
+
+        #the pivot is the first cursor at which the summed upper bounds could reach the threshold
+        pivot = None
+        upper = 0
+        for i, cursor in enumerate(cursors):
+            upper += cursor.upper_bound
+            if threshold is None or upper >= threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+
+        pivot_doc = cursors[pivot].current_doc()
+        if cursors[0].current_doc() == pivot_doc:
+            #every cursor positioned on pivot_doc contributes; add in query term order like the exhaustive path
+            present = {}
+            for cursor in cursors:
+                if cursor.current_doc() != pivot_doc:
+                    break
+                present[cursor.term] = cursor
+            score = 0.0
+            for term in query_terms:
+                cursor = present.get(term)
+                if cursor:
+                    for weight in cursor.weights[cursor.position]:
+                        score += weight
+            evaluated += 1
+
+            entry = (-score, pivot_doc)
+            if len(results) < k:
+                bisect.insort(results, entry)
+            elif entry < results[-1]:
+                bisect.insort(results, entry)
+                results.pop()
+            if len(results) == k:
+                threshold = -results[-1][0]
+
+            for cursor in present.values():
+                cursor.position += 1
+        else:
+            #no document before pivot_doc can reach the threshold, so jump the leading cursors to it
+            for cursor in cursors[:pivot]:
+                skipped += cursor.skip_to(pivot_doc)
+        cursors = [cursor for cursor in cursors if not cursor.exhausted()]
+    score_timer.stop()
+    METRICS.count("documents_scored", evaluated)
+    METRICS.count("postings_skipped", skipped)
+
+    exact = not cursors and skipped == 0
+    total_matches = evaluated
+    if not exact and document_frequencies:
+        #estimates the size of the union of the postings lists assuming terms occur independently
+        document_count = max(fetch_document_count(conn), 1)
+        missing = 1.0
+        for df in document_frequencies:
+            missing *= 1 - min(df / document_count, 1)
+        total_matches = max(evaluated, max(document_frequencies), round(document_count * (1 - missing)))
+    return [(doc_id, -score) for score, doc_id in results], total_matches, exact
+
+#run in a fresh interpreter by measure_cold_start: opens a QueryEngine, answers one query and prints the timings
+#as json; with preload the indexer is imported first, which is what opening a QueryEngine used to cost
+COLD_START_SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+if {preload}:
+    import CreateInvertedIndex
+from QueryEngine import QueryEngine
+imported = time.perf_counter()
+engine = QueryEngine({index_path!r}, document_store_path='')
+opened = time.perf_counter()
+results, _, _ = engine.search({query!r}, 20)
+answered = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "open_ms": (opened - imported) * 1000,
+                  "first_query_ms": (answered - opened) * 1000, "total_ms": (answered - start) * 1000,
+                  "results": len(results), "heavy_modules": sorted(name for name in {heavy!r} if name in sys.modules)}}))
+'''
+
+#starts a new Python process repeat times for each way of starting the query side and returns
+#{name: the timings of the run with the median total}
+def measure_cold_start(index_path='index.db', query=COLD_START_QUERY, repeat=5):
+    import subprocess
+    measurements = {}
+    for name, preload in (("query runtime", False), ("with indexer imports", True)):
+        script = COLD_START_SCRIPT.format(preload=preload, index_path=index_path, query=query, heavy=HEAVY_MODULES)
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        runs.sort(key=lambda run: run["total_ms"])
+        measurements[name] = runs[len(runs) // 2]
+    return measurements
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measures how long the query side takes to answer its first "
+                                                 "query in a new process.")
+    parser.add_argument("index", nargs="?", default="index.db", help="path to index.db")
+    parser.add_argument("--query", default=COLD_START_QUERY, help="the first query")
+    parser.add_argument("--repeat", type=int, default=5, help="processes started per measurement; the median is reported")
+    return parser.parse_args()
+
+#reports the cold start of the query runtime next to the cold start with the indexer's imports
+def main():
+    args = parse_arguments()
+    conn = sqlite3.connect(args.index)
+    if open_lemma_table(conn) is None:
+        print(f"{args.index} has no query_lemmas table, so the first query loads WordNet; rebuild it to get one")
+    conn.close()
+    measurements = measure_cold_start(args.index, args.query, args.repeat)
+    print(f"{'':<22}{'imports':>10}{'open':>10}{'1st query':>11}{'total':>10}  heavy modules loaded")
+    for name, run in measurements.items():
+        print(f"{name:<22}{run['import_ms']:>8.1f}ms{run['open_ms']:>8.1f}ms{run['first_query_ms']:>9.1f}ms"
+              f"{run['total_ms']:>8.1f}ms  {', '.join(run['heavy_modules']) or 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,68 @@
 import json
-import sqlite3
 import os
-from CreateInvertedIndex import compute_cosine_similarity
+import argparse
+from QueryEngine import QueryEngine
+from Metrics import METRICS
 
 MAX_QUERY_SIZE = 20
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Searches index.db from the command line.")
+    parser.add_argument("--shards", metavar="DIR",
+                        help="search a sharded index built with CreateInvertedIndex.py --shards instead of index.db")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="record query timers and counters and write them to PATH when quitting "
+                             "(Prometheus text if PATH ends in .prom, json otherwise)")
+    parser.add_argument("--profile", metavar="STAGE", action="append", default=[],
+                        help="run STAGE (query_fetch, query_score, query_sort, ...) under cProfile")
+    parser.add_argument("--profile-dir", default="profiles", help="where --profile writes its .prof files")
+    return parser.parse_args()
+
 def main():
-    conn = sqlite3.connect('index.db')
-    c = conn.cursor()
+    args = parse_arguments()
+    if args.metrics or args.profile:
+        METRICS.configure(True, args.profile, args.profile_dir)
+    if args.shards:
+        #the sharded index imports the indexer, so it is only loaded when it is searched
+        from ShardedIndex import ShardedIndex
+        engine = ShardedIndex(args.shards)
+    else:
+        engine = QueryEngine('index.db')
     #gets the query
     query = ""
     while True:
         #gets the users query for the databse until the user enters quit
         query = input("\nPlease enter your query for the database.  Enter 'quit' to quit program: ")
         if query != 'quit':
-            results = compute_cosine_similarity(conn, query)
+            results, total_matches, exact = engine.search(query, MAX_QUERY_SIZE)
             result_size = len(results)
             if result_size == 0:
                 print("\nNo results found.")
                 continue
             else:
-                print(f"\n{result_size} results found.")
+                print(f"\n{'' if exact else 'About '}{total_matches} results found.")
                 print(f"\nPrinting {min(result_size, MAX_QUERY_SIZE)} results: ")
+            #looks up the links of all printed results at once
+            doc_ids = [doc_id for doc_id, _ in results[:MAX_QUERY_SIZE]]
+            links = engine.document_paths(doc_ids)
+            infos = engine.document_info(doc_ids)
+            duplicates = engine.duplicate_paths(doc_ids)
             i = 0
             while i < min(result_size, MAX_QUERY_SIZE):
                 print(results[i])
-                c.execute('SELECT * FROM documents WHERE id = ?', (results[i][0],))
-                link = c.fetchone()
-                print(f"{i + 1}. {link[1]}")
+                print(f"{i + 1}. {links.get(results[i][0])}")
+                info = infos.get(results[i][0])
+                if info:
+                    print(f"   {info['title']}\n   {info['description']}")
+                for path in duplicates.get(results[i][0], []):
+                    print(f"   also at {path}")
                 i += 1
         else:
             break
+    engine.close()
+    if args.metrics:
+        print(f"Metrics written to {METRICS.write(args.metrics)}")
+    METRICS.write_profiles()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,29 @@
 import tkinter as tk
 from tkinter import ttk
-import sqlite3
-from bs4 import BeautifulSoup
-from CreateInvertedIndex import compute_cosine_similarity
+from QueryEngine import QueryEngine
+from SearchService import query_service
 import webbrowser
+import threading
+import argparse
+import queue
+
+MAX_RESULTS = 20
+POLL_INTERVAL = 50  # milliseconds between checks for the answer of the search service
 
 class SearchEngineGUI:
 
-    def __init__(self, root):
+    def __init__(self, root, service_url=None):
         # Title
         self.root = root
         self.root.title("Search Engine")
 
+        # Query engine shared by every search, or the URL of a running SearchService.py
+        # Service queries run on a background thread so the window keeps responding
+        self.service_url = service_url
+        self.engine = None if service_url else QueryEngine('index.db')
+        self.responses = queue.Queue()
+        self.search_number = 0
+
         # Path input label
         self.path_label = ttk.Label(self.root, text="Enter Path To WEBPAGES_RAW Here: ")
         self.path_label.pack(padx=10, pady=5)
@@ -53,6 +65,10 @@ class SearchEngineGUI:
         self.status_var = tk.StringVar()
         self.status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+
+        # Results are rendered from docstore.bin when the index has one, so the raw pages are not needed
+        if self.service_url or self.engine.document_store is not None:
+            self.show_search()
     
     #opens web browser for link
     def open_link(*args):
@@ -65,15 +81,16 @@ class SearchEngineGUI:
     def enable_search(self, event=None):
         path = self.path_var.get()
         if path:
-            self.search_entry.config(state=tk.NORMAL)
-            self.search_button.config(state=tk.NORMAL)
-            self.path_label.pack_forget()
-            self.path_entry.pack_forget()
-            self.submit_button.pack_forget()
+            self.show_search()
+
+    def show_search(self):
+        self.search_entry.config(state=tk.NORMAL)
+        self.search_button.config(state=tk.NORMAL)
+        self.path_label.pack_forget()
+        self.path_entry.pack_forget()
+        self.submit_button.pack_forget()
 
     def perform_search(self):
-        # Connect to database
-        conn = sqlite3.connect('index.db')
         query = self.search_var.get().lower()  # Convert query to lowercase for case-insensitive search
         path = self.path_var.get()
         
@@ -82,7 +99,7 @@ class SearchEngineGUI:
             self.status_var.set("Please enter a search query.")
             return
 
-        if not path:
+        if not self.service_url and not path and self.engine.document_store is None:
             self.status_var.set("Please enter a path.")
             return
 
@@ -91,18 +108,66 @@ class SearchEngineGUI:
         self.status_var.set("Searching...")
         self.root.update()
 
+        if self.service_url:
+            self.search_number += 1
+            threading.Thread(target=self.query_service_thread, args=(self.search_number, query), daemon=True).start()
+            self.root.after(POLL_INTERVAL, self.poll_service, self.search_number)
+            return
+
         # Call on helper function
-        results = compute_cosine_similarity(conn, query)
-    
+        results, total_matches, exact = self.engine.search(query, MAX_RESULTS)
+        doc_ids = [doc_id for doc_id, _ in results]
+        # Results are shown by "folder/file" key, which the raw page fallback below needs
+        doc_keys = self.engine.document_keys(doc_ids)
+        doc_paths = self.engine.document_paths(doc_ids)
+        doc_infos = self.engine.document_info(doc_ids)
+        self.show_results([(doc_keys[doc_id], score) for doc_id, score in results], total_matches, exact,
+                          {doc_keys[doc_id]: doc_path for doc_id, doc_path in doc_paths.items()},
+                          {doc_keys[doc_id]: info for doc_id, info in doc_infos.items()}, path)
+
+    # Runs on a background thread; the answer is handed to the Tk thread through self.responses
+    def query_service_thread(self, number, query):
+        try:
+            self.responses.put((number, query_service(self.service_url, query, MAX_RESULTS), None))
+        except Exception as error:
+            self.responses.put((number, None, error))
+
+    # Checks every POLL_INTERVAL ms for the answer to search number; answers to older searches are dropped
+    def poll_service(self, number):
+        if number != self.search_number:
+            return
+        while True:
+            try:
+                response_number, response, error = self.responses.get_nowait()
+            except queue.Empty:
+                self.root.after(POLL_INTERVAL, self.poll_service, number)
+                return
+            if response_number == number:
+                break
+
+        if error is not None:
+            self.status_var.set(f"Search failed: {error}")
+            return
+        hits = response["results"]
+        self.show_results([(hit["doc_id"], hit["score"]) for hit in hits], response["total_matches"],
+                          response["exact"], {hit["doc_id"]: hit["path"] for hit in hits},
+                          {hit["doc_id"]: hit for hit in hits if hit["title"] is not None}, "")
+
+    def show_results(self, results, total_matches, exact, doc_paths, doc_infos, path):
         # Print out the top 20 results in listbox
         if results:
-            for i, (doc_id, _) in enumerate(results[:20], start=1):  # Limit to top 20 results
-                c = conn.cursor()
-                c.execute('SELECT path FROM documents WHERE id = ?', (doc_id,))
-                doc_path = c.fetchone()[0]
-                if '/' in path and path[-1] != '/': path += '/'
-                elif '\\' in path and path[-1] != '\\': path += '\\'
-                title, description = get_info(path + doc_id)  # Using dynamic path here
+            for i, (doc_id, _) in enumerate(results, start=1):
+                doc_path = doc_paths[doc_id]
+                if doc_id in doc_infos:
+                    title = doc_infos[doc_id]['title']
+                    description = doc_infos[doc_id]['description']
+                elif path:
+                    # Indexes without a document store fall back to parsing the raw page
+                    if '/' in path and path[-1] != '/': path += '/'
+                    elif '\\' in path and path[-1] != '\\': path += '\\'
+                    title, description = get_info(path + doc_id)  # Using dynamic path here
+                else:
+                    title, description = "No Title", "No Description"
                 self.results_listbox.insert(tk.END, title)
                 self.results_listbox.insert(tk.END, doc_path)
                 self.results_listbox.insert(tk.END, description)
@@ -111,7 +176,7 @@ class SearchEngineGUI:
                 print(f"Path:\n{doc_path}\n")
                 print(f"ID:\n{doc_id}\n")
                 print(f"Description:\n {description}\n")
-            self.status_var.set(str(len(results)) + " results found.")
+            self.status_var.set(("" if exact else "About ") + str(total_matches) + " results found.")
         else:
             self.results_listbox.insert(tk.END, "No results found.")
 
@@ -124,6 +189,7 @@ def get_info(path):
         return (None, None)
     open_file.close()
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, "html.parser")
     if(soup):
         title = soup.find('title')
@@ -146,6 +212,10 @@ def get_info(path):
     return(title, description)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Graphical search over index.db.")
+    parser.add_argument("--service", metavar="URL",
+                        help="query a running SearchService.py (for example http://127.0.0.1:8080) without blocking the window")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = SearchEngineGUI(root)
+    app = SearchEngineGUI(root, args.service)
     root.mainloop()
@@ -0,0 +1,219 @@
+import json
+import time
+import asyncio
+import argparse
+import threading
+import itertools
+import urllib.parse
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from QueryEngine import QueryEngine
+
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+MAX_CONCURRENT_QUERIES = 16  # queries running or waiting for a worker; more requests wait for a slot
+REQUEST_TIMEOUT = 5.0  # seconds a request may take, from reading it to answering it
+MAX_K = 100
+MAX_HEADERS = 100
+
+#answers one HTTP request per connection with json
+#queries run on a pool of worker threads; every thread opens its own read-only QueryEngine (connection,
+#caches and readers) on first use, so threads never share a SQLite connection
+class SearchService:
+
+    def __init__(self, index_path='index.db', binary_index_path=None, document_store_path=None,
+                 segments_path=None, workers=DEFAULT_WORKERS, max_concurrent=MAX_CONCURRENT_QUERIES,
+                 timeout=REQUEST_TIMEOUT):
+        self.engine_arguments = {"index_path": index_path, "binary_index_path": binary_index_path,
+                                 "document_store_path": document_store_path, "segments_path": segments_path,
+                                 "read_only": True}
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.executor = None
+        self.slots = None
+        self.local = threading.local()
+        #request number -> engine of the thread running it, so a timed out query can be interrupted
+        self.running = {}
+        self.request_numbers = itertools.count()
+        self.completed = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    def thread_engine(self):
+        engine = getattr(self.local, "engine", None)
+        if engine is None:
+            engine = self.local.engine = QueryEngine(**self.engine_arguments)
+        return engine
+
+    #runs on a worker thread: searches and looks up the metadata of the results
+    def run_query(self, request_number, query, k):
+        engine = self.thread_engine()
+        self.running[request_number] = engine
+        try:
+            start = time.perf_counter()
+            results, total_matches, exact = engine.search(query, k)
+            doc_ids = [doc_id for doc_id, _ in results]
+            doc_keys = engine.document_keys(doc_ids)
+            paths = engine.document_paths(doc_ids)
+            infos = engine.document_info(doc_ids)
+            duplicates = engine.duplicate_paths(doc_ids)
+            took_ms = (time.perf_counter() - start) * 1000
+        finally:
+            self.running.pop(request_number, None)
+
+        hits = []
+        for doc_id, score in results:
+            info = infos.get(doc_id, {})
+            hits.append({"doc_id": doc_keys.get(doc_id), "score": score, "path": paths.get(doc_id),
+                         "title": info.get("title"), "description": info.get("description"),
+                         "snippet": info.get("snippet"), "duplicates": duplicates.get(doc_id, [])})
+        return {"query": query, "k": k, "total_matches": total_matches, "exact": exact,
+                "took_ms": took_ms, "results": hits}
+
+    #waits for a free slot, runs the query on the pool and returns (status, body)
+    async def search(self, query, k, deadline):
+        loop = asyncio.get_running_loop()
+        #a request whose deadline passed before it got here timed out, it was not turned away for lack of slots
+        if deadline - loop.time() <= 0:
+            self.timed_out += 1
+            return HTTPStatus.GATEWAY_TIMEOUT, {"error": f"query took longer than {self.timeout} s"}
+        try:
+            await asyncio.wait_for(self.slots.acquire(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "too many concurrent queries"}
+
+        request_number = next(self.request_numbers)
+        future = self.executor.submit(self.run_query, request_number, query, k)
+        #the slot is only given back when the worker is done, even if the client has been answered already
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.slots.release))
+        try:
+            body = await asyncio.wait_for(asyncio.wrap_future(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            engine = self.running.get(request_number)
+            if engine is not None:
+                engine.interrupt()
+            else:
+                future.cancel()
+            self.timed_out += 1
+            return HTTPStatus.GATEWAY_TIMEOUT, {"error": f"query took longer than {self.timeout} s"}
+        except Exception as error:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)}
+        self.completed += 1
+        return HTTPStatus.OK, body
+
+    async def route(self, method, target, deadline):
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "only GET is supported"}
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/health":
+            return HTTPStatus.OK, {"status": "ok", "completed": self.completed, "timed_out": self.timed_out,
+                                   "rejected": self.rejected, "running": len(self.running)}
+        if url.path != "/search":
+            return HTTPStatus.NOT_FOUND, {"error": f"no such endpoint: {url.path}"}
+
+        parameters = urllib.parse.parse_qs(url.query)
+        query = parameters.get("q", [""])[0]
+        if not query.strip():
+            return HTTPStatus.BAD_REQUEST, {"error": "missing q"}
+        try:
+            k = int(parameters.get("k", ["20"])[0])
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "k must be an integer"}
+        if not 1 <= k <= MAX_K:
+            return HTTPStatus.BAD_REQUEST, {"error": f"k must be between 1 and {MAX_K}"}
+        return await self.search(query, k, deadline)
+
+    #reads the request line and headers; returns (method, target) or None if the client sent nothing
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        for _ in range(MAX_HEADERS):
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        return method, target
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            try:
+                request = await asyncio.wait_for(self.read_request(reader), self.timeout)
+            except asyncio.TimeoutError:
+                status, body = HTTPStatus.REQUEST_TIMEOUT, {"error": "request not received in time"}
+            except ValueError:
+                status, body = HTTPStatus.BAD_REQUEST, {"error": "malformed request"}
+            else:
+                if request is None:
+                    return
+                status, body = await self.route(*request, deadline)
+
+            payload = json.dumps(body).encode("utf-8")
+            writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="query")
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{server.sockets[0].getsockname()[1]}/search?q=...&k=...")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+#client side of /search, used by the GUI: returns the decoded json body
+#HTTP errors are raised as RuntimeError with the service's error message
+def query_service(service_url, query, k=20, timeout=REQUEST_TIMEOUT + 1):
+    #urllib.request is only imported by the client, so the service starts without it
+    import urllib.error
+    import urllib.request
+    url = service_url.rstrip("/") + "/search?" + urllib.parse.urlencode({"q": query, "k": k})
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as error:
+        try:
+            message = json.load(error).get("error", error.reason)
+        except ValueError:
+            message = error.reason
+        raise RuntimeError(f"{error.code}: {message}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Serves /search?q=&k= as json over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--index", default="index.db", help="path to index.db")
+    parser.add_argument("--binary-index", help="path to index.bin, used for postings instead of index.db")
+    parser.add_argument("--segments", help="segment directory written by SegmentIndex.py")
+    parser.add_argument("--docstore", help="path to docstore.bin (default: next to the index)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="query threads")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_QUERIES,
+                        help="queries running or queued at once; further requests wait, then get 503")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT,
+                        help="seconds before a request is answered with 504")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    service = SearchService(args.index, args.binary_index, args.docstore, args.segments, args.workers,
+                            args.max_concurrent, args.timeout)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import argparse
+import threading
+
+SEGMENTS_DIRECTORY = 'segments'
+CATALOG_NAME = 'catalog.db'
+MERGE_FACTOR = 4  # segments of the same size tier that trigger a merge
+MAX_DELETED_RATIO = 0.5  # segments with more tombstoned documents than this are rewritten
+NORM_DRIFT_RATIO = 0.1  # documents added, changed or removed since a segment's norms, per document at that time
+INSERT_BATCH_SIZE = 10000
+
+#one merge at a time per process
+MERGE_LOCK = threading.Lock()
+
+#An incremental index is a directory of immutable segment databases plus catalog.db, which records:
+#  segments:   the live segments and how many documents were written to each
+#  documents:  every indexed document (id, url, file mtime/size) and the segment that holds its live copy
+#  tombstones: documents deleted from, or replaced in, an older segment
+#  term_df:    global document frequencies over all live documents
+#  segment_norms: the live document count and document_changes counter each segment's norms were computed at
+#Segments store raw tf values and a per-document norm; weights are computed at query time from the global
+#term_df, so adding a segment does not require reweighting the rest of the index.
+#A norm depends on the idf of all the terms of its document, so the norms of a segment go stale as the corpus
+#changes; once more than NORM_DRIFT_RATIO of the documents have changed since, they are recomputed.
+#Each row belongs to the document that produced it, so deleting a document removes all of its rows.
+def open_catalog(segments_path):
+    os.makedirs(segments_path, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(segments_path, CATALOG_NAME))
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS segments
+                 (name TEXT PRIMARY KEY, documents INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS documents
+                 (id TEXT PRIMARY KEY, path TEXT, mtime_ns INTEGER, size INTEGER, segment TEXT, valid INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS tombstones
+                 (segment TEXT, doc_id TEXT, PRIMARY KEY(segment, doc_id))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS term_df
+                 (token TEXT PRIMARY KEY, df INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS segment_norms
+                 (segment TEXT PRIMARY KEY, documents INTEGER, changes INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS catalog_state
+                 (key TEXT PRIMARY KEY, value INTEGER)''')
+    conn.commit()
+    return conn
+
+def segment_path(segments_path, name):
+    return os.path.join(segments_path, name + '.db')
+
+def catalog_value(c, key):
+    c.execute('SELECT value FROM catalog_state WHERE key = ?', (key,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+#reserves the name of the next segment
+def next_segment_name(conn):
+    c = conn.cursor()
+    number = catalog_value(c, 'next_segment')
+    c.execute("INSERT OR REPLACE INTO catalog_state (key, value) VALUES ('next_segment', ?)", (number + 1,))
+    conn.commit()
+    return f"seg_{number}"
+
+#creates an empty segment database, replacing any leftover file from an interrupted run
+def create_segment(segments_path, name):
+    path = segment_path(segments_path, name)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE seg_postings
+                 (token TEXT, doc_id TEXT, tf REAL, positions TEXT)''')
+    c.execute('''CREATE TABLE seg_docs
+                 (doc_id TEXT PRIMARY KEY, norm REAL)''')
+    conn.commit()
+    return conn
+
+def index_segment(conn):
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS seg_postings_token ON seg_postings(token)')
+    c.execute('CREATE INDEX IF NOT EXISTS seg_postings_doc ON seg_postings(doc_id)')
+    conn.commit()
+
+#removes segment files that are not registered in the catalog (left behind by an interrupted update or merge)
+def remove_orphan_segments(conn, segments_path):
+    c = conn.cursor()
+    c.execute('SELECT name FROM segments')
+    live = {row[0] + '.db' for row in c.fetchall()}
+    for file in os.listdir(segments_path):
+        if file.startswith('seg_') and file.endswith('.db') and file not in live:
+            os.remove(os.path.join(segments_path, file))
+
+#compares bookkeeping.json and the files on disk against the catalog
+#returns (added, changed, removed) doc id lists and {doc_id: (url, mtime_ns, size)} for the current files
+def find_delta(conn, webpages_raw_directory, bookkeeping_data):
+    c = conn.cursor()
+    c.execute('SELECT id, path, mtime_ns, size FROM documents')
+    indexed = {doc_id: (path, mtime_ns, size) for doc_id, path, mtime_ns, size in c.fetchall()}
+
+    current = {}
+    for doc_id, url in bookkeeping_data.items():
+        file_path = os.path.join(webpages_raw_directory, *doc_id.split('/'))
+        if not os.path.isfile(file_path):
+            continue
+        stat = os.stat(file_path)
+        current[doc_id] = (url, stat.st_mtime_ns, stat.st_size)
+
+    added = [doc_id for doc_id in current if doc_id not in indexed]
+    changed = [doc_id for doc_id in current if doc_id in indexed and indexed[doc_id] != current[doc_id]]
+    removed = [doc_id for doc_id in indexed if doc_id not in current]
+    return added, changed, removed, current
+
+#returns the {token: df} change caused by removing docs from their segments, and tombstones them
+#doc_segments is a list of (doc_id, segment name)
+def tombstone_documents(conn, segments_path, doc_segments):
+    c = conn.cursor()
+    df_changes = {}
+    by_segment = {}
+    for doc_id, segment in doc_segments:
+        if segment:
+            by_segment.setdefault(segment, []).append(doc_id)
+    for segment, doc_ids in by_segment.items():
+        segment_conn = sqlite3.connect(segment_path(segments_path, segment))
+        for doc_id in doc_ids:
+            for (token,) in segment_conn.execute('SELECT token FROM seg_postings WHERE doc_id = ?', (doc_id,)):
+                df_changes[token] = df_changes.get(token, 0) - 1
+            c.execute('INSERT OR IGNORE INTO tombstones (segment, doc_id) VALUES (?, ?)', (segment, doc_id))
+        segment_conn.close()
+    return df_changes
+
+def apply_df_changes(conn, df_changes):
+    c = conn.cursor()
+    c.executemany('''INSERT INTO term_df (token, df) VALUES (?, ?)
+                     ON CONFLICT(token) DO UPDATE SET df = df + excluded.df''', df_changes.items())
+    c.execute('DELETE FROM term_df WHERE df <= 0')
+
+#computes the norm of every document in segment name, attached as seg, from the current global statistics and
+#records the statistics they were computed at; must run on the catalog connection
+def compute_segment_norms(conn, name):
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM documents WHERE valid = 1')
+    valid_documents = c.fetchone()[0]
+    c.execute('''SELECT p.doc_id, p.tf, t.df FROM seg.seg_postings p
+                 JOIN term_df t ON t.token = p.token''')
+    norms = {}
+    for doc_id, tf, df in c.fetchall():
+        weight = tf*math.log10(valid_documents/(df + 1))
+        norms[doc_id] = norms.get(doc_id, 0) + math.pow(weight, 2)
+    c.executemany('UPDATE seg.seg_docs SET norm = ? WHERE doc_id = ?',
+                  [(math.sqrt(norm), doc_id) for doc_id, norm in norms.items()])
+    c.execute('INSERT OR REPLACE INTO segment_norms (segment, documents, changes) VALUES (?, ?, ?)',
+              (name, valid_documents, catalog_value(c, 'document_changes')))
+
+#recomputes the norms of the segments whose norms were computed before more than NORM_DRIFT_RATIO of the
+#documents changed (and of segments with no recorded statistics); returns the number of segments refreshed
+def refresh_segment_norms(conn, segments_path):
+    c = conn.cursor()
+    changes = catalog_value(c, 'document_changes')
+    c.execute('''SELECT s.name, n.documents, n.changes FROM segments s
+                 LEFT JOIN segment_norms n ON n.segment = s.name''')
+    stale = [name for name, documents, norm_changes in c.fetchall()
+             if documents is None or changes - norm_changes > NORM_DRIFT_RATIO * max(documents, 1)]
+    for name in stale:
+        c.execute('ATTACH DATABASE ? AS seg', (segment_path(segments_path, name),))
+        compute_segment_norms(conn, name)
+        conn.commit()
+        c.execute('DETACH DATABASE seg')
+    return len(stale)
+
+#indexes the documents that were added, changed or removed since the last update as one new segment
+#returns (added, changed, removed) counts
+def update_segments(webpages_raw_directory, segments_path=SEGMENTS_DIRECTORY, num_workers=1):
+    #the indexer is only imported by updates, so opening a SegmentedIndex for queries stays cheap
+    from CreateInvertedIndex import run_serial_pipeline, run_parallel_pipeline
+    from CorpusSources import DirectorySource
+    conn = open_catalog(segments_path)
+    remove_orphan_segments(conn, segments_path)
+
+    bookkeeping_data = DirectorySource(webpages_raw_directory).read_bookkeeping()
+
+    added, changed, removed, current = find_delta(conn, webpages_raw_directory, bookkeeping_data)
+    if not (added or changed or removed):
+        conn.close()
+        return 0, 0, 0
+
+    #tokenizes the new and changed documents into a new segment
+    #an update that only removes documents still writes an (empty) segment so the steps below stay uniform;
+    #the merge policy drops it later
+    name = next_segment_name(conn)
+    segment_conn = create_segment(segments_path, name)
+    segment_c = segment_conn.cursor()
+    df_changes = {}
+    valid = {}
+    batch = []
+
+    def write_document(doc_id, postings_dict, doc_info):
+        valid[doc_id] = 1 if postings_dict else 0
+        if postings_dict:
+            segment_c.execute('INSERT INTO seg_docs (doc_id, norm) VALUES (?, NULL)', (doc_id,))
+        for token, values in postings_dict.items():
+            _, tf, positions, html_weights = values
+            batch.append((token, doc_id, tf, " ".join(str(i) for i in positions)))
+            df_changes[token] = df_changes.get(token, 0) + 1
+        if len(batch) >= INSERT_BATCH_SIZE:
+            segment_c.executemany('INSERT INTO seg_postings (token, doc_id, tf, positions) VALUES (?, ?, ?, ?)', batch)
+            batch.clear()
+
+    documents = [(os.path.join(webpages_raw_directory, *doc_id.split('/')), None) for doc_id in added + changed]
+    if num_workers > 1:
+        run_parallel_pipeline(documents, bookkeeping_data, write_document, num_workers)
+    else:
+        run_serial_pipeline(documents, bookkeeping_data, write_document)
+    segment_c.executemany('INSERT INTO seg_postings (token, doc_id, tf, positions) VALUES (?, ?, ?, ?)', batch)
+    segment_conn.commit()
+    index_segment(segment_conn)
+    segment_conn.close()
+
+    #everything below is one catalog transaction, so a crash leaves the catalog at the previous state
+    c = conn.cursor()
+    c.execute('ATTACH DATABASE ? AS seg', (segment_path(segments_path, name),))
+    c.execute('SELECT id, segment FROM documents WHERE id IN (SELECT value FROM json_each(?))',
+              (json.dumps(changed + removed),))
+    for token, change in tombstone_documents(conn, segments_path, c.fetchall()).items():
+        df_changes[token] = df_changes.get(token, 0) + change
+    apply_df_changes(conn, df_changes)
+
+    c.executemany('DELETE FROM documents WHERE id = ?', [(doc_id,) for doc_id in removed])
+    c.executemany('INSERT OR REPLACE INTO documents (id, path, mtime_ns, size, segment, valid) VALUES (?, ?, ?, ?, ?, ?)',
+                  [(doc_id, *current[doc_id], name, valid.get(doc_id, 0)) for doc_id in added + changed])
+    c.execute('INSERT INTO segments (name, documents) VALUES (?, ?)', (name, len(added) + len(changed)))
+    c.execute("INSERT OR REPLACE INTO catalog_state (key, value) VALUES ('document_changes', ?)",
+              (catalog_value(c, 'document_changes') + len(added) + len(changed) + len(removed),))
+    compute_segment_norms(conn, name)
+    conn.commit()
+    c.execute('DETACH DATABASE seg')
+    refresh_segment_norms(conn, segments_path)
+    conn.close()
+    return len(added), len(changed), len(removed)
+
+#picks the segments to merge next: MERGE_FACTOR segments of the same size tier (tier = log base MERGE_FACTOR of
+#the live document count), or a single segment whose documents are mostly tombstoned
+def select_merge(conn):
+    c = conn.cursor()
+    c.execute('''SELECT s.name, s.documents, COUNT(d.id) FROM segments s
+                 LEFT JOIN documents d ON d.segment = s.name
+                 GROUP BY s.name ORDER BY COUNT(d.id)''')
+    tiers = {}
+    for name, written, live in c.fetchall():
+        if live == 0 or (written - live) / written > MAX_DELETED_RATIO:
+            return [name]
+        tier = int(math.log(max(live, 1), MERGE_FACTOR))
+        tiers.setdefault(tier, []).append(name)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= MERGE_FACTOR:
+            return tiers[tier][:MERGE_FACTOR]
+    return None
+
+#rewrites the live documents of the given segments into one new segment with freshly computed norms
+def merge_segment_group(conn, segments_path, names):
+    name = next_segment_name(conn)
+    create_segment(segments_path, name).close()
+    c = conn.cursor()
+    c.execute('ATTACH DATABASE ? AS seg', (segment_path(segments_path, name),))
+    for old_name in names:
+        c.execute('ATTACH DATABASE ? AS old', (segment_path(segments_path, old_name),))
+        c.execute('''INSERT INTO seg.seg_postings (token, doc_id, tf, positions)
+                     SELECT p.token, p.doc_id, p.tf, p.positions FROM old.seg_postings p
+                     JOIN documents d ON d.id = p.doc_id AND d.segment = ?''', (old_name,))
+        c.execute('''INSERT INTO seg.seg_docs (doc_id, norm)
+                     SELECT o.doc_id, NULL FROM old.seg_docs o
+                     JOIN documents d ON d.id = o.doc_id AND d.segment = ?''', (old_name,))
+        conn.commit()
+        c.execute('DETACH DATABASE old')
+    c.execute('CREATE INDEX seg.seg_postings_token ON seg_postings(token)')
+    c.execute('CREATE INDEX seg.seg_postings_doc ON seg_postings(doc_id)')
+
+    #switches the catalog over to the merged segment in one transaction
+    compute_segment_norms(conn, name)
+    c.execute(f'SELECT COUNT(*) FROM documents WHERE segment IN ({", ".join("?" * len(names))})', names)
+    live = c.fetchone()[0]
+    c.execute(f'UPDATE documents SET segment = ? WHERE segment IN ({", ".join("?" * len(names))})', (name, *names))
+    c.executemany('DELETE FROM segments WHERE name = ?', [(old_name,) for old_name in names])
+    c.executemany('DELETE FROM tombstones WHERE segment = ?', [(old_name,) for old_name in names])
+    c.executemany('DELETE FROM segment_norms WHERE segment = ?', [(old_name,) for old_name in names])
+    #a segment whose documents were all deleted is simply dropped
+    if live:
+        c.execute('INSERT INTO segments (name, documents) VALUES (?, ?)', (name, live))
+    conn.commit()
+    c.execute('DETACH DATABASE seg')
+    for old_name in names:
+        os.remove(segment_path(segments_path, old_name))
+    if not live:
+        c.execute('DELETE FROM segment_norms WHERE segment = ?', (name,))
+        conn.commit()
+        os.remove(segment_path(segments_path, name))
+    return name
+
+#merges segments until the merge policy is satisfied, then recomputes the norms that went stale; returns the
+#number of merges performed
+def merge_segments(segments_path=SEGMENTS_DIRECTORY):
+    merges = 0
+    with MERGE_LOCK:
+        conn = open_catalog(segments_path)
+        while True:
+            names = select_merge(conn)
+            if not names:
+                break
+            merge_segment_group(conn, segments_path, names)
+            merges += 1
+        refresh_segment_norms(conn, segments_path)
+        conn.close()
+    return merges
+
+#runs merge_segments on a background thread and returns the thread
+def start_background_merge(segments_path=SEGMENTS_DIRECTORY):
+    thread = threading.Thread(target=merge_segments, args=(segments_path,), name="segment-merge")
+    thread.start()
+    return thread
+
+#query-time view over all segments
+#postings(term) merges the live postings of every segment and weights them with the global df, so it can be
+#passed to compute_cosine_similarity / top_k_cosine_similarity in place of an index.db connection
+class SegmentedIndex:
+
+    def __init__(self, segments_path=SEGMENTS_DIRECTORY):
+        self.segments_path = segments_path
+        self.catalog = sqlite3.connect(os.path.join(segments_path, CATALOG_NAME))
+        c = self.catalog.cursor()
+        c.execute('SELECT COUNT(*) FROM documents WHERE valid = 1')
+        self.valid_documents = c.fetchone()[0]
+        c.execute('SELECT name FROM segments ORDER BY name')
+        self.segments = []
+        for (name,) in c.fetchall():
+            c.execute('SELECT doc_id FROM tombstones WHERE segment = ?', (name,))
+            tombstones = {row[0] for row in c.fetchall()}
+            self.segments.append((sqlite3.connect(segment_path(segments_path, name)), tombstones))
+
+    def close(self):
+        for segment_conn, _ in self.segments:
+            segment_conn.close()
+        self.catalog.close()
+
+    def document_count(self):
+        return self.valid_documents
+
+    def max_weight(self, term):
+        return None
+
+    def document_frequency(self, term):
+        c = self.catalog.cursor()
+        c.execute('SELECT df FROM term_df WHERE token = ?', (term,))
+        row = c.fetchone()
+        return row[0] if row else 0
+
+    #returns the doc-ordered (doc_id, nweight) postings of term across all segments, skipping tombstoned documents
+    def postings(self, term):
+        return self.weighted_rows(term)
+
+    #postings() with the stored positions of every row: doc-ordered (doc_id, nweight, positions) rows
+    def position_rows(self, term):
+        return self.weighted_rows(term, with_positions=True)
+
+    def weighted_rows(self, term, with_positions=False):
+        df = self.document_frequency(term)
+        if df == 0:
+            return []
+        idf = math.log10(self.valid_documents/(df + 1))
+        columns = 'p.doc_id, p.tf, d.norm, p.positions' if with_positions else 'p.doc_id, p.tf, d.norm'
+        rows = []
+        for segment_conn, tombstones in self.segments:
+            for doc_id, tf, norm, *positions in segment_conn.execute(f'''SELECT {columns} FROM seg_postings p
+                                                                         JOIN seg_docs d ON d.doc_id = p.doc_id
+                                                                         WHERE p.token = ?''', (term,)):
+                if doc_id not in tombstones:
+                    rows.append((doc_id, tf*idf/norm if norm else 0.0, *positions))
+        rows.sort(key=lambda row: row[:2])
+        return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally updates a segmented index from a WEBPAGES_RAW folder.")
+    parser.add_argument("webpages_raw_directory", help="path to the WEBPAGES_RAW folder")
+    parser.add_argument("--segments", default=SEGMENTS_DIRECTORY, help="segment directory (default: segments)")
+    parser.add_argument("--workers", type=int, default=1, help="number of tokenizer processes")
+    parser.add_argument("--no-merge", action="store_true", help="skip the background segment merge")
+    args = parser.parse_args()
+
+    start = time.time()
+    added, changed, removed = update_segments(args.webpages_raw_directory, args.segments, args.workers)
+    print(f"\nAdded: {added} | Changed: {changed} | Removed: {removed} | Time Elapsed: {time.time()-start:.2f} s")
+    if not args.no_merge:
+        merge_thread = start_background_merge(args.segments)
+        print("Merging segments in the background...")
+        merge_thread.join()
+        print("Segment merge complete.")
+
+if __name__ == "__main__":
+    main()
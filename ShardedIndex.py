@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import heapq
+import pickle
+import shutil
+import sqlite3
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from CreateInvertedIndex import (setup_database, run_serial_pipeline, number_documents, number_postings,
+                                 write_documents, write_term_stats, TOKENIZERS)
+from SpimiIndexer import SpimiInverter, DEFAULT_MEMORY_BUDGET
+from BinaryIndex import write_binary_index
+from TermDictionary import write_term_dictionary
+from QueryRuntime import write_query_lemmas
+from DocumentTable import write_document_table, open_document_table
+from DocumentStore import DocumentStoreWriter, DocumentStoreReader
+from QueryEngine import QueryEngine
+from Metrics import METRICS
+
+SHARDS_DIRECTORY = 'shards'
+MANIFEST_NAME = 'shards.json'
+
+#A sharded index is a directory with one complete index (index.db, terms.dict, docstore.bin and optionally index.bin)
+#per shard plus shards.json. Documents are numbered over the whole corpus and every shard holds one contiguous
+#range of doc numbers, so doc numbers (and the document tables) stay dense within a shard. Every shard is
+#built by its own process in three steps:
+#  1. tokenize the shard's documents; anchor text rows that belong to a document of another shard are
+#     written to an outbox file for that shard
+#  2. add the rows received from the other shards and report the shard's document frequencies
+#  3. weight the postings with the corpus-wide document count and document frequencies (the sums over all
+#     shards), so every nweight is the one an unsharded build computes
+#Queries are sent to every shard on a process pool and the per-shard top k lists are merged.
+def shard_of(doc, shard_count, document_count):
+    return doc * shard_count // document_count
+
+def shard_path(shards_path, shard):
+    return os.path.join(shards_path, f"shard_{shard}")
+
+def outbox_path(shards_path, source, destination):
+    return os.path.join(shard_path(shards_path, destination), f"inbound_{source}.bin")
+
+def read_manifest(shards_path):
+    with open(os.path.join(shards_path, MANIFEST_NAME), 'r') as manifest_file:
+        return json.load(manifest_file)
+
+#runs one build step in a pool process with the parent's metrics settings and returns its metrics with the result
+def run_shard_step(step, metrics_settings, *args):
+    METRICS.configure(**metrics_settings)
+    METRICS.reset()
+    result = step(*args)
+    return result, METRICS.state()
+
+#step 1: tokenizes the documents of one shard into a SpimiInverter kept on disk in the shard directory
+#every shard reads the whole corpus source but only tokenizes its own documents
+def tokenize_shard(shards_path, shard, shard_count, source, url_dict, doc_numbers, tokenizer, memory_budget):
+    directory = shard_path(shards_path, shard)
+    document_count = len(doc_numbers)
+    conn = setup_database(os.path.join(directory, 'index.db'))
+    write_documents(conn, {doc_key: number for doc_key, number in doc_numbers.items()
+                           if shard_of(number, shard_count, document_count) == shard}, url_dict)
+    conn.close()
+
+    inverter = SpimiInverter(memory_budget, run_directory=directory)
+    doc_store = DocumentStoreWriter(os.path.join(directory, 'docstore.bin'))
+    outboxes = {}
+
+    def store(doc_id, postings_dict, doc_info):
+        own = {}
+        foreign = {}
+        for token, values in number_postings(postings_dict, doc_numbers).items():
+            destination = shard_of(values[0], shard_count, document_count)
+            if destination == shard:
+                own[token] = values
+            else:
+                foreign.setdefault(destination, {})[token] = values
+        inverter.add_document(own)
+        for destination, rows in foreign.items():
+            if destination not in outboxes:
+                outboxes[destination] = open(outbox_path(shards_path, shard, destination), 'wb')
+            pickle.dump(rows, outboxes[destination], pickle.HIGHEST_PROTOCOL)
+        if doc_info:
+            doc_store.add(doc_id, doc_info)
+
+    documents = source.documents(lambda doc_key: shard_of(doc_numbers[doc_key], shard_count, document_count) == shard)
+    stats = run_serial_pipeline(documents, url_dict, store, tokenizer)
+    inverter.flush_run()
+    for outbox in outboxes.values():
+        outbox.close()
+    doc_store.close()
+    return inverter, stats.valid_documents
+
+#step 2: adds the rows the other shards sent to this one and returns the shard's document frequencies
+def exchange_shard(shards_path, shard, shard_count, inverter):
+    for source in range(shard_count):
+        path = outbox_path(shards_path, source, shard)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as outbox:
+            while True:
+                try:
+                    inverter.add_document(pickle.load(outbox))
+                except EOFError:
+                    break
+        os.remove(path)
+    return inverter, inverter.document_frequencies()
+
+#step 3: writes the shard's final_postings with the corpus-wide statistics
+def weight_shard(shards_path, shard, inverter, valid_documents, document_frequencies, binary_index):
+    directory = shard_path(shards_path, shard)
+    conn = sqlite3.connect(os.path.join(directory, 'index.db'))
+    inverter.merge(conn, valid_documents, document_frequencies)
+    write_term_stats(conn)
+    write_term_dictionary(conn, os.path.join(directory, 'terms.dict'), document_frequencies)
+    write_query_lemmas(conn, document_frequencies)
+    write_document_table(conn)
+    if binary_index:
+        write_binary_index(conn, os.path.join(directory, 'index.bin'))
+    conn.close()
+
+#runs step(*arguments) for every shard on the pool and returns the results in shard order
+def run_shard_steps(pool, step, arguments):
+    results = []
+    for result, state in pool.starmap(run_shard_step, [(step, METRICS.settings()) + tuple(args)
+                                                        for args in arguments]):
+        METRICS.merge(state)
+        results.append(result)
+    return results
+
+#builds a sharded index of the corpus source in shards_path with one process per shard (at most workers)
+#returns (valid documents, vocabulary size)
+def build_shards(source, url_dict, shard_count, shards_path=SHARDS_DIRECTORY, workers=None,
+                 tokenizer=TOKENIZERS[0], memory_budget=DEFAULT_MEMORY_BUDGET, binary_index=False):
+    #shards of an earlier build are replaced; the manifest goes last so a half-built directory is never opened
+    os.makedirs(shards_path, exist_ok=True)
+    manifest = os.path.join(shards_path, MANIFEST_NAME)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    for shard in itertools.count():
+        if not os.path.isdir(shard_path(shards_path, shard)):
+            break
+        shutil.rmtree(shard_path(shards_path, shard))
+    for shard in range(shard_count):
+        os.makedirs(shard_path(shards_path, shard))
+
+    shards = range(shard_count)
+    doc_numbers = number_documents(source, url_dict)
+    with multiprocessing.Pool(min(workers or shard_count, shard_count)) as pool:
+        print(f"Tokenizing {shard_count} shards...")
+        start = time.time()
+        tokenized = run_shard_steps(pool, tokenize_shard, [(shards_path, shard, shard_count, source, url_dict,
+                                                            doc_numbers, tokenizer, memory_budget // shard_count)
+                                                           for shard in shards])
+        print(f"Time Elapsed: {time.time() - start:.2f} s")
+
+        print("Exchanging anchor text and document frequencies...")
+        start = time.time()
+        exchanged = run_shard_steps(pool, exchange_shard, [(shards_path, shard, shard_count, tokenized[shard][0])
+                                                           for shard in shards])
+        valid_documents = sum(valid for _, valid in tokenized)
+        document_frequencies = {}
+        for _, shard_frequencies in exchanged:
+            for token, df in shard_frequencies.items():
+                document_frequencies[token] = document_frequencies.get(token, 0) + df
+        print(f"Time Elapsed: {time.time() - start:.2f} s")
+
+        print("Calculating tf-idf weights...")
+        start = time.time()
+        run_shard_steps(pool, weight_shard, [(shards_path, shard, exchanged[shard][0], valid_documents,
+                                              document_frequencies, binary_index) for shard in shards])
+        print(f"Time Elapsed: {time.time() - start:.2f} s")
+
+    with open(manifest + ".tmp", 'w') as manifest_file:
+        json.dump({"shard_count": shard_count, "document_count": len(doc_numbers),
+                   "valid_documents": valid_documents, "vocabulary_size": len(document_frequencies)}, manifest_file)
+    os.replace(manifest + ".tmp", manifest)
+    return valid_documents, len(document_frequencies)
+
+#QueryEngine of each shard opened by this pool process, created on first use
+SHARD_ENGINES = {}
+
+def shard_engine(directory):
+    engine = SHARD_ENGINES.get(directory)
+    if engine is None:
+        binary_index_path = os.path.join(directory, 'index.bin')
+        engine = SHARD_ENGINES[directory] = QueryEngine(
+            os.path.join(directory, 'index.db'),
+            binary_index_path if os.path.exists(binary_index_path) else None,
+            document_store_path='', read_only=True)
+    return engine
+
+#runs in a pool process: the top k of one shard
+def search_shard(directory, query, k):
+    return shard_engine(directory).search(query, k)
+
+#merges per-shard (top k, total matches, exact) results into the top k of the whole index
+#a document lives in exactly one shard, so the global top k is among the shards' top k lists; doc numbers are
+#global, so ties are broken the same way as in an unsharded index
+def merge_shard_results(shard_results, k):
+    ranked = heapq.merge(*[results for results, _, _ in shard_results], key=lambda item: (-item[1], item[0]))
+    return (list(itertools.islice(ranked, k)), sum(total for _, total, _ in shard_results),
+            all(exact for _, _, exact in shard_results))
+
+#scatter-gather search over a sharded index, with the search / document_paths / document_keys / document_info /
+#close methods of QueryEngine so the CLI can use either
+class ShardedIndex:
+
+    def __init__(self, shards_path=SHARDS_DIRECTORY, workers=None):
+        manifest = read_manifest(shards_path)
+        self.shard_count = manifest["shard_count"]
+        self.document_count = manifest["document_count"]
+        self.shard_paths = [shard_path(shards_path, shard) for shard in range(self.shard_count)]
+        self.executor = ProcessPoolExecutor(workers or min(self.shard_count, os.cpu_count() or 1))
+        self.conns = [sqlite3.connect(os.path.join(path, 'index.db')) for path in self.shard_paths]
+        self.document_tables = [open_document_table(conn) for conn in self.conns]
+        self.document_stores = [DocumentStoreReader(os.path.join(path, 'docstore.bin'))
+                                if os.path.exists(os.path.join(path, 'docstore.bin')) else None
+                                for path in self.shard_paths]
+
+    #returns (top k [(doc_id, score)], total matches, whether the total is exact) like QueryEngine.search
+    def search(self, query, k=20):
+        futures = [self.executor.submit(search_shard, path, query, k) for path in self.shard_paths]
+        return merge_shard_results([future.result() for future in futures], k)
+
+    #{shard: [doc_id]} for the given doc ids
+    def group_by_shard(self, doc_ids):
+        groups = {}
+        for doc_id in doc_ids:
+            groups.setdefault(shard_of(doc_id, self.shard_count, self.document_count), []).append(doc_id)
+        return groups
+
+    #{doc_id: value} of a document table column, from the tables of the shards that hold the doc ids
+    def document_values(self, name, doc_ids):
+        values = {}
+        for shard, shard_doc_ids in self.group_by_shard(doc_ids).items():
+            values.update(self.document_tables[shard].values(name, shard_doc_ids))
+        return values
+
+    def document_paths(self, doc_ids):
+        return {doc_id: url or None for doc_id, url in self.document_values("url", doc_ids).items()}
+
+    def document_keys(self, doc_ids):
+        return self.document_values("doc_key", doc_ids)
+
+    #shards are built without near-duplicate detection
+    def duplicate_paths(self, doc_ids):
+        return {}
+
+    def document_info(self, doc_ids):
+        infos = {}
+        for shard, shard_doc_ids in self.group_by_shard(doc_ids).items():
+            if self.document_stores[shard] is not None:
+                doc_keys = self.document_tables[shard].values("doc_key", shard_doc_ids)
+                records = self.document_stores[shard].get_many(doc_keys.values())
+                infos.update((doc_id, records[doc_key]) for doc_id, doc_key in doc_keys.items() if doc_key in records)
+        return infos
+
+    def close(self):
+        self.executor.shutdown()
+        for conn in self.conns:
+            conn.close()
+        for document_store in self.document_stores:
+            if document_store is not None:
+                document_store.close()
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Searches a sharded index built with CreateInvertedIndex.py --shards.")
+    parser.add_argument("queries", nargs="+", help="queries to run")
+    parser.add_argument("--shard-dir", default=SHARDS_DIRECTORY)
+    parser.add_argument("--workers", type=int, help="query processes (default: one per shard, up to the core count)")
+    parser.add_argument("-k", type=int, default=20)
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    index = ShardedIndex(args.shard_dir, args.workers)
+    try:
+        for query in args.queries:
+            start = time.perf_counter()
+            results, total_matches, exact = index.search(query, args.k)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"\n{query}: {'' if exact else 'About '}{total_matches} results ({elapsed:.1f} ms)")
+            paths = index.document_paths([doc_id for doc_id, _ in results])
+            for rank, (doc_id, score) in enumerate(results, 1):
+                print(f"{rank}. {paths.get(doc_id)} ({score:.4f})")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import math
+from array import array
+import numpy as np
+from Metrics import METRICS
+from TermDictionary import create_final_postings_table
+from DocumentTable import store_document_norms
+
+#collects the (term, doc, tf) triples of the corpus in flat arrays and weights them as one sparse matrix
+#merge() sorts the triples into a term-major compressed sparse matrix (CSR with a row per term, i.e. the CSC
+#form of the doc-term matrix), then computes df, idf, tf-idf weights and document norms with a few array
+#operations and writes final_postings in one bulk pass, instead of a SELECT per token and per document.
+#the whole matrix is kept in memory; corpora that do not fit should use SpimiInverter
+class SparseInverter:
+
+    def __init__(self):
+        self.term_ids = {}
+        self.row_terms = array('q')
+        self.row_docs = array('q')
+        self.row_tfs = array('d')
+        self.row_positions = []
+
+    #adds the postings of one document (the output of calculate_tf, with doc numbers) as rows of the matrix
+    #doc numbers are dense, so they are used as the column indexes of the matrix as they are
+    def add_document(self, postings_dict):
+        term_ids = self.term_ids
+        for token, values in postings_dict.items():
+            doc_id, tf, positions, html_weights = values
+            term_id = term_ids.get(token)
+            if term_id is None:
+                term_id = term_ids[token] = len(term_ids)
+            self.row_terms.append(term_id)
+            self.row_docs.append(doc_id)
+            self.row_tfs.append(tf)
+            self.row_positions.append(" ".join(str(i) for i in positions))
+
+    #returns (terms, indptr, order): the sorted vocabulary, the offset of each term's postings and the
+    #permutation of the added rows that puts them in term order
+    #the sort is stable, so within a term the postings keep corpus order like the other builds
+    def term_major_order(self):
+        terms = sorted(self.term_ids)
+        term_rank = np.empty(len(terms), dtype=np.int64)
+        term_rank[[self.term_ids[term] for term in terms]] = np.arange(len(terms))
+        row_ranks = term_rank[np.frombuffer(self.row_terms, dtype=np.int64)] if self.row_terms else \
+            np.empty(0, dtype=np.int64)
+        order = np.argsort(row_ranks, kind='stable')
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_ranks, minlength=len(terms)), out=indptr[1:])
+        return terms, indptr, order
+
+    #weights the matrix and writes it to final_postings and the document norms to doc_norms; returns the vocabulary size
+    def merge(self, conn, valid_documents):
+        with METRICS.timer("sparse_matrix"):
+            terms, indptr, order = self.term_major_order()
+            docs = np.frombuffer(self.row_docs, dtype=np.int64)[order]
+            tfs = np.frombuffer(self.row_tfs, dtype=np.float64)[order]
+
+        idf_timer = METRICS.timer("idf").start()
+        document_counts = np.diff(indptr)
+        #math.log10 is evaluated once per distinct df, so the idf values are the ones the sql build computes
+        distinct_counts, count_index = np.unique(document_counts, return_inverse=True)
+        idf = np.array([math.log10(valid_documents/(int(count) + 1)) for count in distinct_counts],
+                       dtype=np.float64)[count_index]
+        weights = tfs * np.repeat(idf, document_counts)
+        idf_timer.stop()
+
+        normalize_timer = METRICS.timer("normalize").start()
+        #squared weights are summed per document in term order like normalize_weight, but squared with a multiply
+        #rather than math.pow, so an nweight can differ from the other builds in its last bit
+        magnitudes = np.sqrt(np.bincount(docs, weights=weights * weights))
+        row_magnitudes = magnitudes[docs]
+        nweights = np.divide(weights, row_magnitudes, out=np.zeros_like(weights), where=row_magnitudes != 0)
+        normalize_timer.stop()
+
+        insert_timer = METRICS.timer("sqlite_insert").start()
+        c = conn.cursor()
+        create_final_postings_table(c)
+        row_terms = np.repeat(np.arange(len(terms)), document_counts).tolist()
+        rows = zip((terms[term_index] for term_index in row_terms), docs.tolist(),
+                   (self.row_positions[i] for i in order.tolist()), nweights.tolist())
+        c.executemany('INSERT INTO final_postings (token, doc_id, positions, nweight) VALUES(?, ?, ?, ?)', rows)
+        indexed_docs = np.unique(docs)
+        store_document_norms(c, zip(indexed_docs.tolist(), magnitudes[indexed_docs].tolist()))
+        c.execute('''DROP TABLE IF EXISTS tokens''')
+        conn.commit()
+        insert_timer.stop()
+        METRICS.count("rows_inserted", len(order))
+        return len(terms)
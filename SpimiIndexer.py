@@ -0,0 +1,161 @@
+import os
+import math
+import heapq
+import pickle
+import shutil
+import tempfile
+from Metrics import METRICS
+from DocumentTable import store_document_norms
+from TermDictionary import create_final_postings_table
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of postings held in memory before a run is flushed
+POSTING_OVERHEAD = 160  # rough size in bytes of one in-memory posting tuple, excluding its positions string
+TERM_OVERHEAD = 120  # rough size in bytes of a dictionary entry for a new term
+INSERT_BATCH_SIZE = 10000
+MERGE_FAN_IN = 64  # maximum number of runs opened at once during a merge
+
+#streams (term, postings) records back out of a run file written by SpimiInverter
+def read_run(run_path):
+    with open(run_path, 'rb') as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+#Single-Pass In-Memory Inversion: postings are collected in a term dictionary until the memory budget
+#is reached, then written out as a term-sorted run. merge() k-way merges the runs and computes
+#df, idf, tf-idf weights and document norms in the same pass, so no intermediate SQL tables are needed
+class SpimiInverter:
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, run_directory=None):
+        self.memory_budget = memory_budget
+        self.run_directory = tempfile.mkdtemp(prefix="spimi_runs_", dir=run_directory or os.getcwd())
+        self.run_paths = []
+        self.dictionary = {}
+        self.memory_used = 0
+
+    #adds the postings of one document (the output of calculate_tf) to the in-memory dictionary
+    def add_document(self, postings_dict):
+        for token, values in postings_dict.items():
+            doc_id, tf, positions, html_weights = values
+            positions_string = " ".join(str(i) for i in positions)
+            if token not in self.dictionary:
+                self.dictionary[token] = []
+                self.memory_used += TERM_OVERHEAD + len(token)
+            self.dictionary[token].append((doc_id, len(positions), tf, positions_string))
+            self.memory_used += POSTING_OVERHEAD + len(positions_string)
+
+        if self.memory_used >= self.memory_budget:
+            self.flush_run()
+
+    #writes the in-memory dictionary to disk as a run sorted by term and empties it
+    def flush_run(self):
+        if not self.dictionary:
+            return
+        run_path = os.path.join(self.run_directory, f"run_{len(self.run_paths)}.bin")
+        with METRICS.timer("spimi_flush"), open(run_path, 'wb') as run_file:
+            for token in sorted(self.dictionary):
+                pickle.dump((token, self.dictionary[token]), run_file, pickle.HIGHEST_PROTOCOL)
+        METRICS.count("runs_flushed")
+        self.run_paths.append(run_path)
+        self.dictionary = {}
+        self.memory_used = 0
+
+    #yields (term, postings) in term order across the given runs
+    #runs are flushed in corpus order and heapq.merge is stable, so a term's postings keep that order
+    def merged_terms(self, run_paths):
+        streams = [read_run(run_path) for run_path in run_paths]
+        current_token = None
+        current_postings = []
+        for token, postings in heapq.merge(*streams, key=lambda record: record[0]):
+            if token != current_token:
+                if current_token is not None:
+                    yield current_token, current_postings
+                current_token = token
+                current_postings = []
+            current_postings.extend(postings)
+        if current_token is not None:
+            yield current_token, current_postings
+
+    #merges groups of MERGE_FAN_IN runs into larger runs until a single merge can open all of them
+    def reduce_runs(self):
+        generation = 0
+        while len(self.run_paths) > MERGE_FAN_IN:
+            merged_paths = []
+            for i in range(0, len(self.run_paths), MERGE_FAN_IN):
+                group = self.run_paths[i:i + MERGE_FAN_IN]
+                if len(group) == 1:
+                    merged_paths.append(group[0])
+                    continue
+                run_path = os.path.join(self.run_directory, f"merge_{generation}_{i // MERGE_FAN_IN}.bin")
+                with open(run_path, 'wb') as run_file:
+                    for record in self.merged_terms(group):
+                        pickle.dump(record, run_file, pickle.HIGHEST_PROTOCOL)
+                for old_path in group:
+                    os.remove(old_path)
+                merged_paths.append(run_path)
+            self.run_paths = merged_paths
+            generation += 1
+
+    #returns {term: df} over the postings added so far; a sharded build sums these across shards
+    def document_frequencies(self):
+        self.flush_run()
+        self.reduce_runs()
+        return {token: len(postings) for token, postings in self.merged_terms(self.run_paths)}
+
+    #merges the runs into final_postings and the document norms into doc_norms
+    #the merge pass computes df, idf and weights and accumulates each document's squared norm while
+    #writing the weighted postings to a single term-ordered file; a sequential read of that file then
+    #divides by the norms and bulk inserts the rows
+    #a shard passes the corpus-wide valid_documents and document_frequencies so its weights match an unsharded index
+    def merge(self, conn, valid_documents, document_frequencies=None):
+        self.flush_run()
+        with METRICS.timer("spimi_reduce"):
+            self.reduce_runs()
+        idf_timer = METRICS.timer("idf").start()
+        doc_norms = {}
+        vocabulary_size = 0
+        weighted_path = os.path.join(self.run_directory, "weighted.bin")
+        with open(weighted_path, 'wb') as weighted_file:
+            for token, postings in self.merged_terms(self.run_paths):
+                vocabulary_size += 1
+                document_count = document_frequencies[token] if document_frequencies else len(postings)
+                idf = math.log10(valid_documents/(document_count + 1))
+                weighted = []
+                for doc_id, frequency, tf, positions_string in postings:
+                    weight = tf*idf
+                    doc_norms[doc_id] = doc_norms.get(doc_id, 0) + math.pow(weight, 2)
+                    weighted.append((doc_id, positions_string, weight))
+                pickle.dump((token, weighted), weighted_file, pickle.HIGHEST_PROTOCOL)
+
+        for doc_id, norm in doc_norms.items():
+            doc_norms[doc_id] = math.sqrt(norm)
+        idf_timer.stop()
+
+        normalize_timer = METRICS.timer("normalize").start()
+        c = conn.cursor()
+        create_final_postings_table(c)
+        batch = []
+        for token, weighted in read_run(weighted_path):
+            for doc_id, positions_string, weight in weighted:
+                magnitude = doc_norms[doc_id]
+                nweight = weight/magnitude if magnitude else 0.0
+                batch.append((token, doc_id, positions_string, nweight))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                c.executemany('INSERT INTO final_postings (token, doc_id, positions, nweight) VALUES(?, ?, ?, ?)', batch)
+                batch = []
+        if batch:
+            c.executemany('INSERT INTO final_postings (token, doc_id, positions, nweight) VALUES(?, ?, ?, ?)', batch)
+        store_document_norms(c, doc_norms.items())
+        c.execute('''DROP TABLE IF EXISTS tokens''')
+        conn.commit()
+        normalize_timer.stop()
+
+        self.cleanup()
+        return vocabulary_size
+
+    #removes the run directory
+    def cleanup(self):
+        shutil.rmtree(self.run_directory, ignore_errors=True)
+        self.run_paths = []
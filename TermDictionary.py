@@ -0,0 +1,316 @@
+import os
+import re
+import sys
+import mmap
+import time
+import struct
+import fnmatch
+import sqlite3
+from BinaryIndex import encode_varbyte, decode_varbyte
+
+TERM_DICTIONARY_MAGIC = b"SCTD"
+TERM_DICTIONARY_VERSION = 1
+BLOCK_SIZE = 16  # terms per front-coded block; a lookup decodes at most one block
+MAX_EXPANSIONS = 50  # terms a wildcard may expand to; the ones with the highest df are kept
+MAX_EXPANSION_SCAN = 100000  # dictionary entries a wildcard may look at before the expansion stops
+WILDCARD_CHARACTERS = "*?"
+
+#header: magic, version, term count, block size, index.db stamp, block table offset, entry table offset
+HEADER_FORMAT = "<4sIII16sQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+#entry of each term, in term order: first final_postings posting_id, row count, df, max weight
+ENTRY_FORMAT = "<qIId"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+#posting_id is declared INTEGER PRIMARY KEY, which makes it the rowid: terms.dict stores posting_id ranges and the
+#readers look them up by rowid, and unlike an implicit rowid it is never renumbered by VACUUM
+def create_final_postings_table(c, table='final_postings'):
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                  (posting_id INTEGER PRIMARY KEY, token TEXT, doc_id INTEGER, positions TEXT, nweight REAL,
+                   FOREIGN KEY(doc_id) REFERENCES documents(id))''')
+
+#rewrites final_postings in (token, posting_id) order if the rows of a term are not contiguous, so each postings
+#list is one posting_id range; the sql build writes final_postings document by document, the other builds term by term
+#the old table's pages are given back with VACUUM, they would otherwise stay in index.db as free pages
+#returns [(token, first posting_id, row count)] in term order
+def cluster_final_postings(conn):
+    c = conn.cursor()
+    c.execute('SELECT token, MIN(posting_id), MAX(posting_id), COUNT(*) FROM final_postings GROUP BY token ORDER BY token')
+    ranges = c.fetchall()
+    if all(last - first + 1 == count for _, first, last, count in ranges):
+        return [(token, first, count) for token, first, _, count in ranges]
+
+    c.execute('DROP TABLE IF EXISTS final_postings_clustered')
+    create_final_postings_table(c, 'final_postings_clustered')
+    c.execute('''INSERT INTO final_postings_clustered (token, doc_id, positions, nweight)
+                 SELECT token, doc_id, positions, nweight FROM final_postings ORDER BY token, posting_id''')
+    c.execute('DROP TABLE final_postings')
+    c.execute('ALTER TABLE final_postings_clustered RENAME TO final_postings')
+    conn.commit()
+    conn.execute('VACUUM')
+    return cluster_final_postings(conn)
+
+#writes the sorted, front-coded term dictionary of index.db to path
+#term_stats must have been written; document_frequencies overrides its df values (a shard passes the global ones)
+#a random stamp is stored in both files so a dictionary left over from another build is never used
+def write_term_dictionary(conn, path='terms.dict', document_frequencies=None):
+    ranges = cluster_final_postings(conn)
+    c = conn.cursor()
+    c.execute('SELECT token, df, max_weight FROM term_stats')
+    term_stats = {token: (df, max_weight) for token, df, max_weight in c.fetchall()}
+
+    blocks = bytearray()
+    block_offsets = []
+    entries = bytearray()
+    previous = b""
+    for i, (token, first_rowid, count) in enumerate(ranges):
+        encoded_token = token.encode('utf-8')
+        if i % BLOCK_SIZE == 0:
+            block_offsets.append(len(blocks))
+            encode_varbyte(len(encoded_token), blocks)
+            blocks += encoded_token
+        else:
+            shared = 0
+            limit = min(len(previous), len(encoded_token))
+            while shared < limit and previous[shared] == encoded_token[shared]:
+                shared += 1
+            encode_varbyte(shared, blocks)
+            encode_varbyte(len(encoded_token) - shared, blocks)
+            blocks += encoded_token[shared:]
+        previous = encoded_token
+        df, max_weight = term_stats.get(token, (count, 0.0))
+        if document_frequencies:
+            df = document_frequencies.get(token, df)
+        entries += struct.pack(ENTRY_FORMAT, first_rowid, count, df, max_weight)
+
+    stamp = os.urandom(16)
+    block_table_offset = HEADER_SIZE + len(blocks)
+    entries_offset = block_table_offset + 8 * len(block_offsets)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as dictionary_file:
+        dictionary_file.write(struct.pack(HEADER_FORMAT, TERM_DICTIONARY_MAGIC, TERM_DICTIONARY_VERSION, len(ranges),
+                                          BLOCK_SIZE, stamp, block_table_offset, entries_offset))
+        dictionary_file.write(blocks)
+        dictionary_file.write(struct.pack(f"<{len(block_offsets)}Q", *block_offsets))
+        dictionary_file.write(entries)
+    os.replace(temp_path, path)
+
+    c.execute('DROP TABLE IF EXISTS term_dictionary')
+    c.execute('CREATE TABLE term_dictionary (stamp BLOB)')
+    c.execute('INSERT INTO term_dictionary (stamp) VALUES (?)', (stamp,))
+    conn.commit()
+    return path
+
+#read-only, memory-mapped view of a dictionary written by write_term_dictionary
+#opening it only reads the header and the block table; lookups binary search the first term of each block and
+#decode one block, so an exact lookup is O(log V) and the process never builds a Python dict of the vocabulary
+class TermDictionary:
+
+    def __init__(self, path='terms.dict'):
+        self.path = path
+        self.dictionary_file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.term_count, self.block_size, self.stamp, block_table_offset, self.entries_offset = \
+            struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != TERM_DICTIONARY_MAGIC or version != TERM_DICTIONARY_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {TERM_DICTIONARY_VERSION} term dictionary")
+        block_count = (self.term_count + self.block_size - 1) // self.block_size
+        self.block_offsets = struct.unpack_from(f"<{block_count}Q", self.buffer, block_table_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+        self.dictionary_file.close()
+
+    def __len__(self):
+        return self.term_count
+
+    def first_term(self, block):
+        offset = HEADER_SIZE + self.block_offsets[block]
+        length, offset = decode_varbyte(self.buffer, offset)
+        return self.buffer[offset:offset + length]
+
+    #returns the encoded terms of a block
+    def block_terms(self, block):
+        offset = HEADER_SIZE + self.block_offsets[block]
+        count = min(self.block_size, self.term_count - block * self.block_size)
+        length, offset = decode_varbyte(self.buffer, offset)
+        term = self.buffer[offset:offset + length]
+        offset += length
+        terms = [term]
+        for _ in range(count - 1):
+            shared, offset = decode_varbyte(self.buffer, offset)
+            length, offset = decode_varbyte(self.buffer, offset)
+            term = term[:shared] + self.buffer[offset:offset + length]
+            offset += length
+            terms.append(term)
+        return terms
+
+    #returns the index of the first term >= key (term_count if there is none)
+    def lower_bound(self, key):
+        low = 0
+        high = len(self.block_offsets)
+        #finds the first block whose first term is > key; key can only be in the block before it
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        block = max(low - 1, 0)
+        for i, term in enumerate(self.block_terms(block) if self.block_offsets else []):
+            if term >= key:
+                return block * self.block_size + i
+        return min((block + 1) * self.block_size, self.term_count)
+
+    #returns the index of term, or None if it is not in the dictionary
+    def index(self, term):
+        key = term.encode('utf-8')
+        i = self.lower_bound(key)
+        if i < self.term_count and self.term_at(i) == key:
+            return i
+        return None
+
+    def term_at(self, i):
+        return self.block_terms(i // self.block_size)[i % self.block_size]
+
+    #(first rowid, row count, df, max weight) of the i-th term
+    def entry(self, i):
+        return struct.unpack_from(ENTRY_FORMAT, self.buffer, self.entries_offset + i * ENTRY_SIZE)
+
+    def __contains__(self, term):
+        return self.index(term) is not None
+
+    #returns the (first, last) final_postings posting_ids of term, or None
+    def row_range(self, term):
+        i = self.index(term)
+        if i is None:
+            return None
+        first_rowid, count, _, _ = self.entry(i)
+        return first_rowid, first_rowid + count - 1
+
+    def document_frequency(self, term):
+        i = self.index(term)
+        return self.entry(i)[2] if i is not None else 0
+
+    def max_weight(self, term):
+        i = self.index(term)
+        return self.entry(i)[3] if i is not None else None
+
+    #yields (index, term) for the terms that start with prefix, in term order
+    def terms_with_prefix(self, prefix):
+        key = prefix.encode('utf-8')
+        i = self.lower_bound(key)
+        block = i // self.block_size
+        while i < self.term_count:
+            terms = self.block_terms(block)
+            for term in terms[i - block * self.block_size:]:
+                if not term.startswith(key):
+                    return
+                yield i, term.decode('utf-8')
+                i += 1
+            block += 1
+
+    #returns the terms matching a pattern with * (any characters) and ? (one character)
+    #only the terms starting with the pattern's literal prefix are scanned, at most MAX_EXPANSION_SCAN of them,
+    #and the limit most frequent matches are returned
+    def expand(self, pattern, limit=MAX_EXPANSIONS):
+        wildcard = min((pattern.index(character) for character in WILDCARD_CHARACTERS if character in pattern),
+                       default=len(pattern))
+        prefix = pattern[:wildcard]
+        matcher = None if pattern[wildcard:] == "*" else re.compile(fnmatch.translate(pattern)).match
+        matches = []
+        for scanned, (i, term) in enumerate(self.terms_with_prefix(prefix)):
+            if scanned >= MAX_EXPANSION_SCAN:
+                break
+            if matcher is None or matcher(term):
+                matches.append((-self.entry(i)[2], term))
+        matches.sort()
+        return [term for _, term in matches[:limit]]
+
+#opens the dictionary at path if it was written for the index.db behind conn, otherwise returns None
+def open_term_dictionary(conn, path):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        c = conn.cursor()
+        c.execute('SELECT stamp FROM term_dictionary')
+        row = c.fetchone()
+    except sqlite3.OperationalError:
+        return None
+    dictionary = TermDictionary(path)
+    if row is None or row[0] != dictionary.stamp:
+        dictionary.close()
+        return None
+    return dictionary
+
+def is_wildcard(word):
+    return any(character in word for character in WILDCARD_CHARACTERS)
+
+#query terms of a query with wildcards: each word with * or ? is replaced by its expansions, the other words are
+#normalized like normalize_query
+def expand_query(dictionary, query, lemmas=None):
+    from QueryRuntime import normalize_query
+    terms = []
+    for word in query.split():
+        if is_wildcard(word):
+            pattern = re.sub(r"[^a-z*?]", "", word.lower())
+            if pattern.strip(WILDCARD_CHARACTERS):
+                terms.extend(dictionary.expand(pattern))
+        else:
+            terms.extend(normalize_query(word, lemmas))
+    return terms
+
+#compares the startup time and lookup latency of terms.dict with the dictionary index.bin loads when opened
+def main():
+    index_path = sys.argv[1] if len(sys.argv) > 1 else 'index.db'
+    dictionary_path = os.path.join(os.path.dirname(index_path), 'terms.dict')
+    binary_index_path = os.path.join(os.path.dirname(index_path), 'index.bin')
+    conn = sqlite3.connect(index_path)
+
+    start = time.perf_counter()
+    dictionary = open_term_dictionary(conn, dictionary_path)
+    print(f"terms.dict: opened in {(time.perf_counter() - start) * 1000:.2f} ms")
+    if dictionary is None:
+        print("terms.dict is missing or was written for another index.db")
+        return
+    print(f"{len(dictionary)} terms, {os.path.getsize(dictionary_path) / 1000:.0f} kb")
+    if os.path.exists(binary_index_path):
+        from BinaryIndex import BinaryIndexReader
+        start = time.perf_counter()
+        BinaryIndexReader(binary_index_path).close()
+        print(f"index.bin: opened in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    terms = [dictionary.term_at(i).decode('utf-8') for i in range(0, len(dictionary), max(len(dictionary) // 1000, 1))]
+    start = time.perf_counter()
+    for term in terms:
+        dictionary.row_range(term)
+    print(f"Exact lookup: {(time.perf_counter() - start) / len(terms) * 1e6:.1f} us")
+
+    c = conn.cursor()
+    start = time.perf_counter()
+    for term in terms[:20]:
+        c.execute('SELECT doc_id, nweight FROM final_postings WHERE token = ?', (term,))
+        c.fetchall()
+    scan = (time.perf_counter() - start) / min(len(terms), 20) * 1000
+    start = time.perf_counter()
+    for term in terms[:20]:
+        c.execute('SELECT doc_id, nweight FROM final_postings WHERE rowid BETWEEN ? AND ?', dictionary.row_range(term))
+        c.fetchall()
+    ranged = (time.perf_counter() - start) / min(len(terms), 20) * 1000
+    print(f"Postings fetch: {scan:.2f} ms by token, {ranged:.2f} ms by rowid range")
+
+    for term in terms[:3]:
+        pattern = term[:max(len(term) // 2, 1)] + "*"
+        print(f"{pattern}: {dictionary.expand(pattern)[:10]}")
+    dictionary.close()
+    conn.close()
+
+if __name__ == "__main__":
+    main()
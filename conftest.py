@@ -0,0 +1,70 @@
+import os
+import sys
+import shutil
+import sqlite3
+import contextlib
+import pytest
+import Benchmark
+import CreateInvertedIndex
+
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DOCUMENTS = 60
+CORPUS_FOLDER_SIZE = 20
+
+#runs in directory with stopwords.txt next to it, like the indexer and the query side expect
+@contextlib.contextmanager
+def working_directory(directory):
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.exists(os.path.join(directory, "stopwords.txt")):
+        shutil.copy(os.path.join(REPO_DIRECTORY, "stopwords.txt"), directory)
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield directory
+    finally:
+        os.chdir(previous)
+
+#runs CreateInvertedIndex.py with args in directory and returns the directory
+def run_indexer(directory, *args):
+    argv = sys.argv
+    sys.argv = ["CreateInvertedIndex.py", *args]
+    try:
+        with working_directory(directory):
+            CreateInvertedIndex.main()
+    finally:
+        sys.argv = argv
+    return directory
+
+#returns every row of table in a stable order, leaving out the columns in exclude
+#floats are rounded, since the builds may add the same weights in a different order
+def table_rows(path, table, exclude=("posting_id",)):
+    conn = sqlite3.connect(path)
+    try:
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in exclude)
+        rows = conn.execute(f"SELECT {columns} FROM {table} ORDER BY {columns}").fetchall()
+    finally:
+        conn.close()
+    return [tuple(round(value, 9) if isinstance(value, float) else value for value in row) for row in rows]
+
+#a small WEBPAGES_RAW folder of CORPUS_DOCUMENTS generated pages in folders of CORPUS_FOLDER_SIZE
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    folder_size = Benchmark.FILES_PER_FOLDER
+    Benchmark.FILES_PER_FOLDER = CORPUS_FOLDER_SIZE
+    try:
+        return Benchmark.generate_corpus(str(tmp_path_factory.mktemp("corpus") / "WEBPAGES_RAW"),
+                                         CORPUS_DOCUMENTS, seed=1, vocabulary_size=400)
+    finally:
+        Benchmark.FILES_PER_FOLDER = folder_size
+
+#build_index(*args) indexes the corpus with the indexer options args and returns the build directory
+#builds are shared by the whole session, so a test that changes the files must work on a copy
+@pytest.fixture(scope="session")
+def build_index(corpus, tmp_path_factory):
+    builds = {}
+
+    def build(*args):
+        if args not in builds:
+            builds[args] = run_indexer(str(tmp_path_factory.mktemp("build")), corpus, *args)
+        return builds[args]
+    return build
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import pytest
+from test_top_k import make_index, make_queries
+from BinaryIndex import BinaryIndexReader
+from QueryEngine import QueryEngine
+from QueryRuntime import compute_cosine_similarity
+
+pytest.importorskip("numpy")
+from BatchQuery import batch_search
+
+@pytest.fixture(scope="module")
+def index_directory(build_index):
+    return build_index("--build", "sql", "--binary-index")
+
+#a batch answers every query like the single-query path, also when the queries span several batches and repeat
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+@pytest.mark.parametrize("k", [1, 5, 1000])
+def test_batch_search_matches_single_queries(index_directory, batch_size, k):
+    conn = sqlite3.connect(os.path.join(index_directory, "index.db"))
+    queries = make_queries(conn)
+    queries += queries[:3]
+    with BinaryIndexReader(os.path.join(index_directory, "index.bin")) as reader:
+        for index in (conn, reader):
+            results = batch_search(index, queries, k, batch_size)
+            assert len(results) == len(queries)
+            for query, (top, total_matches, exact) in zip(queries, results):
+                ranking = compute_cosine_similarity(index, query)
+                assert top == ranking[:k], query
+                assert total_matches == len(ranking) and exact, query
+    conn.close()
+
+def test_batch_search_breaks_ties_by_doc_id():
+    postings = [("cat", doc_id, 0.5) for doc_id in (9, 3, 7, 1, 5)] + [("dog", doc_id, 0.5) for doc_id in (8, 2)]
+    conn = make_index(postings, 10)
+    for k in range(1, 8):
+        (top, _, _), = batch_search(conn, ["cat dog"], k)
+        assert top == compute_cosine_similarity(conn, "cat dog")[:k]
+
+#QueryEngine.search_batch scores the queries missing from its result cache in one batch, with exact totals where
+#search() may estimate them, and caches the results for search()
+def test_query_engine_search_batch(index_directory):
+    engine = QueryEngine(os.path.join(index_directory, "index.db"))
+    queries = make_queries(engine.conn)
+    expected = [engine.search(query, 5) for query in queries]
+    engine.result_cache.clear()
+    results = engine.search_batch(queries, 5)
+    for (top, total_matches, exact), (expected_top, _, _), query in zip(results, expected, queries):
+        assert top == expected_top
+        assert total_matches == len(compute_cosine_similarity(engine, query)) and exact
+    assert [engine.search(query, 5) for query in queries] == results
+    engine.close()
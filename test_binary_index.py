@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import pytest
+from BinaryIndex import BinaryIndexReader, encode_varbyte, decode_varbyte, WEIGHT_LEVELS
+
+@pytest.fixture(scope="module")
+def binary_build(build_index):
+    return build_index("--build", "sql", "--binary-index")
+
+#returns {token: [(doc_id, nweight, [positions])]} of index.db's final_postings
+def read_postings(index_path):
+    conn = sqlite3.connect(index_path)
+    postings = {}
+    rows = conn.execute('SELECT token, doc_id, positions, nweight FROM final_postings')
+    for token, doc_id, positions, nweight in rows:
+        postings.setdefault(token, []).append((doc_id, nweight, [int(i) for i in positions.split()]))
+    conn.close()
+    return postings
+
+def test_varbyte_round_trip():
+    values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 31, 2 ** 40 + 5]
+    encoded = bytearray()
+    for value in values:
+        encode_varbyte(value, encoded)
+    decoded = []
+    offset = 0
+    while offset < len(encoded):
+        value, offset = decode_varbyte(encoded, offset)
+        decoded.append(value)
+    assert decoded == values
+    assert len(encoded) == 1 + 1 + 1 + 2 + 2 + 2 + 3 + 5 + 6
+
+#index.bin holds every posting of index.db: the same doc ids and positions, and weights within the 16-bit
+#quantization step of their term
+def test_binary_index_round_trips_final_postings(binary_build):
+    expected = read_postings(os.path.join(binary_build, "index.db"))
+    with BinaryIndexReader(os.path.join(binary_build, "index.bin")) as reader:
+        assert set(reader.terms()) == set(expected)
+        conn = sqlite3.connect(os.path.join(binary_build, "index.db"))
+        document_count = conn.execute('SELECT COUNT(DISTINCT doc_id) FROM final_postings').fetchone()[0]
+        conn.close()
+        assert reader.document_count() == document_count
+
+        for term, rows in expected.items():
+            weights = [weight for _, weight, _ in rows]
+            tolerance = (max(weights) - min(weights)) / WEIGHT_LEVELS + 1e-6
+            assert reader.document_frequency(term) == len(rows)
+
+            docs, _, _ = reader.doc_postings(term)
+            assert docs == sorted(docs)
+            assert sorted((doc, positions) for doc, positions in reader.positional_postings(term)) == \
+                sorted((doc, positions) for doc, _, positions in rows)
+
+            decoded = sorted(reader.postings(term))
+            assert len(decoded) == len(rows)
+            for (doc, weight), (expected_doc, expected_weight) in zip(decoded, sorted(row[:2] for row in rows)):
+                assert doc == expected_doc
+                assert weight == pytest.approx(expected_weight, abs=tolerance)
+
+            #max_weight bounds the score any one document gets from the term, as the top-k search needs
+            scores = {}
+            for doc, weight in decoded:
+                scores[doc] = scores.get(doc, 0) + weight
+            assert reader.max_weight(term) >= max(scores.values()) - 1e-12
+
+        assert reader.postings("notaterm") == []
+        assert "notaterm" not in reader
@@ -0,0 +1,22 @@
+import os
+import importlib.util
+import pytest
+from conftest import table_rows
+
+COMPARED_TABLES = ["final_postings", "term_stats", "documents", "query_lemmas"]
+needs_numpy = pytest.mark.skipif(importlib.util.find_spec("numpy") is None, reason="NumPy is not installed")
+
+#every build must produce the index the sql build does, whatever it keeps in memory or on disk along the way
+#a memory budget of 0 flushes a run after every document, so the merge has to combine many runs per token
+@pytest.mark.parametrize("args", [
+    ("--build", "spimi"),
+    ("--build", "spimi", "--memory-budget", "0"),
+    pytest.param(("--build", "vectorized"), marks=needs_numpy),
+    pytest.param(("--build", "vectorized", "--workers", "3"), marks=needs_numpy),
+], ids=" ".join)
+def test_build_matches_sql_build(build_index, args):
+    expected = os.path.join(build_index("--build", "sql"), "index.db")
+    built = os.path.join(build_index(*args), "index.db")
+    for table in COMPARED_TABLES:
+        assert table_rows(built, table) == table_rows(expected, table), table
+    assert len(table_rows(built, "final_postings")) > 1000
@@ -0,0 +1,132 @@
+import os
+import shutil
+import sqlite3
+import pytest
+import BulkIndexer
+from conftest import run_indexer, table_rows
+from DocumentStore import DocumentStoreReader
+from TermDictionary import open_term_dictionary
+
+COMPARED_TABLES = ["final_postings", "term_stats", "documents", "query_lemmas"]
+INDEX_FILES = ["index.db", "terms.dict", "docstore.bin", "index.bin"]
+
+#stands in for the build being killed; like a KeyboardInterrupt it is not an Exception
+class Killed(BaseException):
+    pass
+
+#kills the build when it records phase, i.e. at the end of the transaction of the phase before it
+def kill_at_phase(monkeypatch, phase):
+    set_phase = BulkIndexer.set_phase
+
+    def patched(c, next_phase):
+        if next_phase == phase:
+            raise Killed(phase)
+        set_phase(c, next_phase)
+    monkeypatch.setattr(BulkIndexer, "set_phase", patched)
+
+#kills the build while it tokenizes the document after the first `documents` ones
+def kill_after_documents(monkeypatch, documents):
+    number_postings = BulkIndexer.number_postings
+    calls = []
+
+    def patched(*args):
+        calls.append(None)
+        if len(calls) > documents:
+            raise Killed("tokenize")
+        return number_postings(*args)
+    monkeypatch.setattr(BulkIndexer, "number_postings", patched)
+
+def build_phase(directory):
+    conn = sqlite3.connect(os.path.join(directory, "index.db.building"))
+    phase = BulkIndexer.current_phase(conn)
+    folders = conn.execute('SELECT COUNT(*) FROM build_folders').fetchone()[0]
+    conn.close()
+    return phase, folders
+
+def read_document_store(directory):
+    conn = sqlite3.connect(os.path.join(directory, "index.db"))
+    doc_keys = [doc_key for doc_key, in conn.execute('SELECT doc_key FROM documents')]
+    conn.close()
+    with DocumentStoreReader(os.path.join(directory, "docstore.bin")) as store:
+        return store.get_many(doc_keys)
+
+def assert_same_index(directory, expected):
+    for table in COMPARED_TABLES:
+        assert table_rows(os.path.join(directory, "index.db"), table) == \
+            table_rows(os.path.join(expected, "index.db"), table), table
+    conn = sqlite3.connect(os.path.join(directory, "index.db"))
+    dictionary = open_term_dictionary(conn, os.path.join(directory, "terms.dict"))
+    assert dictionary is not None and len(dictionary) == len(table_rows(os.path.join(expected, "index.db"),
+                                                                        "term_stats"))
+    dictionary.close()
+    conn.close()
+    assert read_document_store(directory) == read_document_store(expected)
+    assert not [name for name in os.listdir(directory) if name.endswith(".building")]
+
+@pytest.mark.parametrize("workers", ["1", "3"])
+def test_bulk_build_matches_sql_build(build_index, workers):
+    assert_same_index(build_index("--build", "bulk", "--workers", workers), build_index("--build", "sql"))
+
+#a build killed in any phase keeps the phases before it, and resuming it gives the index of an uninterrupted build
+#(kill_after_documents stops it in the second subfolder it reads, so one subfolder is checkpointed)
+@pytest.mark.parametrize("workers", ["1", "3"])
+@pytest.mark.parametrize("kill, resumed_phase", [
+    (lambda monkeypatch: kill_after_documents(monkeypatch, 25), ("tokenize", 1)),
+    (lambda monkeypatch: kill_at_phase(monkeypatch, "weight"), ("tokenize", 3)),
+    (lambda monkeypatch: kill_at_phase(monkeypatch, "normalize"), ("weight", 3)),
+    (lambda monkeypatch: kill_at_phase(monkeypatch, "term_stats"), ("normalize", 3)),
+    (lambda monkeypatch: kill_at_phase(monkeypatch, "finish"), ("term_stats", 3)),
+], ids=["tokenize", "weight", "normalize", "term_stats", "finish"])
+def test_killed_bulk_build_resumes(build_index, corpus, tmp_path, monkeypatch, workers, kill, resumed_phase):
+    directory = str(tmp_path)
+    with monkeypatch.context() as patch:
+        kill(patch)
+        with pytest.raises(Killed):
+            run_indexer(directory, corpus, "--build", "bulk", "--workers", workers)
+    assert build_phase(directory) == resumed_phase
+    assert not os.path.exists(os.path.join(directory, "index.db"))
+
+    run_indexer(directory, corpus, "--build", "bulk", "--workers", workers)
+    assert_same_index(directory, build_index("--build", "sql"))
+
+def file_contents(directory, names=INDEX_FILES):
+    contents = {}
+    for name in names:
+        with open(os.path.join(directory, name), "rb") as index_file:
+            contents[name] = index_file.read()
+    return contents
+
+#index.db, terms.dict, docstore.bin and index.bin are replaced together: a killed build leaves the previous index
+#as it was, and the finished one replaces all of it, removing an index.bin it did not write
+def test_bulk_build_publishes_atomically(build_index, corpus, tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    previous = build_index("--build", "sql", "--binary-index")
+    for name in INDEX_FILES:
+        shutil.copy(os.path.join(previous, name), directory)
+    published = file_contents(directory)
+
+    with monkeypatch.context() as patch:
+        kill_at_phase(patch, "finish")
+        with pytest.raises(Killed):
+            run_indexer(directory, corpus, "--build", "bulk")
+    assert file_contents(directory) == published
+    assert os.path.exists(os.path.join(directory, "terms.dict.building"))
+
+    #killed between renaming the other files and index.db: index.db is still the previous one, the stale index.bin
+    #is already gone, and the rerun finishes publishing the same build
+    replace = os.replace
+
+    def kill_before_index_db(source, target):
+        if target == "index.db":
+            raise Killed("publish")
+        replace(source, target)
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "replace", kill_before_index_db)
+        with pytest.raises(Killed):
+            run_indexer(directory, corpus, "--build", "bulk")
+    assert file_contents(directory, ["index.db"])["index.db"] == published["index.db"]
+    assert not os.path.exists(os.path.join(directory, "index.bin"))
+
+    run_indexer(directory, corpus, "--build", "bulk")
+    assert not os.path.exists(os.path.join(directory, "index.bin"))
+    assert_same_index(directory, build_index("--build", "sql"))
@@ -0,0 +1,91 @@
+import io
+import os
+import json
+import tarfile
+import zipfile
+import pytest
+import CorpusSources
+from conftest import run_indexer, table_rows
+from CorpusSources import Bookkeeping, iter_json_object, load_bookkeeping, open_corpus
+
+BOOKKEEPING = {
+    "0/1": "www.example.com/a",
+    "0/10": "www.example.com/café \"quoted\" \\ back\\slash",
+    "1/2": "www.example.com/☃/😀",
+    "1/3": "",
+    "2/0": "www.example.com/tab\there\nnewline",
+    "kéy/1": "www.example.com/plain",
+}
+
+#the streaming parser reads the pairs json.load does, whatever the chunk size and formatting
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+@pytest.mark.parametrize("dump", [
+    lambda data: json.dumps(data),
+    lambda data: json.dumps(data, ensure_ascii=False),
+    lambda data: json.dumps(data, indent=4),
+    lambda data: "\ufeff" + json.dumps(data, separators=(",", ":")),
+], ids=["ascii", "utf8", "indented", "bom"])
+def test_iter_json_object_matches_json_load(chunk_size, dump):
+    data = dict(BOOKKEEPING)
+    data.update({"number": 1.5e-3, "integer": 12345678901234567890, "list": [1, {"a": None}], "flag": True})
+    text = dump(data).encode("utf-8")
+    assert list(iter_json_object(io.BytesIO(text), chunk_size)) == list(data.items())
+
+@pytest.mark.parametrize("text", [b"{}", b"  { }  ", b'{"a": "b"}'])
+def test_iter_json_object_small_objects(text):
+    assert dict(iter_json_object(io.BytesIO(text), 1)) == json.loads(text)
+
+@pytest.mark.parametrize("text", [b"", b"[]", b'{"a": "b"', b'{"a" "b"}', b'{"a": "b",}', b'{"a": 1.}', b"{a: 1}"])
+def test_iter_json_object_rejects_malformed_json(text):
+    with pytest.raises(ValueError):
+        list(iter_json_object(io.BytesIO(text), 2))
+
+#pairs are sorted in runs that are then merged; the result must not depend on the run size
+@pytest.mark.parametrize("run_size", [1, 3, 100000])
+def test_bookkeeping_lookups(monkeypatch, run_size):
+    monkeypatch.setattr(CorpusSources, "BOOKKEEPING_RUN_SIZE", run_size)
+    pairs = [(f"{i % 13}/{i}", f"www.example.com/{i}") for i in range(200)]
+    bookkeeping = Bookkeeping(reversed(pairs))
+    assert len(bookkeeping) == len(pairs)
+    assert list(bookkeeping.items()) == sorted(pairs)
+    assert list(bookkeeping) == sorted(doc_key for doc_key, _ in pairs)
+    for doc_key, url in pairs:
+        assert bookkeeping[doc_key] == url
+        assert bookkeeping.get(doc_key) == url
+    assert bookkeeping.get("no/such") is None
+    assert bookkeeping.get(None, "default") == "default"
+    with pytest.raises(KeyError):
+        bookkeeping["no/such"]
+
+def test_load_bookkeeping(monkeypatch):
+    monkeypatch.setattr(CorpusSources, "BOOKKEEPING_RUN_SIZE", 2)
+    bookkeeping = load_bookkeeping(io.BytesIO(json.dumps(BOOKKEEPING).encode("utf-8")))
+    assert dict(bookkeeping.items()) == BOOKKEEPING
+
+#writes the corpus folder into an archive under a WEBPAGES_RAW root and returns its path
+def write_archive(corpus, path):
+    names = sorted(os.path.relpath(os.path.join(root, name), corpus)
+                   for root, _, files in os.walk(corpus) for name in files)
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in names:
+                archive.write(os.path.join(corpus, name), "WEBPAGES_RAW/" + name)
+    else:
+        with tarfile.open(path, "w:gz" if path.endswith("gz") else "w") as archive:
+            for name in names:
+                archive.add(os.path.join(corpus, name), "WEBPAGES_RAW/" + name)
+    return path
+
+#a corpus indexed straight from an archive gives the index of the extracted folder
+@pytest.mark.parametrize("archive_name", ["corpus.tar", "corpus.tgz", "corpus.zip"])
+def test_index_from_archive(build_index, corpus, tmp_path, archive_name):
+    archive = write_archive(corpus, str(tmp_path / archive_name))
+    source = open_corpus(archive)
+    assert sorted(source.doc_keys()) == sorted(open_corpus(corpus).doc_keys())
+    assert dict(source.read_bookkeeping().items()) == dict(open_corpus(corpus).read_bookkeeping().items())
+
+    directory = build_index("--build", "sql")
+    built = run_indexer(str(tmp_path / "build"), archive, "--build", "sql")
+    for table in ["final_postings", "term_stats", "documents"]:
+        assert table_rows(os.path.join(built, "index.db"), table) == \
+            table_rows(os.path.join(directory, "index.db"), table), table
@@ -0,0 +1,41 @@
+import os
+import re
+import sqlite3
+from DocumentStore import DocumentStoreReader
+from QueryEngine import QueryEngine
+
+TITLE = re.compile(r"<title>(.*?)</title>")
+
+#docstore.bin has the title of every indexed page, read back in one bulk lookup
+def test_document_store_has_every_document(build_index, corpus):
+    directory = build_index("--build", "sql")
+    conn = sqlite3.connect(os.path.join(directory, "index.db"))
+    doc_keys = [doc_key for doc_key, in conn.execute('SELECT doc_key FROM documents')]
+    conn.close()
+    with DocumentStoreReader(os.path.join(directory, "docstore.bin")) as store:
+        assert len(store) == len(doc_keys)
+        records = store.get_many(doc_keys)
+        assert set(records) == set(doc_keys)
+        for doc_key in doc_keys[:10]:
+            with open(os.path.join(corpus, *doc_key.split("/")), encoding="utf-8") as page:
+                assert records[doc_key]["title"] == TITLE.search(page.read()).group(1)
+            assert store.get(doc_key) == records[doc_key]
+        assert store.get("no/such-document") is None
+
+#docstore.bin is found next to index.db, not in the directory the engine was started from
+def test_query_engine_finds_document_store_next_to_index(build_index, tmp_path, monkeypatch):
+    directory = build_index("--build", "sql")
+    monkeypatch.chdir(tmp_path)
+    engine = QueryEngine(os.path.join(directory, "index.db"))
+    results, _, _ = engine.search("ananlu pralu", 5)
+    doc_ids = [doc_id for doc_id, _ in results]
+    infos = engine.document_info(doc_ids)
+    with DocumentStoreReader(os.path.join(directory, "docstore.bin")) as store:
+        records = store.get_many(engine.document_keys(doc_ids).values())
+    assert len(infos) == len(doc_ids) == 5
+    assert sorted(info["title"] for info in infos.values()) == sorted(record["title"] for record in records.values())
+    engine.close()
+
+    engine = QueryEngine(os.path.join(directory, "index.db"), document_store_path='')
+    assert engine.document_info(doc_ids) == {}
+    engine.close()
@@ -0,0 +1,77 @@
+import os
+import json
+import multiprocessing
+import pytest
+import CreateInvertedIndex
+from CreateInvertedIndex import run_serial_pipeline, run_parallel_pipeline, TOKENIZERS
+from CorpusSources import DirectorySource
+
+PAGE = """<html><head><title>Page {folder}/{file} &amp; friends</title>
+<meta name="description" content="description of page {folder}/{file}"></head>
+<body><h1>Heading {file}</h1><div><div><div><p>some <b>bold</b> text about cats and dogs {file}</p>
+<a href="www.example.com/{folder}/{next}">the next page</a></div></div></div></body></html>"""
+
+#writes a WEBPAGES_RAW folder of folders x files pages that all have a <title> and returns its path
+def write_corpus(directory, folders=2, files=20):
+    corpus = os.path.join(directory, "WEBPAGES_RAW")
+    bookkeeping = {}
+    for folder in range(folders):
+        os.makedirs(os.path.join(corpus, str(folder)))
+        for file in range(files):
+            with open(os.path.join(corpus, str(folder), str(file)), "w", encoding="utf-8") as page:
+                page.write(PAGE.format(folder=folder, file=file, next=(file + 1) % files))
+            bookkeeping[f"{folder}/{file}"] = f"www.example.com/{folder}/{file}"
+    with open(os.path.join(corpus, "bookkeeping.json"), "w") as bookkeeping_file:
+        json.dump(bookkeeping, bookkeeping_file)
+    return corpus
+
+def run_pipeline(corpus, tokenizer, num_workers=None):
+    source = DirectorySource(corpus)
+    url_dict = source.read_bookkeeping()
+    results = []
+    sink = lambda doc_id, postings_dict, doc_info: results.append((doc_id, postings_dict, doc_info))
+    if num_workers:
+        run_parallel_pipeline(source.documents(), url_dict, sink, num_workers, tokenizer=tokenizer)
+    else:
+        run_serial_pipeline(source.documents(), url_dict, sink, tokenizer=tokenizer)
+    return results
+
+#every doc_info crosses a process boundary in the parallel build, so its title must be a plain str and the
+#results must be the ones the serial build gets
+@pytest.mark.parametrize("tokenizer", TOKENIZERS)
+def test_parallel_build_with_titles(tmp_path, tokenizer):
+    corpus = write_corpus(str(tmp_path))
+    parallel = run_pipeline(corpus, tokenizer, num_workers=3)
+    assert parallel == run_pipeline(corpus, tokenizer)
+    assert len(parallel) == 40
+    for doc_id, _, doc_info in parallel:
+        assert type(doc_info["title"]) is str
+        assert doc_info["title"] == f"Page {doc_id} & friends"
+
+#the workers inherit a patched process_document only when they are forked
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="workers are not forked")
+
+def process_document_failing_on(doc_id, failure):
+    process_document = CreateInvertedIndex.process_document
+
+    def patched(file_path, *args):
+        result, is_valid = process_document(file_path, *args)
+        if result[0] == doc_id:
+            return failure(result), is_valid
+        return result, is_valid
+    return patched
+
+def kill_worker(result):
+    os._exit(1)
+
+def unpicklable(result):
+    return result[0], result[1], {"title": lambda: None}
+
+#a worker that dies, or a result that cannot be sent, must fail the build instead of hanging the writer
+@needs_fork
+@pytest.mark.parametrize("failure", [kill_worker, unpicklable])
+def test_parallel_build_fails_when_a_result_is_lost(tmp_path, monkeypatch, failure):
+    corpus = write_corpus(str(tmp_path))
+    monkeypatch.setattr(CreateInvertedIndex, "process_document", process_document_failing_on("1/5", failure))
+    with pytest.raises(RuntimeError):
+        run_pipeline(corpus, TOKENIZERS[0], num_workers=3)
@@ -0,0 +1,151 @@
+import os
+import shutil
+import sqlite3
+import pytest
+from conftest import working_directory
+from BinaryIndex import BinaryIndexReader
+from QueryEngine import QueryEngine
+from SegmentIndex import update_segments, segment_path, SegmentedIndex
+from TermDictionary import open_term_dictionary
+from PositionalQuery import (parse_query, positional_search, evaluate_positional_query, SQLitePositionSource,
+                             PROXIMITY_WEIGHT)
+
+#returns {doc: {term: sorted positions}} of (token, doc, positions TEXT) rows
+def read_positions(rows):
+    documents = {}
+    for token, doc, positions in rows:
+        documents.setdefault(doc, {}).setdefault(token, []).extend(int(i) for i in positions.split())
+    for terms in documents.values():
+        for positions in terms.values():
+            positions.sort()
+    return documents
+
+#the documents that satisfy every clause, found by trying every position
+def brute_force_matches(documents, clauses):
+    matches = set()
+    for doc, terms in documents.items():
+        for clause in clauses:
+            if clause[0] == 'phrase':
+                (first, first_offset), *rest = clause[1]
+                if not any(all(position - first_offset + offset in terms.get(term, ())
+                               for term, offset in rest) for position in terms.get(first, ())):
+                    break
+            else:
+                _, left, right, window = clause
+                if not any(abs(a - b) <= window for a in terms.get(left, ()) for b in terms.get(right, ())):
+                    break
+        else:
+            matches.add(doc)
+    return matches
+
+#phrase and NEAR/k queries over word pairs that occur in the corpus, at several distances, and pairs in reverse
+def make_queries(documents):
+    queries = []
+    for doc in sorted(documents)[:6]:
+        at = {position: term for term, positions in documents[doc].items() for position in positions}
+        starts = sorted(at)
+        for start in starts[::max(len(starts) // 4, 1)][:4]:
+            if start + 1 in at:
+                queries.append(f'"{at[start]} {at[start + 1]}"')
+                queries.append(f'"{at[start + 1]} {at[start]}"')
+            if start + 1 in at and start + 2 in at:
+                queries.append(f'"{at[start]} {at[start + 1]} {at[start + 2]}"')
+            if start + 3 in at:
+                queries.append(f'{at[start]} NEAR/3 {at[start + 3]}')
+                queries.append(f'{at[start]} NEAR/1 {at[start + 3]}')
+                queries.append(f'"{at[start]} {at[start + 1]}" {at[start]} NEAR/2 {at[start + 3]}')
+    return queries
+
+def check_positional_queries(documents, queries, search, lemmas=None):
+    matched = 0
+    for query in queries:
+        terms, clauses = parse_query(query, lemmas)
+        assert clauses, query
+        expected = brute_force_matches(documents, clauses)
+        results, total_matches, exact = search(query, terms, clauses)
+        assert {doc for doc, _ in results} == expected, query
+        assert total_matches == len(expected) and exact, query
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True), query
+        matched += len(expected)
+    return matched
+
+@pytest.fixture(scope="module")
+def index_directory(build_index):
+    return build_index("--build", "sql", "--binary-index")
+
+@pytest.fixture(scope="module")
+def index_documents(index_directory):
+    conn = sqlite3.connect(os.path.join(index_directory, "index.db"))
+    documents = read_positions(conn.execute('SELECT token, doc_id, positions FROM final_postings'))
+    conn.close()
+    return documents
+
+def test_positional_queries_on_index_db(index_directory, index_documents):
+    queries = make_queries(index_documents)
+    conn = sqlite3.connect(os.path.join(index_directory, "index.db"))
+    search = lambda query, terms, clauses: positional_search(conn, query, 1000)
+    assert check_positional_queries(index_documents, queries, search) > len(queries)
+
+    #with terms.dict the rows of a term are read by rowid range
+    dictionary = open_term_dictionary(conn, os.path.join(index_directory, "terms.dict"))
+    assert dictionary is not None
+    source = SQLitePositionSource(conn, dictionary)
+    search = lambda query, terms, clauses: evaluate_positional_query(conn, source, terms, clauses, 1000)
+    check_positional_queries(index_documents, queries, search)
+    conn.close()
+
+def test_positional_queries_on_index_bin(index_directory, index_documents):
+    queries = make_queries(index_documents)
+    with BinaryIndexReader(os.path.join(index_directory, "index.bin")) as reader:
+        search = lambda query, terms, clauses: positional_search(reader, query, 1000)
+        assert check_positional_queries(index_documents, queries, search) > len(queries)
+
+    engine = QueryEngine(os.path.join(index_directory, "index.db"),
+                         binary_index_path=os.path.join(index_directory, "index.bin"))
+    search = lambda query, terms, clauses: engine.search(query, 1000)
+    check_positional_queries(index_documents, queries, search, engine.lemmas)
+    engine.close()
+
+#a segmented index evaluates the clauses on the positions of its segments instead of ranking their terms as a bag
+#of words
+def test_positional_queries_on_segments(corpus, tmp_path):
+    segments = str(tmp_path / "segments")
+    with working_directory(str(tmp_path)):
+        shutil.copytree(corpus, str(tmp_path / "corpus"))
+        update_segments(str(tmp_path / "corpus"), segments)
+    index = SegmentedIndex(segments)
+    (name,), = index.catalog.execute('SELECT name FROM segments').fetchall()
+    conn = sqlite3.connect(segment_path(segments, name))
+    documents = read_positions(conn.execute('SELECT token, doc_id, positions FROM seg_postings'))
+    conn.close()
+    queries = make_queries(documents)
+
+    search = lambda query, terms, clauses: positional_search(index, query, 1000)
+    assert check_positional_queries(documents, queries, search) > len(queries)
+    index.close()
+
+    engine = QueryEngine(segments_path=segments)
+    search = lambda query, terms, clauses: engine.search(query, 1000)
+    check_positional_queries(documents, queries, search, engine.lemmas)
+    engine.close()
+
+#a phrase scores PROXIMITY_WEIGHT * (1 + log10(occurrences)) on top of the cosine score of its terms
+def test_phrase_bonus_is_added_to_the_cosine_score(index_directory, index_documents):
+    conn = sqlite3.connect(os.path.join(index_directory, "index.db"))
+    query = make_queries(index_documents)[0]
+    terms, clauses = parse_query(query)
+    results, _, _ = positional_search(conn, query, 1000)
+    assert clauses and results
+    for doc, score in results:
+        cosine = sum(weight for term in terms for weight, in
+                     conn.execute('SELECT nweight FROM final_postings WHERE token = ? AND doc_id = ?', (term, doc)))
+        assert score >= cosine + PROXIMITY_WEIGHT - 1e-9
+    conn.close()
+
+def test_clauses_without_positions_are_refused(index_directory):
+    conn = sqlite3.connect(os.path.join(index_directory, "index.db"))
+    terms, clauses = parse_query('"ananlu pralu"')
+    with pytest.raises(ValueError):
+        evaluate_positional_query(conn, None, terms, clauses)
+    conn.close()
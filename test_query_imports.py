@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import subprocess
+from conftest import REPO_DIRECTORY
+from QueryRuntime import HEAVY_MODULES
+
+#the indexer and its dependencies; the query side must start and answer a query without any of them
+INDEXING_MODULES = HEAVY_MODULES + ("CreateInvertedIndex", "CorpusSources", "urllib.request", "tarfile", "zipfile",
+                                    "multiprocessing")
+
+QUERY_SCRIPT = '''
+import sys, json
+import QueryEngine, SearchService, PositionalQuery, SegmentIndex
+engine = QueryEngine.QueryEngine({index_path!r})
+results, _, _ = engine.search("ananlu pralu", 5)
+phrase_results, _, _ = engine.search('"ananlu pralu"', 5)
+print(json.dumps({{"results": len(results), "loaded": sorted(name for name in {modules!r} if name in sys.modules)}}))
+'''
+
+#opening a QueryEngine and answering plain and phrase queries whose words are in index.db's query_lemmas table
+#runs in a fresh interpreter, so nothing the tests imported counts
+def test_query_side_does_not_import_the_indexer(build_index):
+    index_path = os.path.join(build_index("--build", "sql"), "index.db")
+    script = QUERY_SCRIPT.format(index_path=index_path, modules=INDEXING_MODULES)
+    output = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIRECTORY, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=REPO_DIRECTORY), check=True).stdout
+    report = json.loads(output.splitlines()[-1])
+    assert report["results"] == 5
+    assert report["loaded"] == []
@@ -0,0 +1,66 @@
+import os
+import json
+import asyncio
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from SearchService import SearchService
+
+@pytest.fixture(scope="module")
+def service_index(build_index):
+    return os.path.join(build_index("--build", "sql"), "index.db")
+
+#runs test(service, loop) with the slots and worker pool serve() would set up
+def run_service(service, test, slots=None):
+    async def run():
+        service.slots = asyncio.Semaphore(service.max_concurrent if slots is None else slots)
+        service.executor = ThreadPoolExecutor(service.workers)
+        try:
+            return await test(service, asyncio.get_running_loop())
+        finally:
+            service.executor.shutdown(wait=True)
+    return asyncio.run(run())
+
+#sends one GET request to the service's connection handler and returns (status code, json body)
+async def get(service, target):
+    server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+    async with server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(body)
+
+def test_search_over_http(service_index):
+    async def test(service, loop):
+        status, body = await get(service, "/search?q=ananlu+pralu&k=5")
+        assert status == 200
+        assert len(body["results"]) == 5
+        assert all(hit["doc_id"] and hit["path"] and hit["title"] for hit in body["results"])
+        scores = [hit["score"] for hit in body["results"]]
+        assert scores == sorted(scores, reverse=True)
+
+        assert (await get(service, "/search?q=ananlu&k=0"))[0] == 400
+        assert (await get(service, "/search?k=5"))[0] == 400
+        assert (await get(service, "/nothing"))[0] == 404
+        status, health = await get(service, "/health")
+        assert status == 200 and health["completed"] == 1
+    run_service(SearchService(service_index, workers=2), test)
+
+#a request whose deadline passed before it reached a slot timed out; it was not turned away for lack of slots
+def test_expired_deadline_is_a_timeout(service_index):
+    async def test(service, loop):
+        status, _ = await service.search("ananlu", 5, loop.time() - 1)
+        assert status == HTTPStatus.GATEWAY_TIMEOUT
+        assert service.timed_out == 1 and service.rejected == 0
+    run_service(SearchService(service_index), test)
+
+#a request that waits for a slot until its deadline is rejected with 503
+def test_no_free_slot_is_a_rejection(service_index):
+    async def test(service, loop):
+        status, _ = await service.search("ananlu", 5, loop.time() + 0.05)
+        assert status == HTTPStatus.SERVICE_UNAVAILABLE
+        assert service.rejected == 1 and service.timed_out == 0
+    run_service(SearchService(service_index), test, slots=0)
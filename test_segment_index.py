@@ -0,0 +1,68 @@
+import os
+import json
+import shutil
+import pytest
+import SegmentIndex
+from conftest import working_directory
+from SegmentIndex import update_segments, merge_segments, SegmentedIndex
+
+#makes directory hold the pages of doc_keys from corpus, with a bookkeeping.json of just those pages
+def copy_documents(corpus, directory, doc_keys):
+    with open(os.path.join(corpus, "bookkeeping.json")) as bookkeeping_file:
+        bookkeeping = json.load(bookkeeping_file)
+    for doc_key in doc_keys:
+        target = os.path.join(directory, *doc_key.split("/"))
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy(os.path.join(corpus, *doc_key.split("/")), target)
+    with open(os.path.join(directory, "bookkeeping.json"), "w") as bookkeeping_file:
+        json.dump({doc_key: bookkeeping[doc_key] for doc_key in doc_keys}, bookkeeping_file)
+
+def assert_same_postings(index, expected):
+    assert index.document_count() == expected.document_count()
+    terms = [token for token, in expected.catalog.execute('SELECT token FROM term_df')]
+    assert sorted(terms) == sorted(token for token, in index.catalog.execute('SELECT token FROM term_df'))
+    for term in terms:
+        postings = index.postings(term)
+        expected_postings = expected.postings(term)
+        assert [doc_id for doc_id, _ in postings] == [doc_id for doc_id, _ in expected_postings], term
+        assert [weight for _, weight in postings] == pytest.approx([weight for _, weight in expected_postings],
+                                                                   abs=1e-9), term
+
+#an index updated as the corpus grows, changes and shrinks must weight its postings like an index built from the
+#final corpus in one update: the norms of older segments are recomputed once the statistics have drifted
+def test_updated_segments_match_a_fresh_build(corpus, tmp_path, monkeypatch):
+    with open(os.path.join(corpus, "bookkeeping.json")) as bookkeeping_file:
+        doc_keys = sorted(json.load(bookkeeping_file))
+    live = str(tmp_path / "live")
+    segments = str(tmp_path / "segments")
+    with working_directory(str(tmp_path)):
+        copy_documents(corpus, live, doc_keys[:20])
+        assert update_segments(live, segments) == (20, 0, 0)
+        copy_documents(corpus, live, doc_keys[:40])
+        assert update_segments(live, segments) == (20, 0, 0)
+
+        os.remove(os.path.join(live, *doc_keys[3].split("/")))
+        with open(os.path.join(live, *doc_keys[5].split("/")), "a", encoding="utf-8") as page:
+            page.write("<p>" + " ".join(["ananlu"] * 30) + "</p>")
+        copy_documents(corpus, live, doc_keys[:3] + doc_keys[4:])
+        assert update_segments(live, segments) == (20, 1, 1)
+        assert update_segments(live, segments) == (0, 0, 0)
+
+        fresh = str(tmp_path / "fresh")
+        shutil.copytree(live, str(tmp_path / "final"))
+        update_segments(str(tmp_path / "final"), fresh)
+
+        expected = SegmentedIndex(fresh)
+        index = SegmentedIndex(segments)
+        assert_same_postings(index, expected)
+        index.close()
+
+        #the three segments are of one size tier, so a merge factor of 2 merges them
+        monkeypatch.setattr(SegmentIndex, "MERGE_FACTOR", 2)
+        assert merge_segments(segments) >= 1
+        index = SegmentedIndex(segments)
+        assert len(index.segments) < 3
+        assert_same_postings(index, expected)
+        index.close()
+        expected.close()
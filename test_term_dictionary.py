@@ -0,0 +1,98 @@
+import os
+import shutil
+import sqlite3
+import fnmatch
+import pytest
+from TermDictionary import (TermDictionary, open_term_dictionary, cluster_final_postings, create_final_postings_table,
+                            expand_query)
+
+#copies index.db and terms.dict of a build to directory, so the test can change them
+def copy_index(build_directory, directory):
+    for name in ("index.db", "terms.dict"):
+        shutil.copy(os.path.join(build_directory, name), directory)
+    return sqlite3.connect(os.path.join(directory, "index.db"))
+
+#the rows terms.dict points a term to must be exactly the rows of that token
+def assert_row_ranges_match(conn, dictionary):
+    tokens = [token for token, in conn.execute('SELECT DISTINCT token FROM final_postings ORDER BY token')]
+    assert len(dictionary) == len(tokens)
+    for token in tokens:
+        first, last = dictionary.row_range(token)
+        in_range = conn.execute('SELECT token, doc_id, positions, nweight FROM final_postings '
+                                'WHERE rowid BETWEEN ? AND ? ORDER BY rowid', (first, last)).fetchall()
+        by_token = conn.execute('SELECT token, doc_id, positions, nweight FROM final_postings '
+                                'WHERE token = ? ORDER BY rowid', (token,)).fetchall()
+        assert in_range == by_token, token
+
+#the sql build writes final_postings document by document, so the dictionary is written after clustering the table
+#and running VACUUM; posting_id is the rowid, so neither that VACUUM nor a later one moves the ranges
+@pytest.mark.parametrize("build", ["sql", "spimi"])
+def test_row_ranges_survive_vacuum(build_index, tmp_path, build):
+    conn = copy_index(build_index("--build", build), str(tmp_path))
+    dictionary = open_term_dictionary(conn, str(tmp_path / "terms.dict"))
+    assert dictionary is not None
+    assert_row_ranges_match(conn, dictionary)
+
+    conn.execute('DELETE FROM final_postings WHERE rowid IN (SELECT MIN(rowid) FROM final_postings GROUP BY token '
+                 'HAVING COUNT(*) > 1)')
+    conn.commit()
+    conn.execute('VACUUM')
+    for token, count in conn.execute('SELECT token, COUNT(*) FROM final_postings GROUP BY token'):
+        first, last = dictionary.row_range(token)
+        rows = conn.execute('SELECT token FROM final_postings WHERE rowid BETWEEN ? AND ?', (first, last)).fetchall()
+        assert rows == [(token,)] * count
+    dictionary.close()
+    conn.close()
+
+#clustering rewrites interleaved rows into one posting_id range per token and keeps every row
+def test_cluster_final_postings():
+    conn = sqlite3.connect(":memory:")
+    create_final_postings_table(conn.cursor())
+    rows = [(token, doc_id, f"{doc_id} {doc_id + 5}", doc_id / 10) for doc_id in range(1, 8) for token in "cab"]
+    conn.executemany('INSERT INTO final_postings (token, doc_id, positions, nweight) VALUES (?, ?, ?, ?)', rows)
+    conn.execute('DELETE FROM final_postings WHERE doc_id = 3')
+    conn.commit()
+
+    ranges = cluster_final_postings(conn)
+    assert [(token, count) for token, _, count in ranges] == [("a", 6), ("b", 6), ("c", 6)]
+    conn.execute('VACUUM')
+    for token, first, count in ranges:
+        assert conn.execute('SELECT token, doc_id, positions, nweight FROM final_postings '
+                            'WHERE rowid BETWEEN ? AND ?', (first, first + count - 1)).fetchall() == \
+            [row for row in rows if row[0] == token and row[1] != 3]
+    assert cluster_final_postings(conn) == ranges
+
+#a terms.dict is only used with the index.db it was written for
+def test_dictionary_of_another_build_is_not_used(build_index, tmp_path):
+    conn = copy_index(build_index("--build", "sql"), str(tmp_path))
+    assert open_term_dictionary(conn, os.path.join(build_index("--build", "spimi"), "terms.dict")) is None
+    assert open_term_dictionary(conn, str(tmp_path / "missing.dict")) is None
+    conn.close()
+
+def test_lookups_and_wildcards(build_index):
+    directory = build_index("--build", "sql")
+    conn = sqlite3.connect(os.path.join(directory, "index.db"))
+    term_stats = {token: (df, max_weight) for token, df, max_weight in
+                  conn.execute('SELECT token, df, max_weight FROM term_stats')}
+    terms = sorted(term_stats)
+    with TermDictionary(os.path.join(directory, "terms.dict")) as dictionary:
+        for term in terms:
+            assert term in dictionary
+            assert dictionary.document_frequency(term) == term_stats[term][0]
+            assert dictionary.max_weight(term) == pytest.approx(term_stats[term][1])
+        for missing in ("", "a", "zzzz", terms[0][:-1], terms[-1] + "z"):
+            assert (missing in dictionary) == (missing in term_stats)
+            if missing not in term_stats:
+                assert dictionary.row_range(missing) is None
+
+        for prefix in ("", "an", terms[5][:3], "zz"):
+            assert [term for _, term in dictionary.terms_with_prefix(prefix)] == \
+                [term for term in terms if term.startswith(prefix)]
+
+        #the most frequent matches are kept, ties in term order
+        for pattern in ("an*", "*lu", "pra?u", "an*o", "*", "?"):
+            matches = sorted(fnmatch.filter(terms, pattern), key=lambda term: (-term_stats[term][0], term))
+            assert dictionary.expand(pattern) == matches[:50], pattern
+            assert dictionary.expand(pattern, limit=3) == matches[:3], pattern
+        assert expand_query(dictionary, "AN* zzzz*") == dictionary.expand("an*")
+    conn.close()
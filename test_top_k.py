@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import pytest
+from BinaryIndex import BinaryIndexReader
+from QueryRuntime import compute_cosine_similarity, top_k_cosine_similarity
+
+#an index.db with only the tables the query side reads, for postings chosen by the test
+def make_index(postings, document_count):
+    conn = sqlite3.connect(":memory:")
+    conn.execute('CREATE TABLE documents (doc_id INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO documents VALUES (?)', [(doc_id,) for doc_id in range(1, document_count + 1)])
+    conn.execute('CREATE TABLE final_postings (token TEXT, doc_id INTEGER, nweight REAL)')
+    conn.executemany('INSERT INTO final_postings VALUES (?, ?, ?)', postings)
+    return conn
+
+def index_document_count(conn):
+    return conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+#queries over terms of every document frequency of the built index, with repeated and unknown terms
+def make_queries(conn):
+    tokens = [token for token, in conn.execute(
+        'SELECT token FROM final_postings GROUP BY token ORDER BY COUNT(DISTINCT doc_id) DESC, token')]
+    common, rare = tokens[:5], tokens[-5:]
+    middle = tokens[len(tokens) // 2:len(tokens) // 2 + 5]
+    return [" ".join(common[:2]), " ".join(common), " ".join(middle), " ".join(rare), common[0] + " " + rare[0],
+            " ".join([common[1], middle[0], middle[0], rare[1]]), middle[2] + " zzzznotaterm", "zzzznotaterm"]
+
+@pytest.fixture(scope="module")
+def indexes(build_index):
+    directory = build_index("--build", "sql", "--binary-index")
+    conn = sqlite3.connect(os.path.join(directory, "index.db"))
+    reader = BinaryIndexReader(os.path.join(directory, "index.bin"))
+    yield conn, reader, make_queries(conn)
+    reader.close()
+    conn.close()
+
+#WAND must return exactly the first k results of the exhaustive ranking, from index.db and from index.bin
+@pytest.mark.parametrize("k", [1, 3, 10, 1000])
+def test_top_k_matches_exhaustive_ranking(indexes, k):
+    conn, reader, queries = indexes
+    for index in (conn, reader):
+        for query in queries:
+            ranking = compute_cosine_similarity(index, query)
+            results, total_matches, exact = top_k_cosine_similarity(index, query, k)
+            assert results == ranking[:k], query
+            if exact:
+                assert total_matches == len(ranking), query
+            else:
+                assert len(results) <= total_matches <= index_document_count(conn), query
+            if k >= len(ranking):
+                assert exact and total_matches == len(ranking), query
+
+#documents with equal scores are ranked by doc_id, also when k cuts through them
+def test_top_k_breaks_ties_by_doc_id():
+    postings = [("cat", doc_id, 0.5) for doc_id in (9, 3, 7, 1, 5)] + [("dog", doc_id, 0.25) for doc_id in (2, 4, 6)]
+    postings += [("dog", doc_id, 0.5) for doc_id in (8, 10)]
+    conn = make_index(postings, 10)
+    ranking = compute_cosine_similarity(conn, "cat dog")
+    assert [doc_id for doc_id, _ in ranking] == [1, 3, 5, 7, 8, 9, 10, 2, 4, 6]
+    for k in range(1, 11):
+        assert top_k_cosine_similarity(conn, "cat dog", k)[0] == ranking[:k]
+
+#once the top k is full, documents that only contain low weight terms are skipped, so the total is estimated
+def test_top_k_estimates_the_total_when_it_skips():
+    postings = [("cat", doc_id, 0.9) for doc_id in (1, 2)]
+    postings += [("dog", doc_id, 0.1) for doc_id in range(3, 41)]
+    conn = make_index(postings, 100)
+    results, total_matches, exact = top_k_cosine_similarity(conn, "cat dog", 2)
+    assert results == compute_cosine_similarity(conn, "cat dog")[:2]
+    assert not exact
+    assert 38 <= total_matches <= 100
+
+    results, total_matches, exact = top_k_cosine_similarity(conn, "cat dog", 40)
+    assert exact and total_matches == 40 and len(results) == 40